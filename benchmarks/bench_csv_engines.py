@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing._ingest import CSV_ENGINES, read_csv
+
+# Columns and dtypes used to read food_nutrient.csv in the processors
+USECOLS = ['fdc_id', 'nutrient_id', 'amount']
+DTYPE = {'fdc_id': 'int32', 'nutrient_id': 'int32', 'amount': 'float32'}
+
+# ---------------------------------------------------------------------
+# ---- Parse command-line arguments ----
+# ---------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(
+    description='compare wall time and peak RSS of the CSV engines reading a food_nutrient.csv file.')
+parser.add_argument('--csv', default=None,
+                    help='path to a food_nutrient.csv file (default: generate a synthetic one)')
+parser.add_argument('--rows', type=int, default=5_000_000,
+                    help='number of rows of the synthetic food_nutrient.csv file (default: 5000000)')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='number of runs per engine, the fastest is reported (default: 3)')
+parser.add_argument('--child', default=None, choices=CSV_ENGINES,
+                    help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+
+def write_synthetic_food_nutrient(path, rows):
+    """
+    Write a synthetic food_nutrient.csv file with the same columns as the USDA file.
+
+    Parameters:
+        path (str): The path where the CSV file will be saved.
+        rows (int): The number of rows to write.
+
+    Returns:
+        None
+    """
+    rng = np.random.default_rng(0)
+
+    pd.DataFrame({
+        'id': np.arange(rows),
+        'fdc_id': np.sort(rng.integers(300000, 300000 + rows // 20, rows)),
+        'nutrient_id': rng.integers(1000, 1300, rows),
+        'amount': rng.random(rows).round(3) * 100,
+        'data_points': '',
+        'derivation_id': rng.integers(1, 80, rows),
+        'min': '',
+        'max': '',
+        'median': '',
+        'footnote': '',
+        'min_year_acquired': '',
+    }).to_csv(path, index=False)
+
+
+def peak_rss_mb():
+    """
+    Get the peak resident set size of the current process.
+
+    Returns:
+        peak_rss (float): The peak resident set size in MB.
+    """
+    # VmHWM is reset on exec, unlike ru_maxrss which keeps the peak of the parent process on Linux
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != 'darwin' else 1024 ** 2)
+
+
+# Run a single engine and report its timings (peak RSS is only meaningful in a fresh process)
+if args.child:
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    df = read_csv(args.csv, args.child, usecols=USECOLS,
+                  dtype=DTYPE, low_memory=False)
+
+    print(json.dumps({
+        'engine': args.child,
+        'rows': len(df),
+        'wall_s': round(time.perf_counter() - wall_start, 3),
+        'cpu_s': round(time.process_time() - cpu_start, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }))
+    sys.exit(0)
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    csv_path = args.csv
+
+    if csv_path is None:
+        csv_path = os.path.join(tmp_dir, 'food_nutrient.csv')
+        print(f'Writing synthetic food_nutrient.csv with {args.rows} rows:\n> {csv_path}\n')
+        write_synthetic_food_nutrient(csv_path, args.rows)
+
+    print(f'File size: {os.path.getsize(csv_path) / 1024 ** 2:.1f} MB\n')
+
+    for engine in CSV_ENGINES:
+        runs = [json.loads(subprocess.run([sys.executable, __file__, '--csv', csv_path, '--child', engine],
+                                          capture_output=True, text=True, check=True).stdout)
+                for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run['wall_s'])
+
+        print(f"{engine:>8}: {best['wall_s']:>7.2f} s wall, {best['cpu_s']:>7.2f} s cpu, "
+              f"{best['peak_rss_mb']:>8.1f} MB peak RSS ({best['rows']} rows)")
@@ -0,0 +1,90 @@
+import argparse
+import os
+import random
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing._utils import format_ingredients, format_ingredients_column
+
+# Ingredients typical of branded_food.csv
+INGREDIENTS = ['Sugar', 'SALT', 'water', 'Enriched Flour (wheat flour, niacin, iron)', 'Contains less than 2% of: salt',
+               'INGREDIENTS: milk', 'made from: corn', 'soy lecithin*', 'natural flavor.', 'jalapeno peppers',
+               'Vitamin B1 [thiamin]', 'CORN SYRUP', 'PARTIALLY HYDROGENATED SOYBEAN OIL', 'RED 40']
+
+# Ingredients that aren't ASCII, which format_ingredients_column passes on to format_ingredients
+OTHER_INGREDIENTS = ['jalapeño peppers', 'crème fraîche']
+
+# Pieces of random strings, chosen to hit the edge cases of format_ingredients (prefixes, parentheses,
+# punctuation, whitespace and separator characters, and characters that aren't ASCII)
+PIECES = [chr(i) for i in range(128)] + ['ingredients:', 'INGREDIENTS:', 'made from:', 'Made From:', '(', ' , ',
+                                         ',,', '  ', ' \t ', '\x1c', '\x1f', 'é', 'İ', 'ß', 'ﬁ', '\xa0', '\x85']
+
+# ---------------------------------------------------------------------
+# ---- Parse command-line arguments ----
+# ---------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(
+    description='check format_ingredients_column against format_ingredients and compare their wall time.')
+parser.add_argument('--rows', type=int, default=300_000,
+                    help='number of synthetic ingredients strings (default: 300000)')
+parser.add_argument('--random_rows', type=int, default=100_000,
+                    help='number of random strings checked for equal results (default: 100000)')
+parser.add_argument('--other_share', type=float, default=0.02,
+                    help='share of synthetic strings with ingredients that aren\'t ASCII (default: 0.02)')
+parser.add_argument('--workers', type=int, default=1,
+                    help='number of worker threads and processes of format_ingredients_column (default: 1)')
+parser.add_argument('--seed', type=int, default=0,
+                    help='seed of the generated strings (default: 0)')
+args = parser.parse_args()
+
+
+def check_equal(values):
+    """
+    Check that format_ingredients_column gives the same lists as format_ingredients for every value.
+
+    Parameters:
+        values (pd.Series): The ingredients strings.
+
+    Returns:
+        mismatches (int): The number of values with different results.
+    """
+    expected = values.apply(format_ingredients)
+    formatted = format_ingredients_column(values, args.workers)
+
+    mismatches = [idx for idx, (a, b) in enumerate(zip(expected, formatted)) if a != b]
+    for idx in mismatches[:5]:
+        print(f'> {values.iloc[idx]!r}: {expected.iloc[idx]} != {formatted.iloc[idx]}')
+
+    return len(mismatches)
+
+
+rng = random.Random(args.seed)
+
+random_values = pd.Series([''.join(rng.choice(PIECES) for _ in range(rng.randint(0, 40)))
+                           for _ in range(args.random_rows)])
+random_mismatches = check_equal(random_values)
+print(f'Checking {args.random_rows} random strings:\n> {random_mismatches} mismatches\n')
+
+values = pd.Series([', '.join(rng.choice(INGREDIENTS) for _ in range(rng.randint(3, 25))) +
+                    (f', {rng.choice(OTHER_INGREDIENTS)}' if rng.random() < args.other_share else '')
+                    for _ in range(args.rows)])
+mismatches = check_equal(values)
+print(f'Checking {args.rows} synthetic ingredients strings:\n> {mismatches} mismatches\n')
+
+start = time.perf_counter()
+values.apply(format_ingredients)
+apply_time = time.perf_counter() - start
+
+start = time.perf_counter()
+format_ingredients_column(values, args.workers)
+column_time = time.perf_counter() - start
+
+print(f'format_ingredients (Series.apply): {apply_time:>7.2f} s')
+print(f'format_ingredients_column:         {column_time:>7.2f} s ({apply_time / column_time:.1f}x)')
+
+# Fail on different results, like the tests in tests/test_format_ingredients.py
+if random_mismatches or mismatches:
+    sys.exit(1)
@@ -0,0 +1,86 @@
+import argparse
+import os
+import random
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from meat_standards_reference import ATTRIBUTES, find_and_replace_imps_patterns, normalize_reference, outcome, \
+    random_values
+from preprocessing import _constants
+from preprocessing._utils import _replace_meat_standard, normalize_meat_standards
+
+# ---------------------------------------------------------------------
+# ---- Parse command-line arguments ----
+# ---------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(
+    description='check normalize_meat_standards against the URMIS replacement and find_and_replace_imps_patterns, '
+                'and compare their wall time.')
+parser.add_argument('--rows', type=int, default=1_000_000,
+                    help='number of synthetic attribute values (default: 1000000)')
+parser.add_argument('--random_rows', type=int, default=100_000,
+                    help='number of random strings checked for equal results (default: 100000)')
+parser.add_argument('--missing_share', type=float, default=0.1,
+                    help='share of missing synthetic attribute values (default: 0.1)')
+parser.add_argument('--seed', type=int, default=0,
+                    help='seed of the generated strings (default: 0)')
+args = parser.parse_args()
+
+
+def check_equal(values, expected):
+    """
+    Check that normalize_meat_standards gives the expected values.
+
+    Parameters:
+        values (pd.Series): The attribute values.
+        expected (pd.Series): The values normalized by normalize_reference.
+
+    Returns:
+        mismatches (int): The number of values with different results.
+    """
+    normalized = normalize_meat_standards(values)
+
+    mismatches = [idx for idx, (a, b) in enumerate(zip(expected, normalized))
+                  if a != b and not (pd.isna(a) and pd.isna(b))]
+    for idx in mismatches[:5]:
+        print(f'> {values.iloc[idx]!r}: {expected.iloc[idx]!r} != {normalized.iloc[idx]!r}')
+
+    return len(mismatches)
+
+
+rng = random.Random(args.seed)
+
+# Random strings are checked one at a time, so the ones the patterns fail on count too
+random_mismatches = [value for value in random_values(rng, args.random_rows)
+                     if outcome(lambda x: find_and_replace_imps_patterns(_constants.URMIS_PATTERN.sub('meat', x)),
+                                value) !=
+                     outcome(lambda x: _constants.MEAT_STANDARD_PATTERN.sub(_replace_meat_standard, x), value)]
+for value in random_mismatches[:5]:
+    print(f'> {value!r}')
+print(f'Checking {args.random_rows} random strings:\n> {len(random_mismatches)} mismatches\n')
+
+values = pd.Series([np.nan if rng.random() < args.missing_share else rng.choice(ATTRIBUTES)
+                    for _ in range(args.rows)], dtype=object)
+
+start = time.perf_counter()
+expected = normalize_reference(values)
+apply_time = time.perf_counter() - start
+
+mismatches = check_equal(values, expected)
+print(f'Checking {len(values)} synthetic attribute values:\n> {mismatches} mismatches\n')
+
+start = time.perf_counter()
+normalize_meat_standards(values)
+normalize_time = time.perf_counter() - start
+
+print(f'URMIS str.replace + find_and_replace_imps_patterns: {apply_time:>7.2f} s')
+print(f'normalize_meat_standards:                           {normalize_time:>7.2f} s '
+      f'({apply_time / normalize_time:.1f}x)')
+
+# Fail on different results, like the tests in tests/test_meat_standards.py
+if random_mismatches or mismatches:
+    sys.exit(1)
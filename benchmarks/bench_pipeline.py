@@ -0,0 +1,307 @@
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fdc_fixtures import serve_fixtures, write_fixtures
+from preprocessing._download import prefetch_downloads
+from preprocessing._ingest import CSV_ENGINES
+from preprocessing._intermediate import INTERMEDIATE_FORMATS, intermediate_num_rows, intermediate_path
+from preprocessing._lazy import BACKENDS
+from preprocessing._profile import enable_profiling, profile_stage, recorded_stages
+from preprocessing._stack import iter_stacked_batches, read_stacked
+from preprocessing._utils import postprocess_stacked_df
+from preprocessing.process_branded import process_branded
+from preprocessing.process_foundation import process_foundation
+from preprocessing.process_srlegacy import process_srlegacy
+
+# Steps of the pipeline, each run in a fresh process so its peak memory is its own
+STEPS = ['foundation', 'srlegacy', 'branded', 'postprocess']
+
+# ---------------------------------------------------------------------
+# ---- Parse command-line arguments ----
+# ---------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(
+    description='run the processors and postprocess_stacked_df on synthetic FDC archives served from localhost, '
+                'and report the wall time, throughput, and peak memory of every step and stage.')
+parser.add_argument('--scale', type=int, default=1,
+                    help='scale factor of the synthetic archives, 100 is about the size of the FDC archives '
+                         '(default: 1)')
+parser.add_argument('--seed', type=int, default=0,
+                    help='seed of the synthetic archives (default: 0)')
+parser.add_argument('--fixtures_dir', default=None,
+                    help='directory the synthetic archives are written to and reused from (default: a temporary '
+                         'directory)')
+parser.add_argument('--csv_engine', default='pandas', choices=CSV_ENGINES,
+                    help='CSV engine used to read the archives (default: pandas)')
+parser.add_argument('--backend', default='pandas', choices=BACKENDS,
+                    help='backend the processors join the datasets with (default: pandas)')
+parser.add_argument('--intermediate_format', default='parquet', choices=INTERMEDIATE_FORMATS,
+                    help='format of the processed files the postprocess step stacks (default: parquet)')
+parser.add_argument('--streaming', action='store_true',
+                    help='process the branded data and stack the processed data in streaming mode (default: in memory)')
+parser.add_argument('--workers', type=int, default=1,
+                    help='number of worker processes for portion parsing and ingredient formatting (default: 1)')
+parser.add_argument('--output', default=None,
+                    help='path of the JSON results (default: benchmarks/results/pipeline-<commit>-scale<scale>.json)')
+parser.add_argument('--compare', nargs=2, default=None, metavar=('BASELINE', 'CANDIDATE'),
+                    help='compare two JSON results instead of running the benchmark')
+parser.add_argument('--child', default=None, choices=STEPS,
+                    help=argparse.SUPPRESS)
+parser.add_argument('--urls', nargs='*', default=None,
+                    help=argparse.SUPPRESS)
+parser.add_argument('--work_dir', default=None,
+                    help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+
+def peak_rss_mb():
+    """
+    Get the peak resident set size of the current process.
+
+    Returns:
+        peak_rss (float): The peak resident set size in MB.
+    """
+    # VmHWM is reset on exec, unlike ru_maxrss which keeps the peak of the parent process on Linux
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != 'darwin' else 1024 ** 2)
+
+
+def git_commit():
+    """
+    Get the short hash of the checked out commit, or 'unknown' outside a git repository.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def summarize(stages):
+    """
+    Total the wall time, CPU time, and rows of the recorded stages by name, with their throughput.
+
+    Parameters:
+        stages (list of dict): The stages recorded by _profile.
+
+    Returns:
+        totals (dict): A mapping of every stage name to its calls, wall time, CPU time, rows, rows per second, and
+            peak RSS growth.
+    """
+    totals = {}
+    for stage in stages:
+        total = totals.setdefault(stage['stage'], {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'rows': 0,
+                                                   'peak_rss_growth_mb': 0.0})
+        total['calls'] += 1
+        total['wall_time'] += stage['wall_time']
+        total['cpu_time'] += stage['cpu_time']
+        total['rows'] += stage['rows_out'] if stage['rows_out'] is not None else stage['rows_in'] or 0
+        total['peak_rss_growth_mb'] += stage['peak_rss_growth_mb']
+
+    for total in totals.values():
+        total['rows_per_s'] = round(total['rows'] / total['wall_time']) if total['wall_time'] else None
+        for key in ['wall_time', 'cpu_time', 'peak_rss_growth_mb']:
+            total[key] = round(total[key], 4)
+
+    return dict(sorted(totals.items(), key=lambda item: -item[1]['wall_time']))
+
+
+def run_step(step, urls, work_dir):
+    """
+    Run a step of the pipeline with profiling enabled (in the child process).
+
+    Parameters:
+        step (str): One of STEPS.
+        urls (list of str): The URLs of the archives, in the order get_usda_urls returns them.
+        work_dir (str): The directory holding the output, raw, and cache directories.
+
+    Returns:
+        result (dict): The wall time, CPU time, rows, and peak RSS of the step, and the totals of its stages.
+    """
+    output_dir = os.path.join(work_dir, 'output')
+    raw_dir = os.path.join(output_dir, 'FoodData_Central_raw')
+    cache_dir = os.path.join(work_dir, 'download_cache')
+    os.makedirs(raw_dir, exist_ok=True)
+
+    foundation_urls = [url for url in urls if 'foundation' in url or 'FoodData_Central_csv' in url]
+    srlegacy_url = [url for url in urls if 'sr_legacy' in url][0]
+    branded_url = [url for url in urls if 'branded' in url][0]
+
+    enable_profiling()
+    cpu_start = time.process_time()
+
+    with profile_stage(step) as stage:
+        if step == 'foundation':
+            process_foundation(foundation_urls, output_dir, raw_dir, False, cache_dir, args.csv_engine, args.workers,
+                               args.backend, args.intermediate_format)
+
+        elif step == 'srlegacy':
+            process_srlegacy(srlegacy_url, output_dir, raw_dir, False, cache_dir, args.csv_engine, args.workers,
+                             args.backend, args.intermediate_format)
+
+        elif step == 'branded':
+            process_branded(branded_url, output_dir, raw_dir, False, cache_dir, args.csv_engine,
+                            args.streaming, workers=args.workers, backend=args.backend,
+                            intermediate_format=args.intermediate_format)
+
+        else:
+            processed_paths = [intermediate_path(output_dir, name, args.intermediate_format)
+                               for name in ['foundation', 'srlegacy', 'branded']]
+
+            if args.streaming:
+                rows = sum(len(batch) for batch in iter_stacked_batches(processed_paths))
+            else:
+                rows = len(postprocess_stacked_df(read_stacked(processed_paths)))
+
+        if step != 'postprocess':
+            stage.rows_out = intermediate_num_rows(intermediate_path(output_dir, step, args.intermediate_format))
+        else:
+            stage.rows_out = rows
+
+    stages = recorded_stages()
+    step_stage = stages[-1]
+
+    return {
+        'step': step,
+        'wall_time': step_stage['wall_time'],
+        'cpu_time': round(time.process_time() - cpu_start, 4),
+        'rows': step_stage['rows_out'],
+        'rows_per_s': round(step_stage['rows_out'] / step_stage['wall_time']) if step_stage['wall_time'] else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stages': summarize(stages[:-1]),
+    }
+
+
+def compare(baseline_path, candidate_path):
+    """
+    Print the wall time and peak RSS of every step and stage of two results side by side.
+
+    Parameters:
+        baseline_path (str): The JSON results of the baseline.
+        candidate_path (str): The JSON results of the candidate.
+
+    Returns:
+        None
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    print(f"Comparing {baseline['commit']} (baseline) with {candidate['commit']} (candidate):")
+    for key in ['scale', 'seed', 'csv_engine', 'backend', 'intermediate_format', 'streaming', 'workers']:
+        if baseline.get(key) != candidate.get(key):
+            print(f"> warning: {key} differs, {baseline.get(key)} vs {candidate.get(key)}")
+    print()
+
+    baseline_steps = {step['step']: step for step in baseline['steps']}
+    print(f"{'step / stage':<32} {'baseline s':>11} {'candidate s':>12} {'ratio':>7} {'baseline MB':>12} "
+          f"{'candidate MB':>13}")
+
+    for step in candidate['steps']:
+        before = baseline_steps.get(step['step'])
+        if before is None:
+            continue
+
+        ratio = step['wall_time'] / before['wall_time'] if before['wall_time'] else float('nan')
+        print(f"{step['step']:<32} {before['wall_time']:>11.3f} {step['wall_time']:>12.3f} {ratio:>6.2f}x "
+              f"{before['peak_rss_mb']:>12.1f} {step['peak_rss_mb']:>13.1f}")
+
+        for name, stage in step['stages'].items():
+            before_stage = before['stages'].get(name)
+            if before_stage is None:
+                continue
+
+            ratio = stage['wall_time'] / before_stage['wall_time'] if before_stage['wall_time'] else float('nan')
+            print(f"  {name:<30} {before_stage['wall_time']:>11.3f} {stage['wall_time']:>12.3f} {ratio:>6.2f}x")
+
+
+# Run a single step and report its results (peak RSS is only meaningful in a fresh process)
+if args.child:
+    print(json.dumps(run_step(args.child, args.urls, args.work_dir)))
+    sys.exit(0)
+
+if args.compare:
+    compare(*args.compare)
+    sys.exit(0)
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    fixtures_dir = args.fixtures_dir or os.path.join(tmp_dir, 'fixtures')
+    work_dir = os.path.join(tmp_dir, 'work')
+
+    print(f'Writing synthetic FDC archives at scale {args.scale}:\n> {fixtures_dir}\n')
+    start = time.perf_counter()
+    write_fixtures(fixtures_dir, args.scale, args.seed)
+    print(f'> {time.perf_counter() - start:.1f} s, '
+          f'{sum(os.path.getsize(os.path.join(fixtures_dir, f)) for f in os.listdir(fixtures_dir)) / 1024 ** 2:.1f} MB\n')
+
+    with serve_fixtures(fixtures_dir) as urls:
+
+        # Fetch the archives into the download cache first, so the steps time the processing
+        start = time.perf_counter()
+        prefetch_downloads([url for url in urls if 'FoodData_Central_csv' not in url],
+                           os.path.join(work_dir, 'download_cache'))
+        download_time = time.perf_counter() - start
+
+        steps = []
+        for step in STEPS:
+            # Only the JSON line of the child's output is kept, the processors print their progress too
+            child = subprocess.run(
+                [sys.executable, __file__, '--child', step, '--urls', *urls, '--work_dir', work_dir,
+                 '--csv_engine', args.csv_engine, '--backend', args.backend, '--workers', str(args.workers),
+                 '--intermediate_format', args.intermediate_format] +
+                (['--streaming'] if args.streaming else []),
+                capture_output=True, text=True)
+            if child.returncode != 0:
+                sys.exit(f'The {step} step failed:\n{child.stderr}')
+            steps.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+results = {
+    'benchmark': 'pipeline',
+    'commit': git_commit(),
+    'created': datetime.datetime.now().isoformat(timespec='seconds'),
+    'scale': args.scale,
+    'seed': args.seed,
+    'csv_engine': args.csv_engine,
+    'backend': args.backend,
+    'streaming': args.streaming,
+    'intermediate_format': args.intermediate_format,
+    'workers': args.workers,
+    'versions': {'python': sys.version.split()[0], 'pandas': pd.__version__, 'pyarrow': pa.__version__},
+    'download_time': round(download_time, 4),
+    'steps': steps,
+}
+
+output_path = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                          f"pipeline-{results['commit']}-scale{args.scale}.json")
+os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+with open(output_path, 'w') as f:
+    json.dump(results, f, indent=2)
+
+print(f"{'step / stage':<32} {'wall s':>8} {'cpu s':>8} {'rows':>10} {'rows/s':>10} {'peak MB':>8}")
+for step in steps:
+    print(f"{step['step']:<32} {step['wall_time']:>8.3f} {step['cpu_time']:>8.3f} {step['rows']:>10} "
+          f"{step['rows_per_s'] or 0:>10} {step['peak_rss_mb']:>8.1f}")
+
+    for name, stage in step['stages'].items():
+        print(f"  {name:<30} {stage['wall_time']:>8.3f} {stage['cpu_time']:>8.3f} {stage['rows']:>10} "
+              f"{stage['rows_per_s'] or 0:>10}")
+
+print(f'\nResults written to:\n> {output_path}\n')
@@ -0,0 +1,100 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing._utils import pivot_mean
+
+# ---------------------------------------------------------------------
+# ---- Parse command-line arguments ----
+# ---------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(
+    description='check pivot_mean against pd.pivot_table on synthetic long nutrient data and compare their wall '
+                'time and peak memory.')
+parser.add_argument('--foods', type=int, default=400_000,
+                    help='number of synthetic foods, about the size of branded_food.csv (default: 400000)')
+parser.add_argument('--nutrients', type=int, default=65,
+                    help='number of distinct nutrients (default: 65)')
+parser.add_argument('--nutrients_per_food', type=int, default=15,
+                    help='average number of nutrients reported per food (default: 15)')
+parser.add_argument('--duplicate_share', type=float, default=0.01,
+                    help='share of rows repeating a (food, nutrient) pair, which are averaged (default: 0.01)')
+parser.add_argument('--seed', type=int, default=0,
+                    help='seed of the generated data (default: 0)')
+args = parser.parse_args()
+
+
+def make_long_data(rng):
+    """
+    Generate long (fdc_id, nutrient_name, per_gram_amt) data, like the merged nutrient data of the processors.
+
+    Parameters:
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        df (pd.DataFrame): The long data, in random order.
+    """
+    n_rows = args.foods * args.nutrients_per_food
+
+    fdc_ids = rng.integers(1_000_000, 1_000_000 + args.foods, n_rows).astype('int32')
+    nutrients = rng.integers(0, args.nutrients, n_rows)
+    keys = np.unique(fdc_ids.astype(np.int64) * args.nutrients + nutrients)
+
+    # Repeat some (food, nutrient) pairs, so the engines have to average them
+    repeats = rng.choice(keys, int(len(keys) * args.duplicate_share))
+    keys = rng.permutation(np.concatenate([keys, repeats]))
+
+    names = pd.Categorical.from_codes(keys % args.nutrients, [f'nutrient_{i:03d}' for i in range(args.nutrients)])
+    amounts = rng.exponential(0.05, len(keys))
+    amounts[rng.random(len(keys)) < 0.01] = np.nan
+
+    return pd.DataFrame({'fdc_id': (keys // args.nutrients).astype('int32'),
+                         'nutrient_name': names,
+                         'per_gram_amt': amounts})
+
+
+def measure(func):
+    """
+    Run a function, measuring its wall time and the peak memory it allocates.
+
+    Parameters:
+        func (callable): The function to run.
+
+    Returns:
+        result: The return value of func.
+        elapsed (float): The wall time in seconds.
+        peak (float): The peak of the memory allocated while it ran, in MB.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+
+df = make_long_data(np.random.default_rng(args.seed))
+print(f'Long data:\n> {len(df)} rows, {df["fdc_id"].nunique()} foods, {args.nutrients} nutrients\n')
+
+expected, table_time, table_peak = measure(lambda: df.pivot_table(
+    index=['fdc_id'], columns='nutrient_name', values='per_gram_amt', observed=True).reset_index())
+
+wide, pivot_time, pivot_peak = measure(lambda: pivot_mean(
+    df, index=['fdc_id'], columns='nutrient_name', values='per_gram_amt'))
+
+try:
+    pd.testing.assert_frame_equal(wide, expected, check_exact=True)
+    print('Checking pivot_mean against pivot_table:\n> equal\n')
+except AssertionError as e:
+    print(f'Checking pivot_mean against pivot_table:\n> different: {e}\n')
+
+print(f'pivot_table: {table_time:>7.2f} s, {table_peak:>8.1f} MB peak')
+print(f'pivot_mean:  {pivot_time:>7.2f} s, {pivot_peak:>8.1f} MB peak ({table_time / pivot_time:.1f}x)')
@@ -0,0 +1,389 @@
+import contextlib
+import email.utils
+import functools
+import http.server
+import json
+import os
+import re
+import sys
+import threading
+import zipfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing import _constants
+
+# Archives of the fixtures, named like the FDC archives get_usda_urls returns (in the same order)
+FIXTURE_ARCHIVES = {
+    'foundation': 'FoodData_Central_foundation_food_csv_2024-10-31.zip',
+    'sr_legacy': 'FoodData_Central_sr_legacy_food_csv_2018-04.zip',
+    'branded': 'FoodData_Central_branded_food_csv_2024-10-31.zip',
+    'full': 'FoodData_Central_csv_2024-10-31.zip',
+}
+
+# Number of foods per unit of scale factor, scale 100 is about the size of the FDC archives
+FOODS_PER_SCALE = {'foundation': 4, 'sr_legacy': 80, 'branded': 4_000}
+
+# Number of nutrients reported per food, as (min, max)
+NUTRIENTS_PER_FOOD = {'foundation': (20, 60), 'sr_legacy': (20, 60), 'branded': (8, 30)}
+
+# Name of the file recording the scale factor and seed of the fixtures in a directory
+FIXTURES_INFO_FILENAME = 'fixtures.json'
+
+# Nutrients outside RELEVANT_NUTRIENTS, which the processors filter out
+OTHER_NUTRIENTS = [(1051, 'Water', 'G'), (1007, 'Ash', 'G'), (1018, 'Alcohol, ethyl', 'G'),
+                   (1062, 'Energy', 'kJ')]
+
+# Measure units of food_portion.csv (9999 is the 'undetermined' unit of the FDC data)
+MEASURE_UNITS = [(1000, 'cup'), (1001, 'tablespoon'), (1002, 'teaspoon'), (1038, 'oz'), (1043, 'piece'),
+                 (9999, 'undetermined')]
+
+CATEGORIES = ['Dairy and Egg Products', 'Spices and Herbs', 'Baby Foods', 'Fats and Oils', 'Poultry Products',
+              'Soups, Sauces, and Gravies', 'Sausages and Luncheon Meats', 'Breakfast Cereals']
+
+DESCRIPTION_WORDS = ['apple', 'beef', 'raw', 'cooked', 'salted', 'Chicken', 'breast', 'roasted', 'cheese', 'cheddar',
+                     'milk', 'whole', 'bread', 'wheat', 'sauce', 'tomato', 'pork', 'loin', '(fresh)', 'frozen',
+                     'café', 'jalapeño']
+
+PORTION_MODIFIERS = ['', 'chopped', 'large', 'slice', '1/8 of crust', 'cup, diced', 'oz boneless']
+
+INGREDIENTS = ['Sugar', 'SALT', 'water', 'Enriched Flour (wheat flour, niacin, iron)', 'Contains less than 2% of: salt',
+               'INGREDIENTS: milk', 'made from: corn', 'soy lecithin*', 'natural flavor.', 'jalapeño peppers',
+               'Vitamin B1 [thiamin]', 'CORN SYRUP', 'PARTIALLY HYDROGENATED SOYBEAN OIL', 'RED 40']
+
+BRAND_OWNERS = ['Acme Inc.', 'General (Mills)', 'Kroger, Co', 'Nestle USA, Inc.', 'Walmart Inc.']
+BRAND_NAMES = ['', 'ACME', 'Brand  X ', 'GREAT VALUE', 'KROGER']
+HOUSEHOLD_SERVINGS = ['1 cup', '2 tbsp', '1 oz', '', '1 ONZ', '3 PIECES', '1/2 cup (120 ml)']
+
+# Values of the SR Legacy food attributes, with IMPS and URMIS codes for the common name normalization
+SR_LEGACY_ATTRIBUTES = ['IMPS 1100 goat', 'URMIS #1234 beef loin', 'Beef, IMPS 112 ribeye',
+                        'pork URMIS # 9 chop IMPS 402', 'plain value', 'IMPS #700 liver', 'no digits', 'URMIS#55 lamb']
+
+FOOD_NUTRIENT_COLUMNS = ['id', 'fdc_id', 'nutrient_id', 'amount', 'data_points', 'derivation_id', 'min', 'max',
+                         'median', 'footnote', 'min_year_acquired']
+FOOD_PORTION_COLUMNS = ['id', 'fdc_id', 'seq_num', 'amount', 'measure_unit_id', 'portion_description', 'modifier',
+                        'gram_weight', 'data_points', 'footnote', 'min_year_acquired']
+BRANDED_FOOD_COLUMNS = ['fdc_id', 'brand_owner', 'brand_name', 'subbrand_name', 'gtin_upc', 'ingredients',
+                        'not_a_significant_source_of', 'serving_size', 'serving_size_unit',
+                        'household_serving_fulltext', 'branded_food_category', 'data_source', 'package_weight',
+                        'modified_date', 'available_date', 'market_country', 'discontinued_date',
+                        'preparation_state_code', 'trade_channel', 'short_description']
+
+
+def nutrient_table():
+    """
+    Build nutrient.csv: the relevant nutrients (Energy in KCAL), and a few others the processors filter out.
+
+    Returns:
+        nutrients (pd.DataFrame): The nutrient table.
+    """
+    units = ['G', 'MG', 'UG']
+    rows = [(1008 if name == 'Energy' else 1100 + k, name, 'KCAL' if name == 'Energy' else units[k % 3])
+            for k, name in enumerate(_constants.RELEVANT_NUTRIENTS)]
+    rows += OTHER_NUTRIENTS
+
+    nutrients = pd.DataFrame(rows, columns=['id', 'name', 'unit_name'])
+    nutrients['nutrient_nbr'] = ''
+    nutrients['rank'] = ''
+
+    return nutrients
+
+
+def _pick(rng, values, n):
+    """
+    Pick n values at random.
+    """
+    return np.asarray(values, dtype=object)[rng.integers(0, len(values), n)]
+
+
+def _join_words(rng, words, n, min_words, max_words, sep):
+    """
+    Build n strings of min_words to max_words random words.
+    """
+    counts = rng.integers(min_words, max_words + 1, n)
+    picks = _pick(rng, words, counts.sum())
+    bounds = np.r_[0, np.cumsum(counts)]
+
+    return [sep.join(picks[bounds[i]:bounds[i + 1]]) for i in range(n)]
+
+
+def food_table(rng, fdc_ids, data_type):
+    """
+    Build food.csv for the given foods.
+    """
+    return pd.DataFrame({
+        'fdc_id': fdc_ids,
+        'data_type': data_type,
+        'description': _join_words(rng, DESCRIPTION_WORDS, len(fdc_ids), 1, 4, ', '),
+        'food_category_id': rng.integers(1, len(CATEGORIES) + 1, len(fdc_ids)) if data_type != 'branded_food' else '',
+        'publication_date': '2020-01-01',
+    })
+
+
+def food_nutrient_table(rng, fdc_ids, nutrient_ids, per_food):
+    """
+    Build food_nutrient.csv, with per_food (min, max) distinct nutrients per food.
+    """
+    counts = rng.integers(per_food[0], per_food[1] + 1, len(fdc_ids))
+    rows = pd.DataFrame({
+        'fdc_id': np.repeat(fdc_ids, counts),
+        'nutrient_id': np.asarray(nutrient_ids)[rng.integers(0, len(nutrient_ids), counts.sum())],
+    }).drop_duplicates(ignore_index=True)
+
+    rows.insert(0, 'id', np.arange(1, len(rows) + 1))
+    rows['amount'] = rng.uniform(0, 500, len(rows)).round(3)
+    for col in FOOD_NUTRIENT_COLUMNS[4:]:
+        rows[col] = ''
+
+    return rows
+
+
+def food_portion_table(rng, fdc_ids):
+    """
+    Build food_portion.csv, with zero to three portions per food.
+    """
+    counts = rng.integers(0, 4, len(fdc_ids))
+    n = counts.sum()
+    units = np.asarray([unit_id for unit_id, _ in MEASURE_UNITS])
+
+    portions = pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'fdc_id': np.repeat(fdc_ids, counts),
+        'seq_num': np.concatenate([np.arange(count) for count in counts]) if n else [],
+        'amount': _pick(rng, [1, 1.5, 0.5, 2], n),
+        'measure_unit_id': units[rng.integers(0, len(units), n)],
+        'portion_description': '',
+        'modifier': _pick(rng, PORTION_MODIFIERS, n),
+        'gram_weight': rng.uniform(1, 300, n).round(1),
+    })
+    for col in FOOD_PORTION_COLUMNS[8:]:
+        portions[col] = ''
+
+    return portions
+
+
+def branded_food_table(rng, fdc_ids):
+    """
+    Build branded_food.csv, with a few foods lacking ingredients.
+    """
+    n = len(fdc_ids)
+    ingredients = np.asarray(_join_words(rng, INGREDIENTS, n, 1, 12, ', '), dtype=object)
+    ingredients[rng.random(n) < 0.05] = ''
+
+    # Some foods are sold by a brand owner of their fdc_id range only, like the many owners of the FDC data, so
+    # the partitions of the streaming mode hold different categories
+    brand_owners = _pick(rng, BRAND_OWNERS, n)
+    brand_owners[::7] = [f'Store Brand {fdc_id // 500}' for fdc_id in fdc_ids[::7]]
+
+    branded = pd.DataFrame({
+        'fdc_id': fdc_ids,
+        'brand_owner': brand_owners,
+        'brand_name': _pick(rng, BRAND_NAMES, n),
+        'subbrand_name': '',
+        'gtin_upc': '',
+        'ingredients': ingredients,
+        'not_a_significant_source_of': '',
+        'serving_size': _pick(rng, [28, 30, 240, 15.5], n),
+        'serving_size_unit': _pick(rng, ['g', 'ml', 'GRM'], n),
+        'household_serving_fulltext': _pick(rng, HOUSEHOLD_SERVINGS, n),
+        'branded_food_category': _pick(rng, CATEGORIES, n),
+    })
+    for col in BRANDED_FOOD_COLUMNS[11:]:
+        branded[col] = ''
+
+    return branded
+
+
+def _write_archive(path, tables):
+    """
+    Write CSV files into a zip file, under a root directory named like the zip file (as in the FDC archives).
+    """
+    root = os.path.splitext(os.path.basename(path))[0]
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for filename, table in tables.items():
+            data = table if isinstance(table, str) else table.to_csv(index=False)
+            archive.writestr(f'{root}/{filename}', data)
+
+
+def write_fixtures(fixtures_dir, scale=1, seed=0):
+    """
+    Write synthetic FDC archives, shaped like the real ones, into a directory. The number of foods grows linearly
+    with the scale factor (see FOODS_PER_SCALE). Directories already holding fixtures of the same scale and seed
+    are reused as they are.
+
+    Parameters:
+        fixtures_dir (str): The directory the archives are written to.
+        scale (int): The scale factor (default is 1).
+        seed (int): The seed of the generated data (default is 0).
+
+    Returns:
+        paths (dict): A mapping of every archive (see FIXTURE_ARCHIVES) to its path.
+    """
+    paths = {name: os.path.join(fixtures_dir, filename) for name, filename in FIXTURE_ARCHIVES.items()}
+    info = {'scale': scale, 'seed': seed}
+    info_path = os.path.join(fixtures_dir, FIXTURES_INFO_FILENAME)
+
+    if os.path.exists(info_path) and all(os.path.exists(path) for path in paths.values()):
+        with open(info_path) as f:
+            if json.load(f) == info:
+                return paths
+
+    os.makedirs(fixtures_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    nutrients = nutrient_table()
+    measure_units = pd.DataFrame(MEASURE_UNITS, columns=['id', 'name'])
+    categories = pd.DataFrame({'id': np.arange(1, len(CATEGORIES) + 1), 'code': '', 'description': CATEGORIES})
+
+    # Foundation foods, with their ontology names as food attributes
+    fdc_ids = np.arange(100_000, 100_000 + FOODS_PER_SCALE['foundation'] * scale)
+    food_attribute = pd.DataFrame({
+        'id': np.arange(2 * len(fdc_ids)),
+        'fdc_id': np.repeat(fdc_ids, 2),
+        'seq_num': 1,
+        'food_attribute_type_id': 999,
+        'name': np.tile(['Ontology Name For Source', 'FoodOn Ontology Name For FDC Item'], len(fdc_ids)),
+        'value': _pick(rng, ['meat', 'dairy', 'vegetable', 'beef', 'cheese', 'apple'], 2 * len(fdc_ids)),
+    })
+    _write_archive(paths['foundation'], {
+        'food.csv': food_table(rng, fdc_ids, 'foundation_food'),
+        'food_nutrient.csv': food_nutrient_table(rng, fdc_ids, nutrients['id'], NUTRIENTS_PER_FOOD['foundation']),
+        'nutrient.csv': nutrients,
+        'food_portion.csv': food_portion_table(rng, fdc_ids),
+        'measure_unit.csv': measure_units,
+        'food_attribute.csv': food_attribute,
+    })
+
+    # SR Legacy foods, with common names holding IMPS and URMIS codes for most of them
+    fdc_ids = np.arange(200_000, 200_000 + FOODS_PER_SCALE['sr_legacy'] * scale)
+    attributed = fdc_ids[rng.random(len(fdc_ids)) < 0.6]
+    food_attribute = pd.DataFrame({
+        'id': np.arange(len(attributed)),
+        'fdc_id': attributed,
+        'seq_num': 1,
+        'food_attribute_type_id': _pick(rng, [1000, 1001], len(attributed)),
+        'name': '',
+        'value': _pick(rng, SR_LEGACY_ATTRIBUTES, len(attributed)),
+    })
+    food_attribute_type = pd.DataFrame({'id': [1000, 1001], 'name': ['Common Name', 'Other'], 'description': ''})
+    _write_archive(paths['sr_legacy'], {
+        'food.csv': food_table(rng, fdc_ids, 'sr_legacy_food'),
+        'food_nutrient.csv': food_nutrient_table(rng, fdc_ids, nutrients['id'], NUTRIENTS_PER_FOOD['sr_legacy']),
+        'nutrient.csv': nutrients,
+        'food_category.csv': categories,
+        'food_portion.csv': food_portion_table(rng, fdc_ids),
+        'measure_unit.csv': measure_units,
+        'food_attribute.csv': food_attribute,
+        'food_attribute_type.csv': food_attribute_type,
+    })
+
+    # Branded foods
+    fdc_ids = np.arange(1_000_000, 1_000_000 + FOODS_PER_SCALE['branded'] * scale)
+    _write_archive(paths['branded'], {
+        'food.csv': food_table(rng, fdc_ids, 'branded_food'),
+        'food_nutrient.csv': food_nutrient_table(rng, fdc_ids, nutrients['id'], NUTRIENTS_PER_FOOD['branded']),
+        'nutrient.csv': nutrients,
+        'branded_food.csv': branded_food_table(rng, fdc_ids),
+    })
+
+    # The full archive, of which only food_category.csv is read (with range requests)
+    _write_archive(paths['full'], {
+        'food_category.csv': categories,
+        'food.csv': food_table(rng, fdc_ids[:1000], 'branded_food'),
+    })
+
+    with open(info_path, 'w') as f:
+        json.dump(info, f)
+
+    return paths
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serve files like the FDC server: with an ETag and a Last-Modified validator, conditional requests answered
+    with 304, and single byte-range requests (guarded by If-Range) answered with 206.
+    """
+
+    # Whether byte ranges are advertised (Accept-Ranges) and served, or the whole file is always sent
+    accept_ranges = True
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{int(stat.st_mtime):x}-{size:x}"'
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return None
+
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        ranged = self.accept_ranges and match is not None and self.headers.get('If-Range') in (None, etag)
+
+        if ranged:
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+            else:
+                start = max(0, size - int(match.group(2)))
+
+        self.send_response(206 if ranged else 200)
+        if ranged:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+        if self.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        f = open(path, 'rb')
+        f.seek(start)
+        self._remaining = end - start + 1
+
+        return f
+
+    def copyfile(self, source, outputfile):
+        while self._remaining > 0:
+            data = source.read(min(1024 * 1024, self._remaining))
+            if not data:
+                break
+            outputfile.write(data)
+            self._remaining -= len(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_fixtures(fixtures_dir, accept_ranges=True):
+    """
+    Serve a directory over HTTP on localhost, on a free port, while the context is open.
+
+    Parameters:
+        fixtures_dir (str): The directory holding the archives.
+        accept_ranges (bool): Whether byte-range requests are supported (default is True).
+
+    Yields:
+        urls (list of str): The URLs of the archives, in the order get_usda_urls returns them.
+    """
+    handler = type('FixtureRequestHandler', (RangeRequestHandler,), {'accept_ranges': accept_ranges})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler, directory=fixtures_dir))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        yield [f'{base_url}/{filename}' for filename in FIXTURE_ARCHIVES.values()]
+    finally:
+        server.shutdown()
+        server.server_close()
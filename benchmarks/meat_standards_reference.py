@@ -0,0 +1,105 @@
+import os
+import re
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fdc_fixtures import SR_LEGACY_ATTRIBUTES
+from preprocessing import _constants
+
+# Attribute values of SR Legacy foods, with IMPS and URMIS codes of every series and in every case
+ATTRIBUTES = SR_LEGACY_ATTRIBUTES + ['Beef, loin, tenderloin steak (IMPS 1190A)', 'imps 410 pork loin',
+                                     'Lamb, IMPS #204, rack', 'URMIS # 1505, IMPS # 1112', 'Veal (IMPS 306)',
+                                     'Sausage IMPS 802', 'Goat, IMPS 11 whole carcass', 'Cured ham IMPS 500',
+                                     'IMPS 600 dried beef', 'URMIS #2281 urmis #2282', 'IMPS 0 unknown series']
+
+# Pieces of random strings, chosen to hit the edge cases of the patterns (case, spacing, '#', line breaks, and
+# URMIS numbers within IMPS items)
+PIECES = ['IMPS', 'imps', 'ImPs', 'URMIS', 'urmis', '#', ' #', '# ', ' ', '  ', '\n', '\t', ',', '(', ')', 'I', 'M',
+          'P', 'S', 'U', 'R', 'meat', 'beef'] + [str(digit) for digit in range(10)] + ['11', '112', '1100']
+
+
+def random_values(rng, n):
+    """
+    Build n random strings of 0 to 12 PIECES.
+
+    Parameters:
+        rng (random.Random): The random number generator.
+        n (int): The number of strings.
+
+    Returns:
+        values (list of str): The strings.
+    """
+    return [''.join(rng.choice(PIECES) for _ in range(rng.randint(0, 12))) for _ in range(n)]
+
+
+def find_and_replace_imps_patterns(category_value: str) -> str:
+    """
+    Find and replace matches of IMPS_PATTERN in the given string with the corresponding values in IMPS_MEAT_SERIES.
+
+    This is how process_srlegacy normalized the IMPS items before normalize_meat_standards, kept as the reference
+    it's checked against (see tests/test_meat_standards.py).
+    """
+    if category_value is np.nan:
+        return np.nan
+
+    offset = 0
+    pattern_iter = _constants.IMPS_PATTERN.finditer(category_value)
+
+    for match in pattern_iter:
+        match_string = match.group()
+
+        # Get the start and end of the match and the modified start and end positions given the offset
+        start, end = match.start(), match.end()
+        modified_start = start + offset
+        modified_end = end + offset
+
+        DIGIT_PATTERN = re.compile(r'(\d+)')
+
+        digits = DIGIT_PATTERN.findall(match_string)[0]
+
+        first_digit = digits[0]
+        first_two_digits = digits[0:2]
+
+        if first_two_digits == "11":
+            replacement_str = _constants.IMPS_MEAT_SERIES["11"][1]
+        else:
+            replacement_str = _constants.IMPS_MEAT_SERIES.get(
+                first_digit, ["meat", "meat"])[1]
+
+        # Construct the modified string with the replacement applied
+        category_value = category_value[:modified_start] + \
+            str(replacement_str) + category_value[modified_end:]
+
+        # Update the offset for subsequent removals
+        offset += len(str(replacement_str)) - (end - start)
+
+    return category_value
+
+
+def normalize_reference(values):
+    """
+    Normalize the values like process_srlegacy did before normalize_meat_standards: the URMIS replacement, then
+    find_and_replace_imps_patterns applied to every value.
+
+    Parameters:
+        values (pd.Series): The attribute values.
+
+    Returns:
+        normalized (pd.Series): The normalized values.
+    """
+    values = values.str.replace(_constants.URMIS_PATTERN, 'meat', regex=True)
+
+    return values.apply(lambda x: find_and_replace_imps_patterns(x))
+
+
+def outcome(func, value):
+    """
+    Get the result of func for a value, or the type of the error it raises (i.e. IndexError for IMPS items without
+    a number).
+    """
+    try:
+        return func(value)
+    except Exception as e:
+        return type(e)
@@ -1,11 +1,23 @@
 import argparse
 import os
+import time
 import re
 import json
 import pandas as pd
 import numpy as np
 
 from preprocessing._utils import get_usda_urls, dict_to_json, postprocess_stacked_df, fillna_and_set_dtypes
+from preprocessing._delta import detect_output_format, write_delta
+from preprocessing._download import prefetch_downloads
+from preprocessing._ingest import CSV_ENGINES
+from preprocessing._intermediate import INTERMEDIATE_FORMATS, intermediate_path
+from preprocessing._partition import PARTITION_SIZE
+from preprocessing._jobs import run_jobs
+from preprocessing._lazy import BACKENDS
+from preprocessing._manifest import build_entry, is_up_to_date, read_manifest, record_build, write_manifest
+from preprocessing._output import OUTPUT_FORMATS, resolve_output, write_output, write_output_batches
+from preprocessing._profile import enable_profiling, profile_stage, recorded_stages, write_run_report
+from preprocessing._stack import STACK_BATCH_SIZE, iter_stacked_batches, read_stacked
 
 from preprocessing.process_foundation import process_foundation
 from preprocessing.process_srlegacy import process_srlegacy
@@ -14,103 +26,249 @@ from preprocessing.process_branded import process_branded
 import warnings
 warnings.simplefilter("ignore")
 
-# ---------------------------------------------------------------------
-# ---- Parse command-line arguments ----
-# ---------------------------------------------------------------------
-
-# Parse command-line arguments
-parser = argparse.ArgumentParser(
-    description='download and process USDA Food Data Central datasets.')
-parser.add_argument('--output_dir', default='fdc_data',
-                    help='specify output directory path (default: fdc_data)')
-parser.add_argument('--filename', default='usda_food_nutrition_data.csv',
-                    help='specify output filename (default: usda_food_nutrition_data.csv')
-parser.add_argument('--keep_files', action='store_true',
-                    help='keep raw/indv files post-processing (default: delete raw/indv files)')
-args = parser.parse_args()
-
-# Check filename and extension
-filename = args.filename
-file_ext = filename.split('.')[-1] if '.' in filename else None
-filename = filename if file_ext else f"{filename}.csv"
-
-# Check keep_files flag
-keep_files = args.keep_files
-if keep_files:
-    print(f"\n'keep_files' flag specified:\n> Raw and individual files will be kept after processing.")
-
-# ---------------------------------------------------------------------
-# ---- Setup raw and output directories ----
-# ---------------------------------------------------------------------
-
-# Define directories and ensure they exist (raw_dir existence will be checked in individual processing files)
-OUTPUT_DIR = args.output_dir
-RAW_DIR = os.path.join(OUTPUT_DIR, 'FoodData_Central_raw')
-print(
-    f'\nInitializing processing of USDA FDC data. Output directory set to:\n> {OUTPUT_DIR}\n')
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
-    print(f'Directory created:\n> {OUTPUT_DIR}\n')
-
-# ---------------------------------------------------------------------
-# ---- Process USDA datasets ----
-# ---------------------------------------------------------------------
-
-# Gather urls and send them out to appropriate processing scripts
-usda_urls = get_usda_urls()
-
-foundation_urls = [
-    url for url in usda_urls if 'foundation' in url or 'FoodData_Central_csv' in url]
-srlegacy_url = [url for url in usda_urls if 'sr_legacy' in url][0]
-branded_url = [url for url in usda_urls if 'branded' in url][0]
-
-process_foundation(foundation_urls, OUTPUT_DIR, RAW_DIR, keep_files)
-process_srlegacy(srlegacy_url, OUTPUT_DIR, RAW_DIR, keep_files)
-process_branded(branded_url, OUTPUT_DIR, RAW_DIR, keep_files)
-
-# ---------------------------------------------------------------------
-# ---- Postprocess processed USDA datasets ----
-# ---------------------------------------------------------------------
-
-print(f'Initializing stacking of individually processed data:')
-for root, dirs, files in os.walk(OUTPUT_DIR):
-    for file in files:
-        if '.parquet' in file:
-            print(f'> {file}')
-
-# Stack processed data
-stacked_data = pd.concat([
-    pd.read_parquet(os.path.join(OUTPUT_DIR, 'processed_foundation.parquet')),
-    pd.read_parquet(os.path.join(OUTPUT_DIR, 'processed_srlegacy.parquet')),
-    pd.read_parquet(os.path.join(OUTPUT_DIR, 'processed_branded.parquet'))
-])
-
-# Apply some post-processing
-print(f'\nInitializing postprocessing of {filename}.\n')
-stacked_data = postprocess_stacked_df(stacked_data)
-
-# ---------------------------------------------------------------------
-# ---- Save final output data and cleanup directories ----
-# ---------------------------------------------------------------------
-
-stacked_data.to_csv(os.path.join(OUTPUT_DIR, filename), index=False)
-
-# Delete raw dir/individual processed files if keep_files flag is not specified
-for root, dirs, files in os.walk(OUTPUT_DIR):
-    for file in files:
-
-        if not keep_files:
-
-            if 'foundation' in file:
-                file_path = os.path.join(root, file)
-                os.remove(file_path)
-            if 'srlegacy' in file:
-                file_path = os.path.join(root, file)
-                os.remove(file_path)
-            if 'branded' in file:
-                file_path = os.path.join(root, file)
-                os.remove(file_path)
-
-
-print(
-    f"Processing of USDA FDC data is complete. The processed data file ('{filename}') is now available in:\n> {OUTPUT_DIR}\n")
+
+def main():
+    """
+    Download, process, and stack the USDA FDC datasets according to the command-line arguments.
+
+    The script body lives in a function so the worker processes started by the --workers option, which import
+    this module on platforms that spawn them, don't run it again.
+    """
+
+    # ---------------------------------------------------------------------
+    # ---- Parse command-line arguments ----
+    # ---------------------------------------------------------------------
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(
+        description='download and process USDA Food Data Central datasets.')
+    parser.add_argument('--output_dir', default='fdc_data',
+                        help='specify output directory path (default: fdc_data)')
+    parser.add_argument('--filename', default='usda_food_nutrition_data.csv',
+                        help='specify output filename (default: usda_food_nutrition_data.csv')
+    parser.add_argument('--format', default=None, choices=OUTPUT_FORMATS,
+                        help='output format, dataset writes Parquet files partitioned by data_type (default: from the --filename extension, csv otherwise)')
+    parser.add_argument('--keep_files', action='store_true',
+                        help='keep raw/indv files post-processing (default: delete raw/indv files)')
+    parser.add_argument('--cache_dir', default=None,
+                        help='specify download cache directory path, reused across runs (default: <output_dir>/download_cache)')
+    parser.add_argument('--download_parts', type=int, default=8,
+                        help='number of byte ranges downloaded in parallel per large archive (default: 8)')
+    parser.add_argument('--csv_engine', default='pandas', choices=CSV_ENGINES,
+                        help='CSV engine used to read the USDA files, pyarrow reads them multithreaded (default: pandas)')
+    parser.add_argument('--backend', default='pandas', choices=BACKENDS,
+                        help='backend the processors join the datasets with, arrow runs the joins as multithreaded Arrow query plans (default: pandas)')
+    parser.add_argument('--intermediate_format', default='parquet', choices=INTERMEDIATE_FORMATS,
+                        help='format of the per-dataset processed files, feather writes uncompressed Arrow IPC files that are memory-mapped when stacked (default: parquet)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='process branded data one fdc_id range at a time, and stack and postprocess the processed data one batch at a time, to bound peak memory (default: process in memory)')
+    parser.add_argument('--partition_size', type=int, default=PARTITION_SIZE,
+                        help=f'number of branded foods processed at once in streaming mode (default: {PARTITION_SIZE})')
+    parser.add_argument('--stack_batch_size', type=int, default=STACK_BATCH_SIZE,
+                        help=f'number of rows stacked and postprocessed at once in streaming mode (default: {STACK_BATCH_SIZE})')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes for portion parsing and ingredient formatting (default: 1)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of processors (foundation, srlegacy, branded) run concurrently as separate processes (default: 1)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip processors whose archives and code are unchanged since the last incremental run, restacking their kept intermediate files (default: rebuild everything)')
+    parser.add_argument('--profile', action='store_true',
+                        help='record the wall time, CPU time, rows, and memory of every stage to <output_dir>/run_report.json (default: no report)')
+    parser.add_argument('--diff_against', default=None,
+                        help='output of a previous build, in the same format, to write the inserted, updated and deleted foods against to <output_dir>/delta (default: no delta)')
+    args = parser.parse_args()
+
+    # Start recording the stages of the run, in this process and in the jobs
+    started = time.time()
+    if args.profile:
+        enable_profiling()
+
+    # Check filename and extension, which picks the output format unless --format is given
+    output_format, filename = resolve_output(args.filename, args.format)
+
+    # Check the previous build a delta is written against, before anything is processed
+    if args.diff_against:
+        if not os.path.exists(args.diff_against):
+            raise FileNotFoundError(f'No previous build at {args.diff_against!r}')
+
+        if detect_output_format(args.diff_against) != output_format:
+            raise ValueError(f'--diff_against must be a {output_format} output, like the one of this build')
+
+        if os.path.abspath(args.diff_against) == os.path.abspath(os.path.join(args.output_dir, filename)):
+            raise ValueError('--diff_against must not be the output this build overwrites')
+
+    # Check keep_files flag
+    keep_files = args.keep_files
+    if keep_files:
+        print(f"\n'keep_files' flag specified:\n> Raw and individual files will be kept after processing.")
+
+    # ---------------------------------------------------------------------
+    # ---- Setup raw and output directories ----
+    # ---------------------------------------------------------------------
+
+    # Define directories and ensure they exist (raw_dir existence will be checked in individual processing files)
+    OUTPUT_DIR = args.output_dir
+    RAW_DIR = os.path.join(OUTPUT_DIR, 'FoodData_Central_raw')
+    CACHE_DIR = args.cache_dir or os.path.join(OUTPUT_DIR, 'download_cache')
+    LOG_DIR = os.path.join(OUTPUT_DIR, 'logs')
+    print(
+        f'\nInitializing processing of USDA FDC data. Output directory set to:\n> {OUTPUT_DIR}\n')
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+        print(f'Directory created:\n> {OUTPUT_DIR}\n')
+
+    # ---------------------------------------------------------------------
+    # ---- Process USDA datasets ----
+    # ---------------------------------------------------------------------
+
+    # Gather urls and send them out to appropriate processing scripts
+    usda_urls = get_usda_urls()
+
+    foundation_urls = [
+        url for url in usda_urls if 'foundation' in url or 'FoodData_Central_csv' in url]
+    srlegacy_url = [url for url in usda_urls if 'sr_legacy' in url][0]
+    branded_url = [url for url in usda_urls if 'branded' in url][0]
+
+    # Only food_category.csv is read from the full FoodData_Central_csv archive, which process_foundation fetches remotely
+    jobs = [
+        {'name': 'foundation', 'func': process_foundation, 'sources': foundation_urls,
+         'urls': [url for url in foundation_urls if 'FoodData_Central_csv' not in url],
+         'args': (foundation_urls, OUTPUT_DIR, RAW_DIR, keep_files, CACHE_DIR, args.csv_engine, args.workers,
+                  args.backend, args.intermediate_format)},
+        {'name': 'srlegacy', 'func': process_srlegacy, 'sources': [srlegacy_url], 'urls': [srlegacy_url],
+         'args': (srlegacy_url, OUTPUT_DIR, RAW_DIR, keep_files, CACHE_DIR, args.csv_engine, args.workers,
+                  args.backend, args.intermediate_format)},
+        {'name': 'branded', 'func': process_branded, 'sources': [branded_url], 'urls': [branded_url],
+         'args': (branded_url, OUTPUT_DIR, RAW_DIR, keep_files, CACHE_DIR, args.csv_engine,
+                  args.streaming, args.partition_size, args.workers, args.backend, args.intermediate_format)},
+    ]
+
+    for job in jobs:
+        job['output'] = intermediate_path(OUTPUT_DIR, job['name'], args.intermediate_format)
+    all_jobs = jobs
+
+    if args.incremental:
+        # Revalidate the archives first, so their checksums are known, then skip the processors whose archives,
+        # code, and intermediate file match the build manifest
+        print(f'Fetching USDA archives into download cache:\n> {CACHE_DIR}\n')
+        with profile_stage('download'):
+            prefetch_downloads([url for job in jobs for url in job['urls']],
+                               CACHE_DIR, n_parts=args.download_parts)
+
+        manifest = read_manifest(OUTPUT_DIR)
+        for job in jobs:
+            job['build'] = build_entry(job['func'], job['sources'], CACHE_DIR)
+
+        skipped = [job for job in jobs if is_up_to_date(job['build'], manifest, job['output'])]
+        for job in skipped:
+            print(f"Skipping {job['name']} processing, its archives and code are unchanged:\n> {job['output']}\n")
+
+        jobs = [job for job in jobs if job not in skipped]
+
+    job_timings = []
+    if args.jobs > 1 and jobs:
+        # Run the processors as separate processes, each fetching its own archives, so downloads and processing
+        # overlap. The branded job is the longest, so it's started first
+        print(f'Running USDA processors as {args.jobs} concurrent jobs.\n')
+        job_timings = run_jobs(jobs[::-1], LOG_DIR, args.jobs, CACHE_DIR, args.download_parts)
+
+    elif jobs:
+        # Fetch the archives into the download cache concurrently, the processors then reuse the cached files
+        if not args.incremental:
+            print(f'Fetching USDA archives into download cache:\n> {CACHE_DIR}\n')
+            with profile_stage('download'):
+                prefetch_downloads([url for job in jobs for url in job['urls']],
+                                   CACHE_DIR, n_parts=args.download_parts)
+
+        for job in jobs:
+            with profile_stage(job['name']):
+                job['func'](*job['args'])
+
+    # Record the rebuilt intermediate files in the build manifest
+    if args.incremental:
+        for job in jobs:
+            record_build(manifest, job['build'], job['output'])
+        write_manifest(OUTPUT_DIR, manifest)
+
+    # ---------------------------------------------------------------------
+    # ---- Postprocess processed USDA datasets ----
+    # ---------------------------------------------------------------------
+
+    print(f'Initializing stacking of individually processed data:')
+    for root, dirs, files in os.walk(OUTPUT_DIR):
+        for file in files:
+            if file.startswith('processed_'):
+                print(f'> {file}')
+
+    processed_paths = [intermediate_path(OUTPUT_DIR, name, args.intermediate_format)
+                       for name in ['foundation', 'srlegacy', 'branded']]
+
+    if args.streaming:
+        # Stack, postprocess, and write the processed data one batch at a time
+        print(f'\nInitializing streaming postprocessing of {filename}, {args.stack_batch_size} rows at a time.\n')
+        print(f'Writing {output_format} output:\n> {os.path.join(OUTPUT_DIR, filename)}\n')
+        with profile_stage('stack') as stage:
+            stage.rows_out = write_output_batches(iter_stacked_batches(processed_paths, args.stack_batch_size),
+                                                  os.path.join(OUTPUT_DIR, filename), output_format)
+
+    else:
+        # Stack processed data as Arrow tables, keeping the categorical columns categorical
+        with profile_stage('stack') as stage:
+            stacked_data = read_stacked(processed_paths)
+            stage.rows_out = len(stacked_data)
+
+        # Apply some post-processing
+        print(f'\nInitializing postprocessing of {filename}.\n')
+        stacked_data = postprocess_stacked_df(stacked_data, verbose=args.profile)
+
+        print(f'Writing {output_format} output:\n> {os.path.join(OUTPUT_DIR, filename)}\n')
+        write_output(stacked_data, os.path.join(OUTPUT_DIR, filename), output_format)
+        del stacked_data
+
+    # ---------------------------------------------------------------------
+    # ---- Write delta and cleanup directories ----
+    # ---------------------------------------------------------------------
+
+    # Write the foods that changed since the previous build
+    if args.diff_against:
+        delta_dir = os.path.join(OUTPUT_DIR, 'delta')
+        print(f'Writing delta against previous build:\n> {args.diff_against}\n')
+        with profile_stage('delta'):
+            counts = write_delta(args.diff_against, os.path.join(OUTPUT_DIR, filename), delta_dir, output_format)
+        print(f"Delta written to:\n> {delta_dir}\n> {counts['inserted']} inserted, {counts['updated']} updated, "
+              f"{counts['deleted']} deleted foods\n")
+
+    # Delete raw dir/individual processed files if keep_files flag is not specified (the job logs are kept, and
+    # so are the individual processed files of incremental runs, which later runs restack)
+    for root, dirs, files in os.walk(OUTPUT_DIR):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != LOG_DIR]
+        for file in files:
+
+            if args.incremental and os.path.join(root, file) in [job['output'] for job in all_jobs]:
+                continue
+
+            if not keep_files:
+
+                if 'foundation' in file:
+                    file_path = os.path.join(root, file)
+                    os.remove(file_path)
+                if 'srlegacy' in file:
+                    file_path = os.path.join(root, file)
+                    os.remove(file_path)
+                if 'branded' in file:
+                    file_path = os.path.join(root, file)
+                    os.remove(file_path)
+
+    # Write the run report, with the stages the jobs recorded in their own processes
+    if args.profile:
+        stages = recorded_stages() + [stage for timing in job_timings for stage in timing['stages']]
+        report_path = write_run_report(OUTPUT_DIR, stages, started, args=vars(args),
+                                       jobs=[{k: v for k, v in timing.items() if k != 'stages'} for timing in job_timings])
+        print(f'Run report written to:\n> {report_path}\n')
+
+    print(
+        f"Processing of USDA FDC data is complete. The processed data file ('{filename}') is now available in:\n> {OUTPUT_DIR}\n")
+
+
+if __name__ == '__main__':
+    main()
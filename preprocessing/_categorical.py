@@ -0,0 +1,118 @@
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+def is_categorical(values):
+    """
+    Check whether a Series holds a pandas categorical.
+    """
+    return isinstance(values.dtype, pd.CategoricalDtype)
+
+
+def sort_categories(values):
+    """
+    Sort the categories of a categorical Series, so groupbys and pivots on it order their groups like they would
+    on the plain strings (categoricals are ordered by their categories, not by their values).
+
+    Parameters:
+        values (pd.Series): The categorical Series.
+
+    Returns:
+        values (pd.Series): The categorical Series with sorted categories.
+    """
+    categories = values.cat.categories
+    if categories.is_monotonic_increasing:
+        return values
+
+    return values.cat.reorder_categories(categories.sort_values())
+
+
+def to_categorical(df, columns):
+    """
+    Convert the given text columns of a DataFrame to categoricals with sorted categories, skipping the ones it
+    doesn't hold. Missing values stay missing.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame, converted in place.
+        columns (list of str): The columns to convert (i.e. _schema.CATEGORICAL_COLUMNS).
+
+    Returns:
+        df (pd.DataFrame): The DataFrame.
+    """
+    for col in columns:
+        if col not in df.columns:
+            continue
+
+        if is_categorical(df[col]):
+            df[col] = sort_categories(df[col])
+        else:
+            df[col] = sort_categories(df[col].astype(object).astype('category'))
+
+    return df
+
+
+def fillna_categorical(values, value):
+    """
+    Fill the missing values of a categorical Series, adding the fill value to its categories first (fillna only
+    accepts existing categories). Other Series are filled as they are.
+
+    Parameters:
+        values (pd.Series): The categorical Series.
+        value (str): The fill value (i.e. 'no_value').
+
+    Returns:
+        values (pd.Series): The filled categorical Series, with sorted categories.
+    """
+    if not is_categorical(values):
+        return values.fillna(value)
+
+    if not values.isna().any():
+        return values
+
+    if value not in values.cat.categories:
+        values = sort_categories(values.cat.add_categories([value]))
+
+    return values.fillna(value)
+
+
+def concat_frames(frames, **kwargs):
+    """
+    Concatenate DataFrames like pd.concat, keeping categorical columns categorical.
+
+    pd.concat falls back to object columns when the categories of the frames differ, or when a frame lacks the
+    column, so every column that's categorical in any frame is concatenated with union_categoricals instead
+    (with sorted categories). The columns come out in the order pd.concat gives them.
+
+    Parameters:
+        frames (list of pd.DataFrame): The DataFrames to concatenate.
+        **kwargs: Keyword arguments passed on to pd.concat (i.e. ignore_index).
+
+    Returns:
+        df (pd.DataFrame): The concatenated DataFrame.
+    """
+    frames = list(frames)
+
+    columns = []
+    for frame in frames:
+        columns += [col for col in frame.columns if is_categorical(frame[col]) and col not in columns]
+
+    if not columns:
+        return pd.concat(frames, **kwargs)
+
+    # Concatenate the categorical columns, frames without the column contribute missing values
+    combined = {}
+    for col in columns:
+        pieces = [frame[col] if col in frame.columns else pd.Series(index=frame.index, dtype=object)
+                  for frame in frames]
+        pieces = [piece if is_categorical(piece) else piece.astype(object).astype('category') for piece in pieces]
+        combined[col] = union_categoricals(pieces, sort_categories=True)
+
+    order = pd.concat([frame.iloc[:0] for frame in frames]).columns
+
+    df = pd.concat([frame.drop(columns=[col for col in columns if col in frame.columns]) for frame in frames],
+                   **kwargs)
+    for col, values in combined.items():
+        df[col] = values
+
+    return df[order]
+
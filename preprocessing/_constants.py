@@ -1,4 +1,5 @@
 import re
+import sys
 
 # IMPS Meat standard series names from USDA / AMS standards
 # Source: https://www.ams.usda.gov/grades-standards/imps
@@ -26,6 +27,21 @@ IMPS_MEAT_SERIES = {
     "11": ("Fresh Goat Series", "goat")
 }
 
+# Nutrients that consumers care about, only these are kept in the processed data
+RELEVANT_NUTRIENTS = ['Energy', 'Protein', 'Carbohydrate, by difference', 'Total lipid (fat)',
+                      'Iron, Fe', 'Sodium, Na', 'Cholesterol', 'Fatty acids, total trans', 'Fatty acids, total saturated',
+                      'Fiber, total dietary', 'Sugars, Total', 'Vitamin A, RAE', 'Vitamin C, total ascorbic acid',
+                      'Calcium, Ca', 'Retinol', 'Folate, total', 'Fatty acids, total monounsaturated', 'Fatty acids, total polyunsaturated',
+                      'Riboflavin', 'Vitamin B-12', 'Vitamin K (Dihydrophylloquinone)', 'Vitamin K (phylloquinone)',
+                      'Tryptophan', 'Threonine', 'Methionine', 'Phenylalanine', 'Carotene, beta', 'Thiamin',
+                      'Starch', 'Fructose', 'Lactose', 'Galactose', 'Magnesium, Mg', 'Phosphorus, P', 'Copper, Cu',
+                      'Manganese, Mn', 'Tyrosine', 'Alanine', 'Glutamic acid', 'Glycine', 'Proline', 'Valine',
+                      'Arginine', 'Histidine', 'Aspartic acid', 'Serine', 'Sucrose', 'Glucose', 'Maltose',
+                      'Potassium, K', 'Zinc, Zn', 'Selenium, Se', 'Vitamin E (alpha-tocopherol)', 'Niacin', 'Pantothenic acid',
+                      'Vitamin B-6', 'Isoleucine', 'Leucine', 'Lysine', 'Cystine',
+                      'Choline, total', 'Betaine', 'Vitamin K (Menaquinone-4)',
+                      'Vitamin D3 (cholecalciferol)', 'Vitamin D2 (ergocalciferol)']
+
 # -----------------------------------------------------
 # ---- Regular Expressions constants ----
 # -----------------------------------------------------
@@ -36,3 +52,44 @@ DIGIT_PATTERN = re.compile(r'(\d+)')
 # Matches strings with the URMIS/IMPS string patterns
 URMIS_PATTERN = re.compile(r'URMIS\s*#\s*(?:\d*)', re.IGNORECASE)
 IMPS_PATTERN  = re.compile(r'(IMPS.*(?:\d*))', re.IGNORECASE)
+
+# Matches both in a single pass, an IMPS match spans the URMIS numbers after it (and the line breaks within them),
+# like IMPS_PATTERN does once URMIS_PATTERN is replaced
+MEAT_STANDARD_PATTERN = re.compile(
+    rf'(?P<imps>IMPS(?:{URMIS_PATTERN.pattern}|.)*)|(?P<urmis>{URMIS_PATTERN.pattern})', re.IGNORECASE)
+
+# Matches phrases like "contains less than NUMBER %" or "contains less than NUMBER % of:"
+CONTAINS_LESS_THEN_NUMBER_PCT_SYMBOL_REGEX = re.compile(
+    r'contains less than\s*(?:\d*\.\d+|\d+\s*/\s*\d+|\d+)\s*%', re.IGNORECASE)
+CONTAINS_LESS_THEN_NUMBER_PCT_SYMBOL_OF_REGEX = re.compile(
+    r'contains less than\s*(?:\d*\.\d+|\d+\s*/\s*\d+|\d+)\s*%\s*of:', re.IGNORECASE)
+
+# The characters Python's \s and str.strip() treat as whitespace in ASCII strings (including the \x1c-\x1f
+# separators), spelled out for Arrow's RE2 regexes where \s is only [\t\n\f\r ]
+ASCII_WHITESPACE = r'\t\n\x0b\x0c\r\x1c-\x1f '
+
+# Number of rows per slice of the ingredients column formatted by a worker thread in format_ingredients_column
+INGREDIENTS_SLICE_SIZE = 65_536
+
+# Every character str.strip() removes, for Arrow's utf8_trim kernel
+PYTHON_WHITESPACE = ''.join(c for c in map(chr, range(sys.maxunicode + 1)) if c.isspace())
+
+# Matches the control characters removed from the string columns of the final output
+CONTROL_CHARACTERS_REGEX = r'[\x00-\x19]'
+
+# Columns of the final output, in order
+OUTPUT_COLUMNS = [
+    'fdc_id', 'usda_data_source', 'data_type', 'category', 'brand_owner', 'brand_name', 'food_description',
+    'food_common_name', 'food_common_category', 'ingredients', 'portion_amount', 'portion_unit', 'portion_modifier',
+    'std_portion_amount', 'std_portion_unit', 'portion_gram_weight', 'portion_energy', 'energy',
+    'carbohydrate_by_difference', 'protein', 'total_lipid_fat', 'fiber_total_dietary', 'sugars_total', 'calcium_ca',
+    'iron_fe', 'vitamin_c_total_ascorbic_acid', 'vitamin_a_rae', 'vitamin_e_alphatocopherol', 'sodium_na',
+    'cholesterol', 'fatty_acids_total_saturated', 'fatty_acids_total_trans', 'fatty_acids_total_monounsaturated',
+    'fatty_acids_total_polyunsaturated', 'vitamin_k_phylloquinone', 'thiamin', 'riboflavin', 'niacin', 'vitamin_b6',
+    'folate_total', 'vitamin_b12', 'vitamin_d3_cholecalciferol', 'vitamin_d2_ergocalciferol', 'pantothenic_acid',
+    'phosphorus_p', 'magnesium_mg', 'potassium_k', 'zinc_zn', 'copper_cu', 'manganese_mn', 'selenium_se',
+    'carotene_beta', 'retinol', 'vitamin_k_dihydrophylloquinone', 'vitamin_k_menaquinone4', 'tryptophan',
+    'threonine', 'methionine', 'phenylalanine', 'tyrosine', 'valine', 'arginine', 'histidine', 'isoleucine',
+    'leucine', 'lysine', 'cystine', 'alanine', 'glutamic_acid', 'glycine', 'proline', 'serine', 'sucrose', 'glucose',
+    'maltose', 'fructose', 'lactose', 'galactose', 'choline_total', 'betaine'
+]
@@ -0,0 +1,206 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from preprocessing import _constants
+from preprocessing._output import COMPRESSION, EXTENSION_FORMATS, OUTPUT_SCHEMA, to_output_table
+
+# Columns identifying a food in the output, foods of foundation and SR Legacy span several rows (one per portion)
+DELTA_KEY_COLUMNS = ['fdc_id', 'data_type']
+
+# Number of rows read, hashed, and written at once
+DELTA_BATCH_SIZE = 250_000
+
+
+def detect_output_format(path):
+    """
+    Find the format of a final output written by main.py from its path.
+
+    Parameters:
+        path (str): The output file path, or the directory path of the dataset format.
+
+    Returns:
+        output_format (str): One of _output.OUTPUT_FORMATS.
+    """
+    if os.path.isdir(path):
+        return 'dataset'
+
+    file_ext = os.path.splitext(path)[1].lower()
+    if file_ext not in EXTENSION_FORMATS:
+        raise ValueError(f'Cannot tell the output format of {path!r} from its extension')
+
+    return EXTENSION_FORMATS[file_ext]
+
+
+def iter_output_batches(path, output_format):
+    """
+    Read a final output one batch of DELTA_BATCH_SIZE rows at a time, as DataFrames with the columns in output
+    order.
+
+    CSV files are read with the column types of OUTPUT_SCHEMA, except std_portion_amount, which is text in CSV
+    ('no_value' where no quantity was parsed).
+
+    Parameters:
+        path (str): The output file path, or the directory path of the dataset format.
+        output_format (str): One of _output.OUTPUT_FORMATS.
+
+    Yields:
+        batch (pd.DataFrame): The rows of the next batch.
+    """
+    if output_format == 'csv':
+        column_types = {field.name: field.type for field in OUTPUT_SCHEMA}
+        column_types['std_portion_amount'] = pa.string()
+
+        batches = pv.open_csv(
+            path,
+            read_options=pv.ReadOptions(block_size=64 * 1024 * 1024),
+            parse_options=pv.ParseOptions(newlines_in_values=True),
+            convert_options=pv.ConvertOptions(column_types=column_types, strings_can_be_null=False))
+
+    else:
+        dataset = ds.dataset(path, format='ipc' if output_format == 'feather' else 'parquet',
+                             partitioning='hive' if output_format == 'dataset' else None)
+        batches = dataset.to_batches(columns=_constants.OUTPUT_COLUMNS, batch_size=DELTA_BATCH_SIZE)
+
+    for batch in batches:
+        # Text read back as Arrow dictionaries (i.e. the partition column of the dataset format) is hashed as text
+        batch = batch.to_pandas()
+        for col in batch.columns:
+            if isinstance(batch[col].dtype, pd.CategoricalDtype):
+                batch[col] = batch[col].astype(object)
+
+        for start in range(0, len(batch), DELTA_BATCH_SIZE):
+            yield batch.iloc[start:start + DELTA_BATCH_SIZE].reset_index(drop=True)
+
+
+def _batch_keys(batch):
+    """
+    Build the key columns of a batch, with fdc_id as int64 whatever the format stores it as.
+    """
+    return pd.DataFrame({'fdc_id': batch['fdc_id'].astype('int64'), 'data_type': batch['data_type'].astype(str)})
+
+
+def _key_codes(keys, data_types):
+    """
+    Encode food keys as single int64 codes, so batches can be matched against millions of keys with a binary
+    search instead of hashing them again for every batch.
+
+    Parameters:
+        keys (pd.DataFrame): The key columns.
+        data_types (list of str): Every data_type of both outputs.
+
+    Returns:
+        codes (np.ndarray): The int64 code of every key.
+    """
+    type_codes = pd.Categorical(keys['data_type'], categories=data_types).codes.astype(np.int64)
+
+    return keys['fdc_id'].to_numpy(dtype=np.int64) * len(data_types) + type_codes
+
+
+def _isin_sorted(values, sorted_values):
+    """
+    Check which values are in a sorted array.
+    """
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+
+    return sorted_values[positions] == values
+
+
+def content_hashes(path, output_format):
+    """
+    Hash the content of every food of a final output, reading it one batch at a time, so only the keys and their
+    hashes are held in memory.
+
+    The hash of a food is the sum (wrapping around) of the hashes of its rows, which doesn't depend on the order
+    of its rows or on how they're split across batches.
+
+    Parameters:
+        path (str): The output file path, or the directory path of the dataset format.
+        output_format (str): One of _output.OUTPUT_FORMATS.
+
+    Returns:
+        hashes (pd.Series): The uint64 content hash of every food, indexed by DELTA_KEY_COLUMNS.
+    """
+    parts = []
+    for batch in iter_output_batches(path, output_format):
+        keys = _batch_keys(batch)
+        keys['content_hash'] = pd.util.hash_pandas_object(batch, index=False).to_numpy()
+        parts.append(keys.groupby(DELTA_KEY_COLUMNS, sort=False)['content_hash'].sum())
+
+    if not parts:
+        index = pd.MultiIndex.from_arrays([pd.Series(dtype='int64'), pd.Series(dtype=object)],
+                                          names=DELTA_KEY_COLUMNS)
+        return pd.Series(index=index, dtype='uint64', name='content_hash')
+
+    # Foods split across batches are summed again
+    hashes = pd.concat(parts)
+
+    return hashes.groupby(level=DELTA_KEY_COLUMNS, sort=True).sum()
+
+
+def write_delta(previous_path, current_path, delta_dir, output_format='csv'):
+    """
+    Compare a final output with the one of a previous build, and write the foods that changed between them:
+    - <delta_dir>/inserted.parquet: the rows of the foods only the current build has
+    - <delta_dir>/updated.parquet: the rows of the foods both builds have, whose rows changed
+    - <delta_dir>/deleted.parquet: the fdc_id and data_type of the foods only the previous build has
+
+    Foods are keyed by DELTA_KEY_COLUMNS and compared by their content hashes (see content_hashes). Both outputs
+    are read one batch at a time, and the inserted and updated rows are written as they're read, so memory is
+    bounded by the batch size and the number of foods, not by the size of the outputs. The rows are written with
+    OUTPUT_SCHEMA.
+
+    Parameters:
+        previous_path (str): The output of the previous build.
+        current_path (str): The output of the current build.
+        delta_dir (str): The directory the delta is written to.
+        output_format (str): The format of both outputs, one of _output.OUTPUT_FORMATS (default is 'csv').
+
+    Returns:
+        counts (dict): The number of foods of every part of the delta.
+    """
+    os.makedirs(delta_dir, exist_ok=True)
+
+    # Classify the foods by their content hashes
+    previous_hashes = content_hashes(previous_path, output_format)
+    current_hashes = content_hashes(current_path, output_format)
+
+    common = current_hashes.index.intersection(previous_hashes.index)
+    changed = common[current_hashes[common].to_numpy() != previous_hashes[common].to_numpy()]
+    inserted = current_hashes.index.difference(previous_hashes.index)
+    deleted = previous_hashes.index.difference(current_hashes.index)
+
+    data_types = sorted(set(previous_hashes.index.get_level_values('data_type')) |
+                        set(current_hashes.index.get_level_values('data_type')))
+    part_codes = {part: np.sort(_key_codes(part_keys.to_frame(index=False), data_types))
+                  for part, part_keys in [('inserted', inserted), ('updated', changed)]}
+
+    # Stream the rows of the inserted and updated foods into their parts
+    writers = {part: pq.ParquetWriter(os.path.join(delta_dir, f'{part}.parquet'), OUTPUT_SCHEMA,
+                                      compression=COMPRESSION) for part in part_codes}
+    try:
+        for batch in iter_output_batches(current_path, output_format):
+            codes = _key_codes(_batch_keys(batch), data_types)
+
+            for part, sorted_codes in part_codes.items():
+                rows = _isin_sorted(codes, sorted_codes)
+                if rows.any():
+                    writers[part].write_table(to_output_table(batch[rows].reset_index(drop=True)))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # The deleted foods only have their keys
+    deleted_keys = deleted.to_frame(index=False)
+    deleted_table = pa.Table.from_arrays(
+        [pa.array(deleted_keys[col], type=OUTPUT_SCHEMA.field(col).type) for col in DELTA_KEY_COLUMNS],
+        schema=pa.schema([OUTPUT_SCHEMA.field(col) for col in DELTA_KEY_COLUMNS]))
+    pq.write_table(deleted_table, os.path.join(delta_dir, 'deleted.parquet'), compression=COMPRESSION)
+
+    return {'inserted': len(inserted), 'updated': len(changed), 'deleted': len(deleted)}
@@ -0,0 +1,485 @@
+import hashlib
+import json
+import os
+import requests
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# Size of each chunk pulled off the response stream (1 MiB)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Size of the buffered writer used when saving downloads to disk (8 MiB)
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Files smaller than this are downloaded over a single stream, even when ranged downloads are requested (64 MiB)
+MIN_RANGED_DOWNLOAD_SIZE = 64 * 1024 * 1024
+
+# Connect and read timeouts of every request, in seconds, so a stalled connection fails instead of hanging
+DOWNLOAD_TIMEOUT = (10, 60)
+
+
+def _cache_key(url):
+    """
+    Build the cache key for a URL.
+
+    Parameters:
+        url (str): The URL of the file being cached.
+
+    Returns:
+        key (str): A hex digest identifying the URL within the cache directory.
+    """
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+
+def _read_metadata(meta_path):
+    """
+    Read the metadata record of a cache entry.
+
+    Parameters:
+        meta_path (str): The path to the metadata JSON file.
+
+    Returns:
+        metadata (dict): The metadata record, or an empty dict if none exists or it can't be read.
+    """
+    if not os.path.exists(meta_path):
+        return {}
+
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_metadata(meta_path, metadata):
+    """
+    Atomically write the metadata record of a cache entry.
+
+    Parameters:
+        meta_path (str): The path to the metadata JSON file.
+        metadata (dict): The metadata record to be saved.
+
+    Returns:
+        None
+    """
+    tmp_path = f'{meta_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def file_sha256(path, buffer_size=WRITE_BUFFER_SIZE):
+    """
+    Compute the SHA-256 checksum of a file.
+
+    Parameters:
+        path (str): The path to the file.
+        buffer_size (int): The number of bytes read per iteration (default is 8 MiB).
+
+    Returns:
+        checksum (str): The hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(buffer_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def get_cache_entry(url, cache_dir):
+    """
+    Look up the cache entry for a URL.
+
+    Parameters:
+        url (str): The URL of the cached file.
+        cache_dir (str): The directory holding the download cache.
+
+    Returns:
+        metadata (dict): The metadata record (url, etag, last_modified, size, sha256, path), or an empty dict if
+            the URL has not been fully downloaded into the cache.
+    """
+    metadata = _read_metadata(os.path.join(cache_dir, f'{_cache_key(url)}.json'))
+
+    if not metadata.get('complete') or not os.path.exists(metadata.get('path', '')):
+        return {}
+
+    return metadata
+
+
+def remove_cache_entry(url, cache_dir):
+    """
+    Remove a URL's downloaded file, partial download, and metadata from the cache.
+
+    Parameters:
+        url (str): The URL of the cached file.
+        cache_dir (str): The directory holding the download cache.
+
+    Returns:
+        None
+    """
+    key = _cache_key(url)
+    meta_path = os.path.join(cache_dir, f'{key}.json')
+    metadata = _read_metadata(meta_path)
+
+    for path in [metadata.get('path'), os.path.join(cache_dir, f'{key}.part'), meta_path]:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def make_session(pool_size=10):
+    """
+    Create a requests session whose connection pool can serve pool_size concurrent requests per host.
+
+    Parameters:
+        pool_size (int): The number of pooled connections kept per host (default is 10).
+
+    Returns:
+        session (requests.Session): The configured session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def _split_ranges(size, n_parts):
+    """
+    Split a file of the given size into contiguous, inclusive byte ranges.
+
+    Parameters:
+        size (int): The total size of the file in bytes.
+        n_parts (int): The number of ranges to split the file into.
+
+    Returns:
+        ranges (list of tuple): A list of (start, end) byte offsets, with end inclusive.
+    """
+    n_parts = max(1, min(n_parts, size))
+    part_size = -(-size // n_parts)
+
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+def _write_at(fd, data, offset):
+    """
+    Write data to a file descriptor at the given offset without moving a shared file position.
+
+    Parameters:
+        fd (int): The file descriptor opened for writing.
+        data (bytes): The data to be written.
+        offset (int): The byte offset to write the data at.
+
+    Returns:
+        None
+    """
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        with open(fd, 'r+b', closefd=False) as f:
+            f.seek(offset)
+            f.write(data)
+
+
+def _download_range(session, url, fd, start, end, validator, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Download one byte range of a URL and write it into place in a preallocated file.
+
+    Parameters:
+        session (requests.Session): The session used to issue the request.
+        url (str): The URL of the file being downloaded.
+        fd (int): The file descriptor of the preallocated destination file.
+        start (int): The first byte of the range.
+        end (int): The last byte of the range (inclusive).
+        validator (str): The ETag or Last-Modified value the range must match (sent as If-Range).
+        chunk_size (int): The size of each download chunk (default is 1 MiB).
+
+    Returns:
+        None
+    """
+    headers = {'Range': f'bytes={start}-{end}'}
+    if validator:
+        headers['If-Range'] = validator
+
+    with session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+        r.raise_for_status()
+
+        if r.status_code != 206:
+            raise IOError(f'Server ignored range {start}-{end} of {url} (the file may have changed)')
+
+        position = start
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            _write_at(fd, chunk, position)
+            position += len(chunk)
+
+    if position != end + 1:
+        raise IOError(f'Incomplete range {start}-{end} of {url}: got {position - start} bytes')
+
+
+def ranged_download(url, save_path, size, validator=None, n_parts=8, session=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Download a file as n_parts byte ranges fetched in parallel, each written into place in a preallocated file.
+
+    Parameters:
+        url (str): The URL of the file to be downloaded.
+        save_path (str): The path where the downloaded file will be saved.
+        size (int): The total size of the file in bytes, as reported by the server.
+        validator (str): The ETag or Last-Modified value every range must match (default is None).
+        n_parts (int): The number of ranges downloaded concurrently (default is 8).
+        session (requests.Session): An optional session used to issue the requests.
+        chunk_size (int): The size of each download chunk (default is 1 MiB).
+
+    Returns:
+        None
+    """
+    session = session or make_session(n_parts)
+    ranges = _split_ranges(size, n_parts)
+
+    # Preallocate the destination file so each range can be written in place
+    with open(save_path, 'wb') as f:
+        f.truncate(size)
+
+    fd = os.open(save_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(_download_range, session, url, fd, start, end, validator, chunk_size)
+                       for start, end in ranges]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+
+
+def cached_download(url, cache_dir, chunk_size=DOWNLOAD_CHUNK_SIZE, session=None, n_parts=1, expected_sha256=None):
+    """
+    Download a file into a persistent, content-addressed cache and return its local path.
+
+    Completed downloads are stored under their SHA-256 checksum and indexed by a metadata record keyed by the
+    URL, which also keeps the ETag, Last-Modified, and size reported by the server. On later calls:
+    - A complete entry is revalidated with a conditional request (If-None-Match / If-Modified-Since), and a
+      304 response reuses the cached file without downloading anything.
+    - A partial entry is resumed with a byte-range request guarded by If-Range, so the download restarts
+      from scratch only when the file changed on the server.
+
+    When n_parts > 1 and the server accepts byte ranges, files of at least MIN_RANGED_DOWNLOAD_SIZE are
+    downloaded as n_parts parallel ranges instead (see ranged_download). Those are never resumed: an interrupted
+    ranged download is removed, and downloaded again from scratch.
+
+    Finished downloads are verified before they're cached (see _finalize_download).
+
+    Parameters:
+        url (str): The URL of the file to be downloaded.
+        cache_dir (str): The directory holding the download cache.
+        chunk_size (int): The size of each download chunk (default is 1 MiB).
+        session (requests.Session): An optional session used to issue the requests.
+        n_parts (int): The number of byte ranges downloaded in parallel for large files (default is 1).
+        expected_sha256 (str): An optional checksum the downloaded file must match.
+
+    Returns:
+        path (str): The path to the complete, cached file.
+    """
+    # Several downloads (or jobs) may share the cache directory, so it may be created concurrently
+    os.makedirs(cache_dir, exist_ok=True)
+
+    http = session or requests
+    key = _cache_key(url)
+    meta_path = os.path.join(cache_dir, f'{key}.json')
+    part_path = os.path.join(cache_dir, f'{key}.part')
+    metadata = _read_metadata(meta_path)
+    previous_path = metadata.get('path')
+
+    headers = {}
+    offset = 0
+
+    if metadata.get('complete') and os.path.exists(metadata.get('path', '')):
+        # Revalidate the complete entry
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+
+    elif os.path.exists(part_path):
+        offset = os.path.getsize(part_path)
+
+        # A ranged download leaves holes in its preallocated file, and a partial file already as large as the
+        # whole file has nothing left to resume, so both are downloaded again from scratch
+        if (metadata.get('ranged') or not (metadata.get('etag') or metadata.get('last_modified'))
+                or (metadata.get('size') is not None and offset >= metadata['size'])):
+            os.remove(part_path)
+            offset = 0
+
+        else:
+            # Resume the partial entry, as long as the file hasn't changed on the server since
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = metadata.get('etag') or metadata['last_modified']
+
+    if n_parts > 1 and not offset:
+        r = http.head(url, headers=headers, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+
+        if r.status_code == 304:
+            print(f'Using cached download for:\n> {url}\n')
+            return metadata['path']
+
+        r.raise_for_status()
+        content_length = r.headers.get('Content-Length')
+        total_size = int(content_length) if content_length else None
+
+        if total_size and total_size >= MIN_RANGED_DOWNLOAD_SIZE and r.headers.get('Accept-Ranges') == 'bytes':
+            print(f'Downloading file to cache in {n_parts} parts:\n> {url}\n')
+
+            metadata = {
+                'url': url,
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified'),
+                'size': total_size,
+                'ranged': True,
+                'complete': False,
+            }
+            _write_metadata(meta_path, metadata)
+
+            # A failed (or interrupted) ranged download leaves holes in the preallocated file, so it can't be
+            # resumed
+            try:
+                ranged_download(url, part_path, total_size, validator=metadata['etag'] or metadata['last_modified'],
+                                n_parts=n_parts, session=session, chunk_size=chunk_size)
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+
+            return _finalize_download(url, cache_dir, metadata, previous_path, expected_sha256)
+
+    with http.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+
+        if r.status_code == 304:
+            print(f'Using cached download for:\n> {url}\n')
+            return metadata['path']
+
+        r.raise_for_status()
+
+        if r.status_code == 206 and offset:
+            print(f'Resuming download at byte {offset} of:\n> {url}\n')
+            total_size = int(r.headers['Content-Range'].split('/')[-1])
+            mode = 'ab'
+        else:
+            print(f'Downloading file to cache:\n> {url}\n')
+            content_length = r.headers.get('Content-Length')
+            total_size = int(content_length) if content_length else None
+            offset = 0
+            mode = 'wb'
+
+        # Record the validators up front so an interrupted download can be resumed
+        metadata = {
+            'url': url,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'size': total_size,
+            'complete': False,
+        }
+        _write_metadata(meta_path, metadata)
+
+        with open(part_path, mode, buffering=WRITE_BUFFER_SIZE) as fd:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                fd.write(chunk)
+
+    return _finalize_download(url, cache_dir, metadata, previous_path, expected_sha256)
+
+
+def _verify_zip(path):
+    """
+    Check that a downloaded zip file is intact, reading every member and checking its CRC, since the servers
+    don't publish checksums of their files.
+
+    Parameters:
+        path (str): The path to the zip file.
+
+    Returns:
+        error (str): A description of what's wrong with the file, or None if it's intact.
+    """
+    try:
+        with zipfile.ZipFile(path, 'r') as archive:
+            bad_member = archive.testzip()
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, zlib.error, EOFError, OSError) as e:
+        return f'not a valid zip file ({e})'
+
+    return f'bad CRC for member {bad_member}' if bad_member else None
+
+
+def _finalize_download(url, cache_dir, metadata, previous_path=None, expected_sha256=None):
+    """
+    Verify a finished download and move it from its partial file to its content-addressed path in the cache.
+
+    The size of the file must match the size reported by the server, and its checksum the expected one, if any.
+    Zip files are also checked for corrupt data (see _verify_zip), so a broken download is never cached and
+    reused.
+
+    Parameters:
+        url (str): The URL of the downloaded file.
+        cache_dir (str): The directory holding the download cache.
+        metadata (dict): The metadata record written when the download started.
+        previous_path (str): The cached file previously stored for the URL, removed once replaced (default is None).
+        expected_sha256 (str): An optional checksum the downloaded file must match.
+
+    Returns:
+        path (str): The path to the complete, cached file.
+    """
+    key = _cache_key(url)
+    meta_path = os.path.join(cache_dir, f'{key}.json')
+    part_path = os.path.join(cache_dir, f'{key}.part')
+
+    downloaded_size = os.path.getsize(part_path)
+    if metadata.get('size') is not None and downloaded_size != metadata['size']:
+        raise IOError(
+            f'Incomplete download of {url}: expected {metadata["size"]} bytes, got {downloaded_size}')
+
+    checksum = file_sha256(part_path)
+    if expected_sha256 and checksum != expected_sha256.lower():
+        os.remove(part_path)
+        raise IOError(f'Checksum mismatch for {url}: expected {expected_sha256}, got {checksum}')
+
+    extension = os.path.splitext(url.split('?')[0])[1]
+    error = _verify_zip(part_path) if extension.lower() == '.zip' else None
+    if error:
+        os.remove(part_path)
+        raise IOError(f'Corrupt download of {url}: {error}')
+
+    # Store the completed file under its checksum
+    blob_path = os.path.join(cache_dir, f'{checksum}{extension}')
+
+    os.replace(part_path, blob_path)
+    if previous_path and previous_path != blob_path and os.path.exists(previous_path):
+        os.remove(previous_path)
+
+    metadata.update({'size': downloaded_size, 'sha256': checksum, 'path': blob_path, 'complete': True})
+    _write_metadata(meta_path, metadata)
+
+    return blob_path
+
+
+def prefetch_downloads(urls, cache_dir, n_parts=8, max_workers=None):
+    """
+    Download several files into the cache concurrently, sharing one pooled session.
+
+    Parameters:
+        urls (list of str): The URLs of the files to be downloaded.
+        cache_dir (str): The directory holding the download cache.
+        n_parts (int): The number of byte ranges downloaded in parallel per large file (default is 8).
+        max_workers (int): The number of files downloaded at once (default is one per URL).
+
+    Returns:
+        paths (dict): A mapping of each URL to the path of its cached file.
+    """
+    max_workers = max_workers or len(urls)
+    session = make_session(max_workers * max(n_parts, 1))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {url: executor.submit(cached_download, url, cache_dir, session=session, n_parts=n_parts)
+                   for url in urls}
+
+        return {url: future.result() for url, future in futures.items()}
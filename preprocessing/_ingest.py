@@ -0,0 +1,192 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from preprocessing._categorical import concat_frames, is_categorical, to_categorical
+
+# CSV engines selectable with the --csv_engine option
+CSV_ENGINES = ['pandas', 'pyarrow']
+
+# Size of the blocks the pyarrow engine splits a CSV file into, each parsed on its own thread (16 MiB)
+PYARROW_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Number of rows per chunk when a CSV file is filtered while it's read
+CSV_CHUNK_SIZE = 1_000_000
+
+# Arrow types matching the dtypes used in pd.read_csv calls
+ARROW_TYPES = {
+    'int16': pa.int16(),
+    'int32': pa.int32(),
+    'int64': pa.int64(),
+    'float32': pa.float32(),
+    'float64': pa.float64(),
+    'str': pa.string(),
+    'category': pa.dictionary(pa.int32(), pa.string()),
+}
+
+
+def _arrow_to_pandas(table):
+    """
+    Convert an Arrow table to a DataFrame, keeping string columns Arrow-backed.
+
+    Dictionary columns become categoricals, with their categories sorted like pd.read_csv sorts them.
+    """
+    df = table.to_pandas(split_blocks=True, self_destruct=True,
+                         types_mapper={pa.string(): pd.StringDtype('pyarrow')}.get)
+
+    return to_categorical(df, [col for col in df.columns if is_categorical(df[col])])
+
+
+def _convert_options(usecols=None, dtype=None):
+    """
+    Build the pyarrow CSV convert options matching the usecols and dtype arguments of pd.read_csv.
+    """
+    column_types = {col: ARROW_TYPES[col_type] for col, col_type in (dtype or {}).items()}
+
+    return pa_csv.ConvertOptions(include_columns=usecols,
+                                 column_types=column_types,
+                                 strings_can_be_null=True)
+
+
+def read_csv_arrow(source, usecols=None, dtype=None, filters=None):
+    """
+    Read a CSV file into an Arrow table with pyarrow's multithreaded CSV reader. When filters are given, the file
+    is streamed batch by batch instead and only the matching rows of each batch are kept.
+
+    Parameters:
+        source (str or file-like): The path to, or the open binary stream of, the CSV file.
+        usecols (list of str): The columns to read (default is all columns).
+        dtype (dict): A mapping of column names to the dtypes used in pd.read_csv (i.e. 'int32', 'str', 'category').
+        filters (dict): A mapping of column names to the collection of values to keep (default is None).
+
+    Returns:
+        table (pa.Table): The CSV file contents, with 'category' columns dictionary encoded.
+    """
+    convert_options = _convert_options(usecols, dtype)
+
+    if not filters:
+        return pa_csv.read_csv(
+            source,
+            read_options=pa_csv.ReadOptions(
+                use_threads=True, block_size=PYARROW_BLOCK_SIZE),
+            convert_options=convert_options)
+
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(block_size=PYARROW_BLOCK_SIZE),
+        convert_options=convert_options)
+
+    batches = [_filter_batch(batch, filters) for batch in reader]
+
+    return pa.Table.from_batches(batches, schema=reader.schema)
+
+
+def read_csv_pyarrow(source, usecols=None, dtype=None, filters=None):
+    """
+    Read a CSV file with pyarrow's multithreaded CSV reader (see read_csv_arrow).
+
+    Numeric columns keep the requested NumPy dtypes, while string columns are returned as Arrow-backed
+    'string[pyarrow]' columns, so they aren't converted to Python objects.
+
+    Parameters:
+        source (str or file-like): The path to, or the open binary stream of, the CSV file.
+        usecols (list of str): The columns to read (default is all columns).
+        dtype (dict): A mapping of column names to the dtypes used in pd.read_csv (i.e. 'int32', 'str', 'category').
+        filters (dict): A mapping of column names to the collection of values to keep (default is None).
+
+    Returns:
+        df (pd.DataFrame): The CSV file contents.
+    """
+    return _arrow_to_pandas(read_csv_arrow(source, usecols, dtype, filters))
+
+
+def _filter_batch(batch, filters):
+    """
+    Keep the rows of an Arrow record batch whose values are in the given collections.
+    """
+    mask = None
+    for col, values in filters.items():
+        column = batch.column(col)
+        col_mask = pc.is_in(column, value_set=pa.array(list(values), type=column.type))
+        mask = col_mask if mask is None else pc.and_(mask, col_mask)
+
+    return batch.filter(mask)
+
+
+def _filter_chunk(chunk, filters):
+    """
+    Keep the rows of a DataFrame whose values are in the given collections.
+    """
+    mask = True
+    for col, values in filters.items():
+        mask &= chunk[col].isin(values)
+
+    return chunk[mask]
+
+
+def read_csv(source, engine='pandas', usecols=None, dtype=None, filters=None, chunksize=CSV_CHUNK_SIZE, **kwargs):
+    """
+    Read a CSV file with the selected CSV engine, keeping the same usecols and dtype contract for every engine.
+
+    When filters are given, the file is read chunk by chunk and only the rows whose values are in the given
+    collections are kept, so the rest of the file never has to be held in memory at once.
+
+    Parameters:
+        source (str or file-like): The path to, or the open binary stream of, the CSV file.
+        engine (str): The CSV engine to use, one of CSV_ENGINES (default is 'pandas').
+        usecols (list of str): The columns to read (default is all columns).
+        dtype (dict): A mapping of column names to the dtypes used in pd.read_csv (i.e. 'int32', 'str', 'category').
+        filters (dict): A mapping of column names to the collection of values to keep (default is None).
+        chunksize (int): The number of rows per chunk read by the pandas engine when filtering (default is 1000000).
+        **kwargs: Keyword arguments passed on to pd.read_csv, ignored by the pyarrow engine.
+
+    Returns:
+        df (pd.DataFrame): The CSV file contents.
+    """
+    if engine == 'pandas':
+        if not filters:
+            return pd.read_csv(source, usecols=usecols, dtype=dtype, **kwargs)
+
+        return concat_frames(iter_csv(source, engine, usecols, dtype, filters, chunksize, **kwargs), ignore_index=True)
+
+    if engine == 'pyarrow':
+        return read_csv_pyarrow(source, usecols=usecols, dtype=dtype, filters=filters)
+
+    raise ValueError(f"Unknown CSV engine '{engine}', expected one of {CSV_ENGINES}")
+
+
+def iter_csv(source, engine='pandas', usecols=None, dtype=None, filters=None, chunksize=CSV_CHUNK_SIZE, **kwargs):
+    """
+    Read a CSV file chunk by chunk with the selected CSV engine, so files larger than memory can be processed.
+
+    The pandas engine yields chunks of chunksize rows, the pyarrow engine yields one chunk per parsed block
+    (see PYARROW_BLOCK_SIZE). When filters are given, only the matching rows of each chunk are yielded.
+
+    Parameters:
+        source (str or file-like): The path to, or the open binary stream of, the CSV file.
+        engine (str): The CSV engine to use, one of CSV_ENGINES (default is 'pandas').
+        usecols (list of str): The columns to read (default is all columns).
+        dtype (dict): A mapping of column names to the dtypes used in pd.read_csv (i.e. 'int32', 'str', 'category').
+        filters (dict): A mapping of column names to the collection of values to keep (default is None).
+        chunksize (int): The number of rows per chunk read by the pandas engine (default is 1000000).
+        **kwargs: Keyword arguments passed on to pd.read_csv, ignored by the pyarrow engine.
+
+    Yields:
+        chunk (pd.DataFrame): The next chunk of the CSV file contents.
+    """
+    if engine == 'pandas':
+        for chunk in pd.read_csv(source, usecols=usecols, dtype=dtype, chunksize=chunksize, **kwargs):
+            yield _filter_chunk(chunk, filters) if filters else chunk
+
+    elif engine == 'pyarrow':
+        reader = pa_csv.open_csv(
+            source,
+            read_options=pa_csv.ReadOptions(block_size=PYARROW_BLOCK_SIZE),
+            convert_options=_convert_options(usecols, dtype))
+
+        for batch in reader:
+            batch = _filter_batch(batch, filters) if filters else batch
+            yield _arrow_to_pandas(pa.Table.from_batches([batch], schema=reader.schema))
+
+    else:
+        raise ValueError(f"Unknown CSV engine '{engine}', expected one of {CSV_ENGINES}")
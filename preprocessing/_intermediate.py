@@ -0,0 +1,149 @@
+import os
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+# Formats the processed (intermediate) files of the processors can be written in, and the file extension of each
+INTERMEDIATE_FORMATS = ['parquet', 'feather']
+INTERMEDIATE_EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather'}
+
+
+def intermediate_path(output_dir, name, intermediate_format='parquet'):
+    """
+    Get the path of the processed file of a processor.
+
+    Parameters:
+        output_dir (str): The output directory.
+        name (str): The name of the processor (i.e. 'branded').
+        intermediate_format (str): One of INTERMEDIATE_FORMATS (default is 'parquet').
+
+    Returns:
+        path (str): The path to the processed file (i.e. <output_dir>/processed_branded.parquet).
+    """
+    if intermediate_format not in INTERMEDIATE_FORMATS:
+        raise ValueError(f'intermediate_format must be one of {INTERMEDIATE_FORMATS}, got {intermediate_format!r}')
+
+    return os.path.join(output_dir, f'processed_{name}{INTERMEDIATE_EXTENSIONS[intermediate_format]}')
+
+
+def _is_feather(path):
+    """
+    Check whether a processed file is a Feather file, from its extension.
+    """
+    return path.endswith(INTERMEDIATE_EXTENSIONS['feather'])
+
+
+def write_intermediate(df, path):
+    """
+    Write a processed DataFrame in the format of its path's extension.
+
+    Parquet files are written as before. Feather files are uncompressed Arrow IPC files, which are memory-mapped
+    when they're read back (see read_intermediate_table), so reading them decodes and copies nothing.
+
+    Parameters:
+        df (pd.DataFrame): The processed DataFrame.
+        path (str): The path to the processed file (see intermediate_path).
+
+    Returns:
+        None
+    """
+    if _is_feather(path):
+        feather.write_feather(df, path, compression='uncompressed')
+    else:
+        df.to_parquet(path)
+
+
+def open_intermediate_writer(path, schema):
+    """
+    Open a writer appending Arrow tables to a processed file, in the format of its path's extension.
+
+    Parameters:
+        path (str): The path to the processed file (see intermediate_path).
+        schema (pa.Schema): The schema of the tables.
+
+    Returns:
+        writer (pq.ParquetWriter or pa.ipc.RecordBatchFileWriter): The writer, to be used as a context manager.
+    """
+    if _is_feather(path):
+        return pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression=None))
+
+    return pq.ParquetWriter(path, schema)
+
+
+def read_intermediate_schema(path):
+    """
+    Read the Arrow schema of a processed file, with the pandas metadata of the DataFrame it was written from.
+
+    Parameters:
+        path (str): The path to the processed file.
+
+    Returns:
+        schema (pa.Schema): The schema.
+    """
+    if _is_feather(path):
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema
+
+    return pq.read_schema(path)
+
+
+def intermediate_num_rows(path):
+    """
+    Count the rows of a processed file, from its metadata (Parquet) or its memory-mapped record batches (Feather).
+
+    Parameters:
+        path (str): The path to the processed file.
+
+    Returns:
+        num_rows (int): The number of rows.
+    """
+    if _is_feather(path):
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        return sum(reader.get_batch(idx).num_rows for idx in range(reader.num_record_batches))
+
+    return pq.read_metadata(path).num_rows
+
+
+def read_intermediate_table(path, columns=None):
+    """
+    Read a processed file as an Arrow table. Feather files are memory-mapped, so the columns of the table point
+    straight into the page cache (zero-copy), while Parquet files are decompressed and decoded.
+
+    Parameters:
+        path (str): The path to the processed file.
+        columns (list of str): The columns to read, or None to read all of them (default is None).
+
+    Returns:
+        table (pa.Table): The table.
+    """
+    if _is_feather(path):
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        return table if columns is None else table.select(columns)
+
+    return pq.read_table(path, columns=columns)
+
+
+def iter_intermediate_batches(path, batch_size, columns=None):
+    """
+    Read a processed file one batch of up to batch_size rows at a time (one Parquet row group, or one memory-mapped
+    Arrow record batch, at a time).
+
+    Parameters:
+        path (str): The path to the processed file.
+        batch_size (int): The maximum number of rows of a batch.
+        columns (list of str): The columns to read, or None to read all of them (default is None).
+
+    Yields:
+        batch (pa.RecordBatch): The next batch.
+    """
+    if not _is_feather(path):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns)
+        return
+
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    for idx in range(reader.num_record_batches):
+        batch = reader.get_batch(idx)
+        if columns is not None:
+            batch = batch.select(columns)
+
+        yield from pa.Table.from_batches([batch]).to_batches(max_chunksize=batch_size)
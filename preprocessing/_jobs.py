@@ -0,0 +1,122 @@
+import json
+import os
+import resource
+import sys
+import time
+import traceback
+import concurrent.futures
+from preprocessing._download import prefetch_downloads
+from preprocessing._profile import profile_stage, recorded_stages
+
+
+def _run_job(name, log_path, func, args, kwargs, prefetch_urls, cache_dir, n_parts):
+    """
+    Run a single job in a worker process, with its output written to log_path.
+
+    The job's own archives are fetched first, so its downloads overlap with the processing of the other jobs.
+    """
+    with open(log_path, 'w') as log:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        # Redirect the file descriptors rather than sys.stdout, so output of child processes is logged too
+        os.dup2(log.fileno(), sys.stdout.fileno())
+        os.dup2(log.fileno(), sys.stderr.fileno())
+
+        start = time.perf_counter()
+        first_stage = len(recorded_stages())
+        error = None
+
+        try:
+            if prefetch_urls:
+                print(f'Fetching {name} archives into download cache:\n> {cache_dir}\n')
+                with profile_stage('download'):
+                    prefetch_downloads(prefetch_urls, cache_dir, n_parts=n_parts)
+
+            with profile_stage(name):
+                func(*args, **kwargs)
+
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return {
+        'job': name,
+        'status': 'failed' if error else 'done',
+        'wall_time': round(time.perf_counter() - start, 3),
+        'cpu_time': round(usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime, 3),
+        'peak_memory_mb': round(usage.ru_maxrss / 1024, 1),
+        'log': log_path,
+        'stages': recorded_stages()[first_stage:],
+    }
+
+
+def _run_job_process(*args):
+    """
+    Run a single job in a fresh process of its own, so its resource usage is measured on its own.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_run_job, *args).result()
+
+
+def run_jobs(jobs, log_dir, max_jobs=None, cache_dir=None, n_parts=8):
+    """
+    Run independent jobs (i.e. the processors) in separate processes, with at most max_jobs running at once.
+
+    The jobs are started in the given order, so the longest one should come first. Every job's output is written
+    to <log_dir>/<job>.log, and the timings of all jobs to <log_dir>/timings.json.
+
+    Parameters:
+        jobs (list of dict): The jobs, each with a 'name', a module level 'func' with its 'args' and 'kwargs',
+            and optionally the 'urls' to fetch into the download cache before func is called.
+        log_dir (str): The directory the logs and timings are written to.
+        max_jobs (int): The maximum number of jobs running at once (default is all of them).
+        cache_dir (str): The directory holding the download cache (default is None).
+        n_parts (int): The number of byte ranges downloaded in parallel per large archive (default is 8).
+
+    Returns:
+        timings (list of dict): The status, wall time, CPU time, and peak memory of every job, and the stages
+            recorded while it ran when profiling is enabled (see _profile).
+    """
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    max_jobs = max_jobs or len(jobs)
+    start = time.perf_counter()
+
+    # Every job gets a process of its own, the threads only limit how many of them run at once
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_jobs, len(jobs))) as executor:
+        futures = []
+        for job in jobs:
+            log_path = os.path.join(log_dir, f"{job['name']}.log")
+            print(f"Scheduling {job['name']} job, logging to:\n> {log_path}\n")
+
+            futures.append(executor.submit(_run_job_process, job['name'], log_path, job['func'], job.get('args', ()),
+                                           job.get('kwargs', {}), job.get('urls'), cache_dir, n_parts))
+
+        timings = []
+        for future in concurrent.futures.as_completed(futures):
+            timing = future.result()
+            timings.append(timing)
+            print(f"Finished {timing['job']} job ({timing['status']}) in {timing['wall_time']}s:\n"
+                  f"> cpu time: {timing['cpu_time']}s, peak memory: {timing['peak_memory_mb']} MB\n")
+
+    # Keep the timings in job order
+    timings.sort(key=lambda timing: [job['name'] for job in jobs].index(timing['job']))
+
+    with open(os.path.join(log_dir, 'timings.json'), 'w') as f:
+        json.dump({'wall_time': round(time.perf_counter() - start, 3), 'jobs': timings}, f, indent=2)
+
+    failed = [timing for timing in timings if timing['status'] == 'failed']
+    if failed:
+        raise RuntimeError('Failed jobs, see their logs:\n' +
+                           '\n'.join(f"> {timing['job']}: {timing['log']}" for timing in failed))
+
+    return timings
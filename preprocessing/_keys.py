@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+
+def rank_keys(values):
+    """
+    Replace a text column of a small table (i.e. the descriptions of food.csv, or the names of nutrient.csv) with
+    integer surrogate keys, so the joins, groupbys, and pivots of the large tables carry and compare integers,
+    and the text is attached only at the end (see decode_keys).
+
+    The keys are the codes of pd.factorize(sort=True), which rank like the text they replace (categoricals in
+    the order of their categories), so grouping and sorting on them gives the groups and the row order the text
+    would. Missing values get the key -1, so rows with a missing key have to be left out of groupbys explicitly
+    (see has_keys).
+
+    Parameters:
+        values (pd.Series): The text column.
+
+    Returns:
+        keys (np.ndarray): The int32 key of every value.
+        key_values (pd.Index): The text of every key, for decode_keys.
+    """
+    codes, uniques = pd.factorize(values, sort=True)
+
+    return codes.astype(np.int32), pd.Index(uniques)
+
+
+def has_keys(df, columns):
+    """
+    Find the rows of a DataFrame whose surrogate keys (see rank_keys) are all present, the rows a groupby on the
+    text would keep.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame holding the key columns.
+        columns (list of str): The key columns.
+
+    Returns:
+        mask (np.ndarray): A boolean mask of the rows with every key present.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for col in columns:
+        mask &= df[col].to_numpy() >= 0
+
+    return mask
+
+
+def decode_keys(df, key_values):
+    """
+    Attach the text back to surrogate key columns made by rank_keys, in place. Categorical columns come back
+    with their categories.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame holding the key columns.
+        key_values (dict): A mapping of every key column to the text of its keys, as returned by rank_keys.
+
+    Returns:
+        df (pd.DataFrame): The DataFrame.
+    """
+    for col, values in key_values.items():
+        if col in df.columns:
+            df[col] = pd.api.extensions.take(values, df[col].to_numpy(), allow_fill=True)
+
+    return df
+
+
+def decode_columns(df, key_values):
+    """
+    Rename the columns of a DataFrame that hold surrogate keys (i.e. the nutrient columns of a pivot on the keys of
+    the nutrient names) to the text of their keys.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame.
+        key_values (pd.Index): The text of every key, as returned by rank_keys.
+
+    Returns:
+        df (pd.DataFrame): The DataFrame, with the columns renamed.
+    """
+    return df.rename(columns={key: str(key_values[key]) for key in df.columns if isinstance(key, (int, np.integer))})
@@ -0,0 +1,579 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.acero as acero
+import pyarrow.compute as pc
+from preprocessing import _constants
+from preprocessing._categorical import is_categorical, to_categorical
+from preprocessing._ingest import _arrow_to_pandas, read_csv_arrow
+from preprocessing._profile import profile_stage
+from preprocessing._schema import COLUMN_SCHEMA
+from preprocessing._utils import fillna_and_set_dtypes, find_archive_member, read_archive_csv
+
+# Backends selectable with the --backend option
+BACKENDS = ['pandas', 'arrow']
+
+# Join types of the plans, and the Acero join types they run as
+JOIN_TYPES = {'left': 'left outer', 'inner': 'inner'}
+
+# Prefix of the columns numbering the rows of every source, which the arrow backend sorts its result by to give
+# the rows in the order pd.merge gives them
+ROW_ID_PREFIX = '__row_'
+
+
+# ---------------------------------------------------------------------
+# ---- Building plans ----
+# ---------------------------------------------------------------------
+#
+# A plan is a tree of nodes, every node a dict with an 'op' key:
+# - scan: a CSV file of a zip file, read when the plan runs
+# - frame: a DataFrame already in memory
+# - filter: the rows of its input matching all its predicates
+# - project: a subset of the columns of its input
+# - join: its left and right inputs joined on key columns, like pd.merge
+#
+# Nodes are never changed once built, optimize returns new ones.
+
+
+def scan_archive_csv(archive, filename, usecols, dtype, rename=None, csv_engine='pandas', fill=True):
+    """
+    Build a plan reading a CSV file straight out of a zip file, when the plan runs (see collect). The zip file
+    must stay open until then.
+
+    Parameters:
+        archive (zipfile.ZipFile): The opened zip file.
+        filename (str): The file name of the CSV file within the zip file (i.e. 'food.csv').
+        usecols (list of str): The columns to read, optimize only reads the ones the plan uses.
+        dtype (dict): A mapping of column names to the dtypes used in pd.read_csv (i.e. 'int32', 'str', 'category').
+        rename (dict): A mapping of the column names of the file to the column names of the plan (default is None).
+        csv_engine (str): The CSV engine the pandas backend reads the file with, the arrow backend always reads it
+            with pyarrow (default is 'pandas').
+        fill (bool): Whether to fill the missing values and set the dtypes of the columns as read (see
+            fillna_and_set_dtypes) (default is True).
+
+    Returns:
+        plan (dict): The scan node.
+    """
+    return {'op': 'scan', 'archive': archive, 'filename': filename, 'usecols': list(usecols), 'dtype': dtype,
+            'rename': rename or {}, 'csv_engine': csv_engine, 'fill': fill, 'predicates': []}
+
+
+def from_frame(df, fill=False):
+    """
+    Build a plan reading a DataFrame, leaving plans as they are (so processors can take either).
+
+    Parameters:
+        df (pd.DataFrame or dict): The DataFrame, or a plan.
+        fill (bool): Whether to fill the missing values and set the dtypes of the DataFrame (see
+            fillna_and_set_dtypes), in place, when the plan runs (default is False).
+
+    Returns:
+        plan (dict): The frame node.
+    """
+    if isinstance(df, dict):
+        return df
+
+    return {'op': 'frame', 'frame': df, 'columns': list(df.columns), 'fill': fill, 'predicates': []}
+
+
+def isin(column, values):
+    """
+    Build a predicate keeping the rows whose value is in the given collection (missing values never are).
+    """
+    return {'kind': 'isin', 'column': column, 'values': list(values)}
+
+
+def not_equal(column, value):
+    """
+    Build a predicate keeping the rows whose value differs from the given value (missing values always do, like
+    in pandas).
+    """
+    return {'kind': 'not_equal', 'column': column, 'value': value}
+
+
+def relevant_nutrient_predicates():
+    """
+    Build the predicates keeping the rows of the relevant nutrients, like filter_relevent_nutrients.
+    """
+    return [isin('nutrient_name', _constants.RELEVANT_NUTRIENTS), not_equal('nutrient_unit', 'kJ')]
+
+
+def filter_rows(plan, *predicates):
+    """
+    Build a plan keeping the rows of a plan that match all the predicates (see isin and not_equal).
+    """
+    return {'op': 'filter', 'input': plan, 'predicates': list(predicates)}
+
+
+def drop(plan, columns):
+    """
+    Build a plan leaving columns out of a plan.
+    """
+    return {'op': 'project', 'input': plan,
+            'columns': [col for col in output_columns(plan) if col not in columns]}
+
+
+def join(left, right, on, how='left'):
+    """
+    Build a plan joining two plans on key columns, like pd.merge(left, right, on=on, how=how): the rows keep the
+    order of the left rows, and the columns are the left columns followed by the right columns but the keys.
+
+    Parameters:
+        left (dict): The left plan.
+        right (dict): The right plan.
+        on (str or list of str): The key columns.
+        how (str): The join type, one of JOIN_TYPES (default is 'left').
+
+    Returns:
+        plan (dict): The join node.
+    """
+    on = [on] if isinstance(on, str) else list(on)
+
+    if how not in JOIN_TYPES:
+        raise ValueError(f"Unknown join type '{how}', expected one of {list(JOIN_TYPES)}")
+
+    shared = (set(output_columns(left)) & set(output_columns(right))) - set(on)
+    if shared:
+        raise ValueError(f'Columns {sorted(shared)} are on both sides of the join, drop them from one side first')
+
+    return {'op': 'join', 'left': left, 'right': right, 'on': on, 'how': how}
+
+
+def output_columns(plan):
+    """
+    Get the columns a plan gives, in order.
+    """
+    op = plan['op']
+
+    if op == 'scan':
+        return [plan['rename'].get(col, col) for col in plan['usecols']]
+
+    if op == 'frame':
+        return list(plan['columns'])
+
+    if op == 'filter':
+        return output_columns(plan['input'])
+
+    if op == 'project':
+        return list(plan['columns'])
+
+    right = [col for col in output_columns(plan['right']) if col not in plan['on']]
+
+    return output_columns(plan['left']) + right
+
+
+# ---------------------------------------------------------------------
+# ---- Optimizing plans ----
+# ---------------------------------------------------------------------
+
+
+def optimize(plan):
+    """
+    Rewrite a plan so it reads and joins as few rows and columns as possible, without changing its result:
+
+    1. Predicate pushdown: filters are moved down the plan, into the sources whose columns they test, so rows
+       are dropped as they're read instead of after the joins. A left join whose right columns are filtered
+       with a predicate that drops missing values (i.e. isin) can't keep the left rows without a match, so it
+       becomes an inner join and the filter moves into its right side.
+    2. Projection pushdown: the sources only read the columns the rest of the plan uses.
+
+    Sources test their predicates once their columns are filled (see fillna_and_set_dtypes), like the filters
+    they're pushed down from did, but scans test the ones they can while their file is read.
+
+    Parameters:
+        plan (dict): The plan.
+
+    Returns:
+        plan (dict): The optimized plan.
+    """
+    plan = _push_predicates(plan, [])
+
+    return _prune_columns(plan, set(output_columns(plan)))
+
+
+def _push_predicates(plan, predicates):
+    """
+    Move predicates down a plan, as far as the columns they test go.
+    """
+    op = plan['op']
+
+    if op in ('scan', 'frame'):
+        return {**plan, 'predicates': plan['predicates'] + predicates}
+
+    if op == 'filter':
+        return _push_predicates(plan['input'], plan['predicates'] + predicates)
+
+    if op == 'project':
+        return {**plan, 'input': _push_predicates(plan['input'], predicates)}
+
+    left_cols = set(output_columns(plan['left']))
+    how = plan['how']
+
+    left, right, remaining = [], [], []
+    for predicate in predicates:
+        if predicate['column'] in plan['on']:
+            left.append(predicate)
+        elif predicate['column'] in left_cols:
+            left.append(predicate)
+        else:
+            right.append(predicate)
+
+    # A filter dropping the missing values of the right columns drops the left rows without a match
+    if how == 'left' and any(predicate['kind'] == 'isin' for predicate in right):
+        how = 'inner'
+
+    if how == 'inner':
+        right += [predicate for predicate in left if predicate['column'] in plan['on']]
+    else:
+        remaining, right = right, []
+
+    joined = {**plan, 'how': how,
+              'left': _push_predicates(plan['left'], left),
+              'right': _push_predicates(plan['right'], right)}
+
+    return filter_rows(joined, *remaining) if remaining else joined
+
+
+def _prune_columns(plan, required):
+    """
+    Narrow the sources of a plan to the columns required above them.
+    """
+    op = plan['op']
+
+    if op in ('scan', 'frame'):
+        required = required | {predicate['column'] for predicate in plan['predicates']}
+
+        if op == 'scan':
+            return {**plan, 'usecols': [col for col in plan['usecols']
+                                        if plan['rename'].get(col, col) in required]}
+
+        return {**plan, 'columns': [col for col in plan['columns'] if col in required]}
+
+    if op == 'filter':
+        required = required | {predicate['column'] for predicate in plan['predicates']}
+        return {**plan, 'input': _prune_columns(plan['input'], required)}
+
+    if op == 'project':
+        columns = [col for col in plan['columns'] if col in required]
+        return {**plan, 'columns': columns, 'input': _prune_columns(plan['input'], set(columns))}
+
+    required = required | set(plan['on'])
+
+    return {**plan,
+            'left': _prune_columns(plan['left'], required & set(output_columns(plan['left']))),
+            'right': _prune_columns(plan['right'], required & set(output_columns(plan['right'])))}
+
+
+# ---------------------------------------------------------------------
+# ---- Running plans ----
+# ---------------------------------------------------------------------
+
+
+def collect(plan, backend='pandas'):
+    """
+    Optimize a plan (see optimize) and run it with the selected backend:
+    - pandas: the scans are read with their CSV engine, and the joins run with pd.merge
+    - arrow: the scans are read with pyarrow's multithreaded CSV reader, and the joins, filters, and the final
+      ordering run as an Acero plan with multithreaded Arrow kernels, on the key and filter columns only. The
+      other columns are gathered from the sources once the rows of the result are known, so the text the joins
+      repeat (i.e. the ingredients of a food, for every nutrient) is shared like pd.merge shares it instead of
+      being copied for every row.
+
+    Both give the same rows in the same order, with the same columns and dtypes.
+
+    Parameters:
+        plan (dict): The plan.
+        backend (str): The backend to use, one of BACKENDS (default is 'pandas').
+
+    Returns:
+        df (pd.DataFrame): The result of the plan.
+    """
+    columns = output_columns(plan)
+    plan = optimize(plan)
+
+    if backend == 'pandas':
+        df = _run_pandas(plan)
+
+    elif backend == 'arrow':
+        df = _run_arrow(plan)
+
+    else:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+    return df[columns] if list(df.columns) != columns else df
+
+
+def _pandas_mask(df, predicates):
+    """
+    Match the rows of a DataFrame against predicates.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for predicate in predicates:
+        values = df[predicate['column']]
+
+        if predicate['kind'] == 'isin':
+            mask &= values.isin(predicate['values']).to_numpy()
+        else:
+            mask &= (values != predicate['value']).to_numpy()
+
+    return mask
+
+
+def _read_filters(plan):
+    """
+    Split the predicates of a scan node into the filters applied while its file is read, and the predicates
+    applied once its columns are filled (the ones an isin of the fill value, or a not_equal, could match).
+
+    Returns:
+        filters (dict): A mapping of the columns of the file to the collection of values to keep, or None.
+        predicates (list of dict): The predicates left.
+    """
+    columns = {plan['rename'].get(col, col): col for col in plan['usecols']}
+
+    filters, predicates = {}, []
+    for predicate in plan['predicates']:
+        spec = COLUMN_SCHEMA.get(predicate['column'], {})
+        fill = spec.get('fill') if plan['fill'] else None
+
+        if predicate['kind'] == 'isin' and (fill is None or fill not in predicate['values']):
+            filters[columns[predicate['column']]] = predicate['values']
+        else:
+            predicates.append(predicate)
+
+    return filters or None, predicates
+
+
+def _read_scan(plan, backend):
+    """
+    Read the CSV file of a scan node, with its columns renamed and filled, and its predicates applied.
+    """
+    filters, predicates = _read_filters(plan)
+    dtype = {col: plan['dtype'][col] for col in plan['usecols'] if col in plan['dtype']}
+
+    if backend == 'arrow':
+        # Text is converted to Python strings, which the rows gathered from the result share, unless the CSV engine
+        # is pyarrow, whose Arrow-backed strings the pandas backend gives (see _ingest.read_csv_pyarrow)
+        with profile_stage('read_csv') as stage:
+            with plan['archive'].open(find_archive_member(plan['archive'], plan['filename'])) as f:
+                table = read_csv_arrow(f, usecols=plan['usecols'], dtype=dtype, filters=filters)
+
+            if plan['csv_engine'] == 'pyarrow':
+                df = _arrow_to_pandas(table)
+            else:
+                df = table.to_pandas(split_blocks=True, self_destruct=True)
+                df = to_categorical(df, [col for col in df.columns if is_categorical(df[col])])
+            stage.rows_out = len(df)
+
+    else:
+        df = read_archive_csv(plan['archive'], plan['filename'], plan['csv_engine'],
+                              usecols=plan['usecols'], dtype=dtype, filters=filters, low_memory=False)
+
+    df.rename(columns=plan['rename'], inplace=True)
+
+    if plan['fill']:
+        df = fillna_and_set_dtypes(df)
+
+    return df[_pandas_mask(df, predicates)] if predicates else df
+
+
+def _read_frame(plan):
+    """
+    Get the DataFrame of a frame node, with its columns narrowed and filled, and its predicates applied.
+    """
+    df = plan['frame']
+
+    if plan['columns'] != list(df.columns):
+        df = df[plan['columns']]
+
+    if plan['fill']:
+        df = fillna_and_set_dtypes(df)
+
+    return df[_pandas_mask(df, plan['predicates'])] if plan['predicates'] else df
+
+
+def _run_pandas(plan):
+    """
+    Run an optimized plan with pandas.
+    """
+    op = plan['op']
+
+    if op == 'scan':
+        return _read_scan(plan, 'pandas')
+
+    if op == 'frame':
+        return _read_frame(plan)
+
+    if op == 'filter':
+        df = _run_pandas(plan['input'])
+        return df[_pandas_mask(df, plan['predicates'])]
+
+    if op == 'project':
+        df = _run_pandas(plan['input'])
+        return df.drop(columns=[col for col in df.columns if col not in plan['columns']])
+
+    return pd.merge(_run_pandas(plan['left']), _run_pandas(plan['right']), on=plan['on'], how=plan['how'])
+
+
+def _plan_columns(plan):
+    """
+    Get the columns the joins and filters of a plan test, the only ones the Acero plan needs.
+    """
+    op = plan['op']
+
+    if op in ('scan', 'frame'):
+        return set()
+
+    if op == 'filter':
+        return _plan_columns(plan['input']) | {predicate['column'] for predicate in plan['predicates']}
+
+    if op == 'project':
+        return _plan_columns(plan['input'])
+
+    return _plan_columns(plan['left']) | _plan_columns(plan['right']) | set(plan['on'])
+
+
+def _expression(predicates):
+    """
+    Build the Arrow expression matching the rows against predicates, like _pandas_mask.
+    """
+    expression = None
+    for predicate in predicates:
+        field = pc.field(predicate['column'])
+
+        if predicate['kind'] == 'isin':
+            condition = field.isin(pa.array(predicate['values']))
+        else:
+            condition = (field != predicate['value']) | field.is_null()
+
+        expression = condition if expression is None else expression & condition
+
+    return expression
+
+
+def _declare(plan, plan_columns, sources, left_joins):
+    """
+    Declare an optimized plan as an Acero plan, reading its sources.
+
+    Every source is declared with the columns of plan_columns it has, and a column numbering its rows. The
+    sources are recorded in sources, by the name of that column, in the order they're joined, and the left joins
+    in left_joins, as the declarations of their sides, their keys, and the row number columns of their right side.
+
+    Returns:
+        declaration (acero.Declaration): The plan.
+        fields (list of str): The columns of plan_columns the plan gives.
+        origins (dict): A mapping of the columns the plan gives to the row number column of their source.
+        orders (list of str): The row number columns the plan gives, the order of its rows in pd.merge is
+            theirs.
+    """
+    op = plan['op']
+
+    if op in ('scan', 'frame'):
+        df = _read_scan(plan, 'arrow') if op == 'scan' else _read_frame(plan)
+
+        order = f'{ROW_ID_PREFIX}{len(sources)}'
+        sources[order] = df
+
+        # The row ids come first, so a source none of whose columns are tested (i.e. a scan collected on its own)
+        # still has a row for every row of the frame
+        fields = [col for col in df.columns if col in plan_columns]
+        table = pa.table({order: pa.array(np.arange(len(df), dtype=np.int64))})
+        for field, values in zip(fields, pa.Table.from_pandas(df[fields], preserve_index=False).columns):
+            if pa.types.is_dictionary(values.type):
+                values = values.cast(values.type.value_type)
+            table = table.append_column(field, values)
+
+        declaration = acero.Declaration('table_source', acero.TableSourceNodeOptions(table))
+        return declaration, fields, {col: order for col in df.columns}, [order]
+
+    if op == 'filter':
+        declaration, fields, origins, orders = _declare(plan['input'], plan_columns, sources, left_joins)
+        declaration = acero.Declaration('filter', acero.FilterNodeOptions(_expression(plan['predicates'])),
+                                        inputs=[declaration])
+        return declaration, fields, origins, orders
+
+    if op == 'project':
+        declaration, fields, origins, orders = _declare(plan['input'], plan_columns, sources, left_joins)
+        fields = [col for col in fields if col in plan['columns']]
+        declaration = acero.Declaration('project', acero.ProjectNodeOptions(
+            [pc.field(col) for col in fields + orders], fields + orders), inputs=[declaration])
+        return declaration, fields, {col: origins[col] for col in plan['columns']}, orders
+
+    left, left_fields, left_origins, left_orders = _declare(plan['left'], plan_columns, sources, left_joins)
+    right, right_fields, right_origins, right_orders = _declare(plan['right'], plan_columns, sources, left_joins)
+
+    if plan['how'] == 'left':
+        left_joins.append((left, right, plan['on'], right_orders))
+
+    right_fields = [col for col in right_fields if col not in plan['on']]
+
+    declaration = acero.Declaration('hashjoin', acero.HashJoinNodeOptions(
+        JOIN_TYPES[plan['how']], plan['on'], plan['on'],
+        left_output=left_fields + left_orders, right_output=right_fields + right_orders),
+        inputs=[left, right])
+
+    origins = {**left_origins, **{col: order for col, order in right_origins.items() if col not in plan['on']}}
+
+    return declaration, left_fields + right_fields, origins, left_orders + right_orders
+
+
+def _promoted_orders(plan, sources, origins, positions, left_joins):
+    """
+    Find the sources whose integer and boolean columns pd.merge turns to float and object: the ones on the right
+    side of a left join with a left row without a match, even when a later join or filter drops that row (when
+    it doesn't, the missing rows of the result promote them anyway).
+
+    Returns:
+        promoted (set of str): The row number columns of the sources.
+    """
+    promoted = set()
+
+    for left, right, on, right_orders in left_joins:
+        candidates = {origins[col] for col in output_columns(plan) if origins[col] in right_orders and
+                      isinstance(sources[origins[col]][col].dtype, np.dtype) and
+                      sources[origins[col]][col].dtype.kind in 'iub' and (positions[origins[col]] >= 0).all()}
+
+        if not candidates - promoted:
+            continue
+
+        # The left rows without a match, of the join on its own
+        unmatched = acero.Declaration('hashjoin', acero.HashJoinNodeOptions(
+            'left anti', on, on, left_output=on, right_output=[]), inputs=[left, right])
+
+        if unmatched.to_table(use_threads=True).num_rows:
+            promoted |= candidates
+
+    return promoted
+
+
+def _run_arrow(plan):
+    """
+    Run an optimized plan as an Acero plan, then gather the columns of the result from its sources.
+    """
+    sources, left_joins = {}, []
+    declaration, _, origins, orders = _declare(plan, _plan_columns(plan), sources, left_joins)
+
+    # Sort the rows like pd.merge orders them: by the rows of the left source, then by the rows of the sources
+    # joined to it, in join order (the left rows without a match have no right row, and come out once)
+    declaration = acero.Declaration('order_by', acero.OrderByNodeOptions(
+        [(order, 'ascending') for order in orders], null_placement='at_end'), inputs=[declaration])
+
+    table = declaration.to_table(use_threads=True)
+    positions = {order: table.column(order).fill_null(-1).to_numpy() for order in set(origins.values())}
+    del table
+
+    promoted = _promoted_orders(plan, sources, origins, positions, left_joins)
+
+    # Gather the columns by row number, the missing rows of the left joins give missing values like pd.merge
+    columns = {}
+    for col in output_columns(plan):
+        values = sources[origins[col]][col]
+        values = values.array if pd.api.types.is_extension_array_dtype(values.dtype) else values.to_numpy()
+        rows = positions[origins[col]]
+
+        if origins[col] in promoted:
+            # Gathered with a missing row, which take promotes the dtype for, then left out
+            columns[col] = pd.api.extensions.take(values, np.append(rows, -1), allow_fill=True)[:-1]
+        else:
+            columns[col] = pd.api.extensions.take(values, rows, allow_fill=True)
+
+    return pd.DataFrame(columns)
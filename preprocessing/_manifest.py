@@ -0,0 +1,156 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+from preprocessing._download import file_sha256, get_cache_entry
+
+# Name of the build manifest kept in the output directory
+MANIFEST_FILENAME = 'build_manifest.json'
+
+# Release version in the name of an FDC archive (i.e. '2024-10-31' or '2018-04')
+RELEASE_VERSION_PATTERN = re.compile(r'_(\d{4}-\d{2}(?:-\d{2})?)\.zip$')
+
+
+def release_version(url):
+    """
+    Extract the release version from the URL of an FDC archive.
+
+    Parameters:
+        url (str): The archive URL (i.e. '.../FoodData_Central_sr_legacy_food_csv_2018-04.zip').
+
+    Returns:
+        version (str): The release version (i.e. '2018-04'), or None if the URL doesn't carry one.
+    """
+    match = RELEASE_VERSION_PATTERN.search(url.split('?')[0])
+
+    return match.group(1) if match else None
+
+
+def code_hash(func):
+    """
+    Hash the code a processor runs: the source of its own module and of the helper modules of the package (the
+    underscore modules), so a change to either rebuilds its output.
+
+    Parameters:
+        func (callable): The processor (i.e. process_srlegacy).
+
+    Returns:
+        digest (str): The hex digest of the sources.
+    """
+    module_path = sys.modules[func.__module__].__file__
+    helper_paths = sorted(glob.glob(os.path.join(os.path.dirname(module_path), '_*.py')))
+
+    digest = hashlib.sha256()
+    for path in [module_path] + helper_paths:
+        with open(path, 'rb') as f:
+            digest.update(os.path.basename(path).encode('utf-8') + b'\0' + f.read())
+
+    return digest.hexdigest()
+
+
+def build_entry(func, urls, cache_dir):
+    """
+    Describe the inputs and the code of a processor, as recorded in the build manifest.
+
+    Every input is identified by its URL, its release version, and the checksum of its archive in the download
+    cache (None for archives that aren't downloaded as a whole, i.e. FoodData_Central_csv, whose version
+    identifies it).
+
+    Parameters:
+        func (callable): The processor.
+        urls (list of str): The URLs of the archives it reads.
+        cache_dir (str): The directory holding the download cache.
+
+    Returns:
+        entry (dict): The inputs and the code hash of the processor.
+    """
+    inputs = []
+    for url in urls:
+        inputs.append({
+            'url': url,
+            'version': release_version(url),
+            'sha256': get_cache_entry(url, cache_dir).get('sha256'),
+        })
+
+    return {'inputs': inputs, 'code_hash': code_hash(func)}
+
+
+def read_manifest(output_dir):
+    """
+    Read the build manifest of an output directory.
+
+    Parameters:
+        output_dir (str): The output directory.
+
+    Returns:
+        manifest (dict): A mapping of every intermediate file to its build entry, or an empty dict if there's no
+            manifest or it can't be read.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {}
+
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(output_dir, manifest):
+    """
+    Atomically write the build manifest of an output directory.
+
+    Parameters:
+        output_dir (str): The output directory.
+        manifest (dict): A mapping of every intermediate file to its build entry.
+
+    Returns:
+        None
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    tmp_path = f'{manifest_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def is_up_to_date(entry, manifest, output_path):
+    """
+    Check whether an intermediate file was built from the same inputs and code, and is still the file that was
+    built.
+
+    Parameters:
+        entry (dict): The current build entry of the processor (see build_entry).
+        manifest (dict): The build manifest of the previous runs.
+        output_path (str): The path to the intermediate file.
+
+    Returns:
+        up_to_date (bool): Whether the processor can be skipped.
+    """
+    previous = manifest.get(os.path.basename(output_path))
+
+    if not previous or not os.path.exists(output_path):
+        return False
+
+    return (previous.get('inputs') == entry['inputs'] and previous.get('code_hash') == entry['code_hash']
+            and previous.get('output_sha256') == file_sha256(output_path))
+
+
+def record_build(manifest, entry, output_path):
+    """
+    Record a freshly built intermediate file in the build manifest.
+
+    Parameters:
+        manifest (dict): The build manifest, changed in place.
+        entry (dict): The build entry of the processor (see build_entry).
+        output_path (str): The path to the intermediate file.
+
+    Returns:
+        manifest (dict): The build manifest.
+    """
+    manifest[os.path.basename(output_path)] = {**entry, 'output_sha256': file_sha256(output_path)}
+
+    return manifest
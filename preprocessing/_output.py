@@ -0,0 +1,195 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from preprocessing import _constants
+from preprocessing._profile import profiled
+from preprocessing._schema import ARROW_TYPES, COLUMN_SCHEMA
+
+# Formats the final output can be written in, and the file extension of each ('dataset' is a directory)
+OUTPUT_FORMATS = ['csv', 'parquet', 'feather', 'dataset']
+FORMAT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather', 'dataset': ''}
+
+# Extensions of --filename that select a format, when --format isn't given
+EXTENSION_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather',
+                     '.arrow': 'feather', '.ipc': 'feather'}
+
+# Compression of the columnar formats, and the number of rows per Parquet row group
+COMPRESSION = 'zstd'
+PARQUET_ROW_GROUP_SIZE = 250_000
+
+# Text columns with few distinct values, dictionary encoded in Parquet
+DICTIONARY_COLUMNS = ['usda_data_source', 'data_type', 'category', 'brand_owner', 'food_common_category',
+                      'portion_unit', 'portion_modifier', 'std_portion_unit']
+
+# Column the 'dataset' format is partitioned by
+DATASET_PARTITION_COLUMN = 'data_type'
+
+# Arrow schema of the columnar formats, derived from the column schema, the same whatever the data holds
+OUTPUT_SCHEMA = pa.schema([
+    (col, ARROW_TYPES[COLUMN_SCHEMA[col].get('output_dtype', COLUMN_SCHEMA[col]['dtype'])])
+    for col in _constants.OUTPUT_COLUMNS
+])
+
+
+def resolve_output(filename, output_format=None):
+    """
+    Pick the output format and the output filename.
+
+    Without an explicit format, the extension of filename selects it, falling back to csv. A filename without an
+    extension, or with the extension of another format (i.e. the default .csv filename with --format parquet),
+    gets the extension of the format.
+
+    Parameters:
+        filename (str): The output filename (i.e. the --filename argument).
+        output_format (str): One of OUTPUT_FORMATS, or None to use the extension of filename (default is None).
+
+    Returns:
+        output_format (str): The output format.
+        filename (str): The output filename.
+    """
+    file_ext = os.path.splitext(filename)[1].lower()
+
+    if output_format is None:
+        output_format = EXTENSION_FORMATS.get(file_ext, 'csv')
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'output_format must be one of {OUTPUT_FORMATS}, got {output_format!r}')
+
+    if not file_ext:
+        filename = f'{filename}{FORMAT_EXTENSIONS[output_format]}'
+
+    elif EXTENSION_FORMATS.get(file_ext, output_format) != output_format:
+        filename = f'{os.path.splitext(filename)[0]}{FORMAT_EXTENSIONS[output_format]}'
+
+    return output_format, filename
+
+
+def to_output_table(df):
+    """
+    Convert the postprocessed DataFrame to an Arrow table with OUTPUT_SCHEMA.
+
+    Numbers stored as text (i.e. std_portion_amount, which holds 'no_value' where no quantity was parsed) are
+    converted to float32, with nulls where the text isn't a number.
+
+    Parameters:
+        df (pd.DataFrame): The output of postprocess_stacked_df.
+
+    Returns:
+        table (pa.Table): The output table.
+    """
+    arrays = []
+    for field in OUTPUT_SCHEMA:
+        values = df[field.name]
+
+        if pa.types.is_floating(field.type):
+            values = pd.to_numeric(values, errors='coerce')
+
+        arrays.append(pa.array(values, type=field.type, from_pandas=True))
+
+    return pa.Table.from_arrays(arrays, schema=OUTPUT_SCHEMA)
+
+
+@profiled('write_output')
+def write_output(df, path, output_format='csv'):
+    """
+    Write the postprocessed DataFrame in the given format.
+
+    csv is written as before. parquet is a single zstd compressed file with row groups of PARQUET_ROW_GROUP_SIZE
+    rows, feather is an Arrow IPC file, and dataset is a directory of Parquet files partitioned by data_type
+    (i.e. <path>/data_type=branded/part-0.parquet). The columnar formats share OUTPUT_SCHEMA.
+
+    Parameters:
+        df (pd.DataFrame): The output of postprocess_stacked_df.
+        path (str): The output file path (the directory path for the dataset format).
+        output_format (str): One of OUTPUT_FORMATS (default is 'csv').
+
+    Returns:
+        None
+    """
+    if output_format == 'csv':
+        df.to_csv(path, index=False)
+        return
+
+    table = to_output_table(df)
+
+    if output_format == 'parquet':
+        pq.write_table(table, path, compression=COMPRESSION, row_group_size=PARQUET_ROW_GROUP_SIZE,
+                       use_dictionary=DICTIONARY_COLUMNS)
+
+    elif output_format == 'feather':
+        feather.write_feather(table, path, compression=COMPRESSION)
+
+    elif output_format == 'dataset':
+        # Partitions written by a previous run are replaced
+        ds.write_dataset(
+            table, path, format='parquet',
+            partitioning=ds.partitioning(pa.schema([OUTPUT_SCHEMA.field(DATASET_PARTITION_COLUMN)]), flavor='hive'),
+            file_options=ds.ParquetFileFormat().make_write_options(
+                compression=COMPRESSION, use_dictionary=DICTIONARY_COLUMNS),
+            max_rows_per_group=PARQUET_ROW_GROUP_SIZE, existing_data_behavior='delete_matching')
+
+    else:
+        raise ValueError(f'output_format must be one of {OUTPUT_FORMATS}, got {output_format!r}')
+
+
+@profiled('write_output')
+def write_output_batches(batches, path, output_format='csv'):
+    """
+    Write postprocessed batches in the given format as they come, so only one batch is held in memory. The output
+    is the one write_output gives for the batches concatenated, except that the Parquet row groups and the Arrow
+    record batches don't span batches.
+
+    Parameters:
+        batches (iterable of pd.DataFrame): The postprocessed batches (i.e. _stack.iter_stacked_batches).
+        path (str): The output file path (the directory path for the dataset format).
+        output_format (str): One of OUTPUT_FORMATS (default is 'csv').
+
+    Returns:
+        rows (int): The number of rows written.
+    """
+    rows = 0
+
+    def output_tables():
+        nonlocal rows
+        for batch in batches:
+            rows += len(batch)
+            yield to_output_table(batch)
+
+    if output_format == 'csv':
+        # Written like DataFrame.to_csv writes to a path, with the header once
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            for batch in batches:
+                batch.to_csv(f, index=False, header=rows == 0)
+                rows += len(batch)
+
+            if rows == 0:
+                pd.DataFrame(columns=_constants.OUTPUT_COLUMNS).to_csv(f, index=False)
+
+    elif output_format == 'parquet':
+        with pq.ParquetWriter(path, OUTPUT_SCHEMA, compression=COMPRESSION,
+                              use_dictionary=DICTIONARY_COLUMNS) as writer:
+            for table in output_tables():
+                writer.write_table(table, row_group_size=PARQUET_ROW_GROUP_SIZE)
+
+    elif output_format == 'feather':
+        with pa.ipc.new_file(path, OUTPUT_SCHEMA,
+                             options=pa.ipc.IpcWriteOptions(compression=COMPRESSION)) as writer:
+            for table in output_tables():
+                writer.write_table(table)
+
+    elif output_format == 'dataset':
+        ds.write_dataset(
+            (record_batch for table in output_tables() for record_batch in table.to_batches()), path,
+            schema=OUTPUT_SCHEMA, format='parquet',
+            partitioning=ds.partitioning(pa.schema([OUTPUT_SCHEMA.field(DATASET_PARTITION_COLUMN)]), flavor='hive'),
+            file_options=ds.ParquetFileFormat().make_write_options(
+                compression=COMPRESSION, use_dictionary=DICTIONARY_COLUMNS),
+            max_rows_per_group=PARQUET_ROW_GROUP_SIZE, existing_data_behavior='delete_matching')
+
+    else:
+        raise ValueError(f'output_format must be one of {OUTPUT_FORMATS}, got {output_format!r}')
+
+    return rows
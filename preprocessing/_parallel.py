@@ -0,0 +1,55 @@
+import math
+import concurrent.futures
+import pandas as pd
+
+# Minimum number of values per chunk sent to a worker process, smaller inputs aren't worth the pickling overhead
+MIN_CHUNK_SIZE = 1_000
+
+# Number of chunks per worker, so a worker that's done early picks up another chunk
+CHUNKS_PER_WORKER = 4
+
+
+def _map_chunk(func, chunk):
+    """
+    Apply func to every value of a chunk, in a worker process.
+    """
+    return [func(value) for value in chunk]
+
+
+def parallel_map(func, values, workers=1, min_chunk_size=MIN_CHUNK_SIZE):
+    """
+    Apply a pure function to every value, splitting the values into chunks that are processed by a pool of
+    worker processes, and reassembling the results in their original order.
+
+    The results don't depend on the number of workers. With one worker, or too few values to fill more than one
+    chunk, the values are processed in the current process.
+
+    Parameters:
+        func (callable): A module level function of one value (i.e. format_ingredients), so it can be pickled.
+        values (pd.Series or list): The values to apply func to.
+        workers (int): The number of worker processes (default is 1).
+        min_chunk_size (int): The minimum number of values per chunk (default is 1000).
+
+    Returns:
+        results (pd.Series or list): The results, as a Series with the index of values if values is a Series,
+            or a list otherwise.
+    """
+    items = values.tolist() if isinstance(values, pd.Series) else list(values)
+
+    n_chunks = min(workers * CHUNKS_PER_WORKER, math.ceil(len(items) / min_chunk_size))
+
+    if workers <= 1 or n_chunks <= 1:
+        results = _map_chunk(func, items)
+
+    else:
+        chunk_size = math.ceil(len(items) / n_chunks)
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            results = [result for chunk_results in executor.map(_map_chunk, [func] * len(chunks), chunks)
+                       for result in chunk_results]
+
+    if isinstance(values, pd.Series):
+        return pd.Series(results, index=values.index, dtype=object)
+
+    return results
@@ -0,0 +1,176 @@
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from preprocessing._categorical import concat_frames
+from preprocessing._intermediate import _is_feather, open_intermediate_writer
+
+# Default number of foods (unique fdc_ids) processed at once in streaming mode
+PARTITION_SIZE = 100_000
+
+
+def partition_bounds(keys, partition_size=PARTITION_SIZE):
+    """
+    Split the key space into consecutive ranges holding partition_size unique keys each.
+
+    Parameters:
+        keys (array-like): The keys to partition by (i.e. every fdc_id of food.csv).
+        partition_size (int): The number of unique keys per partition (default is 100000).
+
+    Returns:
+        bounds (np.ndarray): The sorted lower bound of every partition's key range.
+    """
+    if partition_size < 1:
+        raise ValueError(f'partition_size must be at least 1, got {partition_size}')
+
+    return np.unique(np.asarray(keys))[::partition_size]
+
+
+def spill_partitions(chunks, spill_dir, bounds, key='fdc_id'):
+    """
+    Split DataFrame chunks by key range and spill the pieces to one Parquet file per partition and chunk.
+
+    Rows whose key falls below the first bound don't belong to any partition and are dropped.
+
+    Parameters:
+        chunks (iterable of pd.DataFrame): The chunks to spill, i.e. as yielded by _ingest.iter_csv.
+        spill_dir (str): The directory to spill the pieces to.
+        bounds (np.ndarray): The partition bounds, as returned by partition_bounds.
+        key (str): The column holding the keys (default is 'fdc_id').
+
+    Returns:
+        template (pd.DataFrame): An empty DataFrame with the columns and dtypes of the chunks, used for
+            partitions without any rows.
+    """
+    if not os.path.exists(spill_dir):
+        os.makedirs(spill_dir)
+
+    template = None
+    for chunk_idx, chunk in enumerate(chunks):
+        if template is None:
+            template = chunk.iloc[:0]
+
+        partitions = np.searchsorted(bounds, chunk[key].to_numpy(), side='right') - 1
+
+        # groupby keeps the file order of the rows within every partition
+        for partition, piece in chunk.groupby(partitions, sort=True):
+            if partition < 0:
+                continue
+            piece.to_parquet(os.path.join(spill_dir, f'{partition:06d}-{chunk_idx:06d}.parquet'), index=False)
+
+    return template
+
+
+def read_partition(spill_dir, partition, template):
+    """
+    Read the pieces of one partition spilled by spill_partitions, in their original order.
+
+    Parameters:
+        spill_dir (str): The directory the pieces were spilled to.
+        partition (int): The index of the partition to read.
+        template (pd.DataFrame): The empty DataFrame returned by spill_partitions.
+
+    Returns:
+        df (pd.DataFrame): The rows of the partition.
+    """
+    paths = sorted(glob.glob(os.path.join(spill_dir, f'{partition:06d}-*.parquet')))
+    if not paths:
+        return template.copy()
+
+    return concat_frames([pd.read_parquet(path) for path in paths], ignore_index=True)
+
+
+def _merge_pandas_metadata(schemas):
+    """
+    Merge the pandas metadata of the schemas, so a column that's all null in the first schema takes its
+    pandas dtype from the first schema where it isn't.
+    """
+    metadata = [json.loads(schema.metadata[b'pandas']) for schema in schemas if schema.metadata and b'pandas' in schema.metadata]
+    if not metadata:
+        return None
+
+    merged = metadata[0]
+    for idx, column in enumerate(merged['columns']):
+        if column['pandas_type'] != 'empty':
+            continue
+        for other in metadata[1:]:
+            match = [c for c in other['columns'] if c['name'] == column['name'] and c['pandas_type'] != 'empty']
+            if match:
+                merged['columns'][idx] = match[0]
+                break
+
+    return {b'pandas': json.dumps(merged).encode('utf8')}
+
+
+def _unified_dictionaries(paths, schema):
+    """
+    Get the sorted union of the dictionaries every partition holds for every dictionary (categorical) column,
+    reading only those columns.
+    """
+    names = [field.name for field in schema if pa.types.is_dictionary(field.type)]
+
+    dictionaries = {name: [] for name in names}
+    for path in paths:
+        table = pq.read_table(path, columns=[name for name in names if name in pq.read_schema(path).names])
+        for name in table.column_names:
+            dictionaries[name] += [chunk.dictionary for chunk in table.column(name).chunks
+                                   if pa.types.is_dictionary(chunk.type)]
+
+    unified = {}
+    for name, arrays in dictionaries.items():
+        values = pc.unique(pa.concat_arrays(arrays)) if arrays else pa.array([], schema.field(name).type.value_type)
+        unified[name] = values.take(pc.sort_indices(values))
+
+    return unified
+
+
+def _recode_dictionary(values, dictionary):
+    """
+    Recode a dictionary column to the given dictionary, which holds all its values.
+    """
+    chunks = []
+    for chunk in values.chunks:
+        indices = pc.take(pc.index_in(chunk.dictionary, value_set=dictionary), chunk.indices)
+        chunks.append(pa.DictionaryArray.from_arrays(indices.cast(pa.int32()), dictionary))
+
+    return pa.chunked_array(chunks, pa.dictionary(pa.int32(), dictionary.type))
+
+
+def combine_partitions(paths, output_path):
+    """
+    Combine per-partition Parquet files into a single processed file, appending one row group (or one Arrow record
+    batch, for the Feather format) per partition.
+
+    The schemas of the partitions are unified first, since a column that's all null within a partition is
+    stored with Arrow's null type there. Every partition has its own categories, which Parquet stores per row
+    group, but an Arrow IPC file holds a single dictionary per column, so for the Feather format the
+    categorical columns of every partition are recoded to the sorted union of their categories.
+
+    Parameters:
+        paths (list of str): The per-partition Parquet files, in output order.
+        output_path (str): The path of the combined file, whose extension selects its format (see _intermediate).
+
+    Returns:
+        None
+    """
+    schemas = [pq.read_schema(path) for path in paths]
+    schema = pa.unify_schemas(schemas).with_metadata(_merge_pandas_metadata(schemas))
+
+    dictionaries = _unified_dictionaries(paths, schema) if _is_feather(output_path) else {}
+    output_schema = schema
+    for name, dictionary in dictionaries.items():
+        output_schema = output_schema.set(output_schema.get_field_index(name),
+                                          pa.field(name, pa.dictionary(pa.int32(), dictionary.type)))
+
+    with open_intermediate_writer(output_path, output_schema) as writer:
+        for path in paths:
+            table = pq.read_table(path).cast(schema)
+            for name, dictionary in dictionaries.items():
+                table = table.set_column(table.schema.get_field_index(name), output_schema.field(name),
+                                         _recode_dictionary(table.column(name), dictionary))
+
+            writer.write_table(table)
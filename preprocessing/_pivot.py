@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from preprocessing._profile import profiled
+
+
+def _group_codes(df, keys):
+    """
+    Number the unique combinations of the key columns in sorted order, like a sorted groupby numbers its groups.
+
+    Returns the code of every row and the position of a row of every group (all rows of a group share its keys).
+    """
+    if len(keys) == 1:
+        codes, uniques = pd.factorize(df[keys[0]], sort=True)
+        n_groups = len(uniques)
+    else:
+        grouped = df.groupby(keys, sort=True, observed=True)
+        codes = grouped.ngroup().to_numpy()
+        n_groups = grouped.ngroups
+
+    group_rows = np.empty(n_groups, dtype=np.intp)
+    group_rows[codes] = np.arange(len(codes))
+
+    return codes, group_rows
+
+
+def _compensated_sums(values, starts, counts):
+    """
+    Sum runs of values (the entries of every cell, in their original order) with Kahan compensation, adding the
+    k-th entry of all cells at once, so the sums match the ones pandas' groupby mean computes entry by entry.
+    """
+    sums = np.zeros(len(starts))
+    compensation = np.zeros(len(starts))
+
+    for k in range(counts.max(initial=0)):
+        cells = np.flatnonzero(counts > k)
+        y = values[starts[cells] + k] - compensation[cells]
+        t = sums[cells] + y
+        compensation[cells] = np.nan_to_num(t - sums[cells] - y, nan=0.0, posinf=0.0, neginf=0.0)
+        sums[cells] = t
+
+    return sums
+
+
+@profiled('pivot')
+def pivot_mean(df, index, columns, values, dtype='float64'):
+    """
+    Pivot long data into one column per unique value of columns, averaging the values of duplicate entries.
+    This gives the same frame as pd.pivot_table(df, index=index, columns=columns, values=values,
+    observed=True).reset_index(), without its groupby and unstack.
+
+    The index keys and the column labels are factorized into integer codes, and the values are scattered into
+    a preallocated (rows x columns) matrix, which becomes the nutrient block of the wide frame without a copy.
+    Duplicate entries, if any, are found with np.bincount and summed the way pandas sums them and divided by their counts. Like pivot_table,
+    rows with a missing key or value are left out, so every row and column of the result holds a value.
+
+    Parameters:
+        df (pd.DataFrame): The long data.
+        index (list of str): The columns identifying a row of the result (i.e. ['fdc_id']).
+        columns (str): The column holding the labels of the result's columns (i.e. 'nutrient_name').
+        values (str): The column holding the values (i.e. 'per_gram_amt').
+        dtype (str): The dtype of the value columns (default is 'float64').
+
+    Returns:
+        wide (pd.DataFrame): The index columns, followed by one column per label in sorted order.
+    """
+    valid = df[values].notna() & df[columns].notna()
+    for key in index:
+        valid &= df[key].notna()
+
+    if not valid.all():
+        df = df.loc[valid]
+
+    # Factorize the rows and columns of the result
+    row_codes, group_rows = _group_codes(df, index)
+    col_codes, col_labels = pd.factorize(df[columns], sort=True)
+
+    n_rows, n_cols = len(group_rows), len(col_labels)
+    cells = row_codes.astype(np.int64) * n_cols + col_codes
+    amounts = df[values].to_numpy(dtype=np.float64)
+
+    # Scatter the values, then average the cells holding more than one of them
+    matrix = np.full(n_rows * n_cols, np.nan, dtype=np.float64)
+    matrix[cells] = amounts
+
+    cell_counts = np.bincount(cells, minlength=n_rows * n_cols)
+    duplicates = np.flatnonzero(cell_counts[cells] > 1)
+
+    if len(duplicates):
+        # Only the duplicate entries are sorted by cell, keeping their original order within a cell
+        duplicates = duplicates[np.argsort(cells[duplicates], kind='stable')]
+        sorted_cells = cells[duplicates]
+        starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+
+        counts = np.diff(np.r_[starts, len(sorted_cells)])
+        sums = _compensated_sums(amounts[duplicates], starts, counts)
+        matrix[sorted_cells[starts]] = sums / counts
+
+    matrix = matrix.reshape(n_rows, n_cols).astype(dtype, copy=False)
+
+    wide = pd.DataFrame(matrix, columns=pd.Index(np.asarray(col_labels, dtype=object), name=columns))
+
+    # Add the index columns in front, taking the keys of every row from one of its entries
+    for pos, key in enumerate(index):
+        wide.insert(pos, key, df[key].iloc[group_rows].reset_index(drop=True))
+
+    return wide
@@ -0,0 +1,143 @@
+import collections
+import json
+import os
+import sqlite3
+import ingredient_slicer
+import numpy as np
+import pandas as pd
+from preprocessing._parallel import parallel_map
+from preprocessing._profile import profiled
+
+# Maximum number of parsed portions kept in memory, shared by all processors of a run
+PORTION_CACHE_SIZE = 100_000
+
+# File name of the on-disk portion cache, kept in the download cache directory
+PORTION_CACHE_FILENAME = 'portions.sqlite'
+
+# Number of portions looked up per query of the on-disk cache (sqlite limits the number of query parameters)
+SQLITE_BATCH_SIZE = 500
+
+# Portions parsed by another version of ingredient_slicer are parsed again
+INGREDIENT_SLICER_VERSION = getattr(ingredient_slicer, '__version__', 'unknown')
+
+_memory_cache = collections.OrderedDict()
+
+
+def parse_portion(text):
+    """
+    Parse a portion string (i.e. '1.0 cup chopped') with the ingredient_slicer package.
+
+    Parameters:
+        text (str): The portion string.
+
+    Returns:
+        parsed (tuple): The quantity and the standardized unit, either of which may be None.
+    """
+    parsed = ingredient_slicer.IngredientSlicer(text).parsed_ingredient()
+
+    return (parsed['quantity'], parsed['standardized_unit'])
+
+
+def _remember(text, parsed):
+    """
+    Add a parsed portion to the in-memory cache, evicting the least recently used ones beyond PORTION_CACHE_SIZE.
+    """
+    _memory_cache[text] = parsed
+    _memory_cache.move_to_end(text)
+
+    while len(_memory_cache) > PORTION_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+
+def _open_disk_cache(cache_dir):
+    """
+    Open the on-disk portion cache in cache_dir, creating it if needed.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    connection = sqlite3.connect(os.path.join(cache_dir, PORTION_CACHE_FILENAME), timeout=60)
+    connection.execute('CREATE TABLE IF NOT EXISTS portions '
+                       '(version TEXT, portion TEXT, parsed TEXT, PRIMARY KEY (version, portion))')
+
+    return connection
+
+
+def lookup_portions(texts, cache_dir=None, workers=1):
+    """
+    Parse portion strings, looking each of them up in the in-memory cache, then in the on-disk cache, and only
+    parsing the ones found in neither.
+
+    Parameters:
+        texts (list of str): The unique portion strings.
+        cache_dir (str): The directory holding the on-disk cache. If None, only the in-memory cache is used
+            (default is None).
+        workers (int): The number of worker processes the missing strings are parsed by (default is 1).
+
+    Returns:
+        parsed (dict): A mapping of every portion string to its parsed quantity and standardized unit.
+    """
+    parsed = {}
+    missing = []
+    for text in texts:
+        if text in _memory_cache:
+            _memory_cache.move_to_end(text)
+            parsed[text] = _memory_cache[text]
+        else:
+            missing.append(text)
+
+    connection = _open_disk_cache(cache_dir) if cache_dir and missing else None
+
+    try:
+        if connection is not None:
+            for i in range(0, len(missing), SQLITE_BATCH_SIZE):
+                batch = missing[i:i + SQLITE_BATCH_SIZE]
+                rows = connection.execute(
+                    f'SELECT portion, parsed FROM portions WHERE version = ? AND portion IN ({",".join("?" * len(batch))})',
+                    [INGREDIENT_SLICER_VERSION] + batch)
+                for text, result in rows:
+                    parsed[text] = tuple(json.loads(result))
+
+        unparsed = [text for text in missing if text not in parsed]
+        new = dict(zip(unparsed, parallel_map(parse_portion, unparsed, workers)))
+
+        if connection is not None and new:
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO portions VALUES (?, ?, ?)',
+                                       [(INGREDIENT_SLICER_VERSION, text, json.dumps(result)) for text, result in new.items()])
+    finally:
+        if connection is not None:
+            connection.close()
+
+    parsed.update(new)
+    for text in missing:
+        _remember(text, parsed[text])
+
+    return parsed
+
+
+@profiled('parse_portions')
+def parse_portions(values, cache_dir=None, default='no_value', workers=1):
+    """
+    Parse a column of portion strings, parsing every unique string once and mapping the results back to the rows.
+
+    Parameters:
+        values (pd.Series): The portion strings (i.e. the portion_combined column).
+        cache_dir (str): The directory holding the on-disk cache. If None, only the in-memory cache is used
+            (default is None).
+        default (str): The value used where ingredient_slicer finds no quantity or unit (default is 'no_value').
+        workers (int): The number of worker processes the unique strings are parsed by (default is 1).
+
+    Returns:
+        portions (pd.DataFrame): The 'quantity' and 'standardized_unit' of every row, with the index of values.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    parsed = lookup_portions([text for text in uniques if isinstance(text, str)], cache_dir, workers)
+
+    # Values like NaN can't be cached, they're passed on to ingredient_slicer as they are
+    results = [parsed[text] if isinstance(text, str) else parse_portion(text) for text in uniques]
+
+    quantities = np.array([quantity or default for quantity, _ in results], dtype=object)
+    units = np.array([unit or default for _, unit in results], dtype=object)
+
+    return pd.DataFrame({'quantity': quantities[codes], 'standardized_unit': units[codes]},
+                        index=values.index)
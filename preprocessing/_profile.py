@@ -0,0 +1,236 @@
+import datetime
+import functools
+import json
+import os
+import resource
+import time
+import pandas as pd
+
+# Name of the run report written to the output directory by --profile
+RUN_REPORT_FILENAME = 'run_report.json'
+
+# Environment variable that enables profiling, so processes started by the jobs (see _jobs) profile too
+PROFILE_ENV_VAR = 'FDC_PROFILE'
+
+# Stages recorded by this process, and the stages currently running (outermost first)
+_stages = []
+_running = []
+
+
+def enable_profiling():
+    """
+    Enable the recording of stages, in this process and in the processes it starts.
+
+    Returns:
+        None
+    """
+    os.environ[PROFILE_ENV_VAR] = '1'
+
+
+def is_profiling():
+    """
+    Check whether stages are recorded.
+    """
+    return os.environ.get(PROFILE_ENV_VAR) == '1'
+
+
+def recorded_stages():
+    """
+    Get the stages recorded by this process so far, in the order they finished.
+
+    Returns:
+        stages (list of dict): The name, path, wall time, CPU time, rows, and memory of every stage.
+    """
+    return list(_stages)
+
+
+def _cpu_time():
+    """
+    Get the CPU time of this process and of its finished child processes (i.e. the --workers pools).
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _peak_rss_mb():
+    """
+    Get the peak resident memory of this process so far, in MB (ru_maxrss is in KB on Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _count_rows(value):
+    """
+    Count the rows of a DataFrame or Series, or return None for anything else.
+    """
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+class _Stage:
+    """
+    A stage being recorded, set rows_in and rows_out on it to record the rows it read and produced.
+    """
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        _running.append(self.name)
+        self._start = time.perf_counter()
+        self._cpu_start = _cpu_time()
+        self._peak_start = _peak_rss_mb()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        peak = _peak_rss_mb()
+
+        _stages.append({
+            'stage': self.name,
+            'path': '/'.join(_running),
+            'pid': os.getpid(),
+            'wall_time': round(time.perf_counter() - self._start, 4),
+            'cpu_time': round(_cpu_time() - self._cpu_start, 4),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'peak_rss_mb': round(peak, 1),
+            'peak_rss_growth_mb': round(peak - self._peak_start, 1),
+            'failed': exc_type is not None,
+        })
+        _running.pop()
+
+        return False
+
+
+class _NullStage:
+    """
+    The stage handed out while profiling is off, which records nothing.
+    """
+    rows_in = None
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def profile_stage(name, rows_in=None):
+    """
+    Record the wall time, CPU time, rows, and memory of a stage of the pipeline, when profiling is enabled (see
+    enable_profiling). Otherwise nothing is recorded, and the cost is a single check.
+
+    Stages can be nested, every stage records the path of the stages it runs in (i.e. 'branded/read_csv'). The
+    memory is measured as the peak resident memory of the process, which is cheap to read: peak_rss_mb is the
+    peak so far when the stage ends, and peak_rss_growth_mb how much the stage raised it, so the stages that
+    drive the peak memory of a run stand out.
+
+    Usage:
+        with profile_stage('merge', rows_in=len(foods)) as stage:
+            full_foods = pd.merge(foods, nutrients, on='fdc_id')
+            stage.rows_out = len(full_foods)
+
+    Parameters:
+        name (str): The name of the stage (i.e. 'read_csv').
+        rows_in (int): The number of rows the stage reads (default is None).
+
+    Returns:
+        stage (context manager): The stage, whose rows_in and rows_out can be set while it runs.
+    """
+    if not is_profiling():
+        return _NULL_STAGE
+
+    return _Stage(name, rows_in)
+
+
+def profiled(name):
+    """
+    Decorate a function so every call to it is recorded as a stage (see profile_stage). The rows of the first
+    DataFrame or Series argument and of the returned DataFrame or Series are recorded as its rows_in and rows_out.
+
+    Parameters:
+        name (str): The name of the stage (i.e. 'pivot').
+
+    Returns:
+        decorator (callable): The decorator.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_profiling():
+                return func(*args, **kwargs)
+
+            rows_in = next((_count_rows(arg) for arg in args if _count_rows(arg) is not None), None)
+            with _Stage(name, rows_in) as stage:
+                result = func(*args, **kwargs)
+                stage.rows_out = _count_rows(result)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def summarize_stages(stages):
+    """
+    Total the calls, wall time, and CPU time of the stages by name, slowest first.
+
+    Parameters:
+        stages (list of dict): The recorded stages.
+
+    Returns:
+        totals (dict): A mapping of every stage name to its number of calls, total wall time, and total CPU time.
+    """
+    totals = {}
+    for stage in stages:
+        total = totals.setdefault(stage['stage'], {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0})
+        total['calls'] += 1
+        total['wall_time'] += stage['wall_time']
+        total['cpu_time'] += stage['cpu_time']
+
+    for total in totals.values():
+        total['wall_time'] = round(total['wall_time'], 4)
+        total['cpu_time'] = round(total['cpu_time'], 4)
+
+    return dict(sorted(totals.items(), key=lambda item: -item[1]['wall_time']))
+
+
+def write_run_report(output_dir, stages, started, **extra):
+    """
+    Write the run report, <output_dir>/run_report.json, with the recorded stages and their totals.
+
+    Parameters:
+        output_dir (str): The output directory.
+        stages (list of dict): The recorded stages, of this process and of the jobs.
+        started (float): The time.time() the run started at.
+        **extra: Other entries of the report (i.e. the command-line arguments).
+
+    Returns:
+        report_path (str): The path to the run report.
+    """
+    report = {
+        'started': datetime.datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+        'wall_time': round(time.time() - started, 3),
+        'cpu_time': round(_cpu_time(), 3),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        **extra,
+        'totals': summarize_stages(stages),
+        'stages': stages,
+    }
+
+    report_path = os.path.join(output_dir, RUN_REPORT_FILENAME)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+
+    return report_path
@@ -0,0 +1,199 @@
+import io
+import os
+import tempfile
+import zipfile
+from preprocessing._download import DOWNLOAD_TIMEOUT, _cache_key, cached_download, make_session
+from preprocessing._utils import find_archive_member
+
+# Minimum number of bytes fetched per range request, so zipfile's many small reads don't each cost a request (64 KiB)
+RANGE_BLOCK_SIZE = 64 * 1024
+
+
+class RangeNotSupportedError(IOError):
+    """Raised when a server answers a byte-range request with the full file."""
+
+
+class HttpRangeFile(io.RawIOBase):
+    """
+    A read-only, seekable file over a remote file, where every read is served by an HTTP Range request.
+
+    Wrapping a remote zip file in an HttpRangeFile lets zipfile.ZipFile read its central directory and
+    individual members without downloading the rest of the file.
+
+    Parameters:
+        url (str): The URL of the remote file.
+        size (int): The size of the remote file in bytes.
+        session (requests.Session): The session used to issue the requests.
+        validator (str): The ETag or Last-Modified value every range must match (sent as If-Range).
+        block_size (int): The minimum number of bytes fetched per request (default is 64 KiB).
+    """
+
+    def __init__(self, url, size, session, validator=None, block_size=RANGE_BLOCK_SIZE):
+        super().__init__()
+        self.url = url
+        self.size = size
+        self.session = session
+        self.validator = validator
+        self.block_size = block_size
+        self.position = 0
+        self.requests_made = 0
+        self.bytes_fetched = 0
+        self.ranges_ignored = False
+        self._block_start = 0
+        self._block = b''
+        self._tail = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+
+        self.position = max(0, self.position)
+        return self.position
+
+    def _fetch(self, start, end):
+        """
+        Fetch the inclusive byte range start-end of the remote file.
+        """
+        headers = {'Range': f'bytes={start}-{end}'}
+        if self.validator:
+            headers['If-Range'] = self.validator
+
+        # The response is streamed, so the whole file a server answers with when it ignores the range (or when
+        # If-Range no longer matches) is never downloaded
+        r = self.session.get(self.url, headers=headers, timeout=DOWNLOAD_TIMEOUT, stream=True)
+        try:
+            r.raise_for_status()
+
+            if r.status_code != 206:
+                self.ranges_ignored = True
+                raise RangeNotSupportedError(f'Server ignored range {start}-{end} of {self.url}')
+
+            content = r.content
+
+        finally:
+            r.close()
+
+        self.requests_made += 1
+        self.bytes_fetched += len(content)
+
+        return content
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+
+        n = min(len(buffer), self.size - self.position)
+        tail_start = max(0, self.size - self.block_size)
+
+        if self.position >= tail_start:
+            # The end of the file (end of central directory record, usually the central directory itself) is
+            # read backwards in small pieces, so it's fetched once and kept
+            if self._tail is None:
+                self._tail = self._fetch(tail_start, self.size - 1)
+
+            block_start, block = tail_start, self._tail
+
+        else:
+            # Fetch a new block unless the requested bytes are already buffered
+            if not (self._block_start <= self.position and self.position + n <= self._block_start + len(self._block)):
+                end = min(self.position + max(n, self.block_size), self.size) - 1
+                self._block = self._fetch(self.position, end)
+                self._block_start = self.position
+
+            block_start, block = self._block_start, self._block
+
+        offset = self.position - block_start
+        data = block[offset:offset + n]
+        buffer[:len(data)] = data
+        self.position += len(data)
+
+        return len(data)
+
+
+def read_remote_zip_member(url, filename, cache_dir=None, session=None):
+    """
+    Read a single member of a remote zip file without downloading the whole zip file.
+
+    The central directory of the zip file and the compressed bytes of the member are fetched with HTTP Range
+    requests. The member is cached in cache_dir under the URL, the validator (ETag or Last-Modified) reported
+    by the server, and the file name, so later calls only cost a HEAD request. If the server doesn't support
+    byte ranges, the whole zip file is downloaded through the download cache instead.
+
+    Parameters:
+        url (str): The URL of the remote zip file.
+        filename (str): The file name of the member to read (i.e. 'food_category.csv').
+        cache_dir (str): The directory holding the download cache. If None, nothing is cached and a full
+            download is made in a temporary directory (default is None).
+        session (requests.Session): An optional session used to issue the requests.
+
+    Returns:
+        data (bytes): The decompressed contents of the member.
+    """
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    session = session or make_session()
+
+    r = session.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+    r.raise_for_status()
+
+    validator = r.headers.get('ETag') or r.headers.get('Last-Modified')
+    content_length = r.headers.get('Content-Length')
+    size = int(content_length) if content_length else None
+
+    member_path = os.path.join(
+        cache_dir, f'{_cache_key(f"{url} {validator} {filename}")}-{filename}') if cache_dir and validator else None
+
+    if member_path and os.path.exists(member_path):
+        print(f"Using cached '{filename}' from:\n> {url}\n")
+        with open(member_path, 'rb') as f:
+            return f.read()
+
+    data = None
+
+    if size and r.headers.get('Accept-Ranges') == 'bytes':
+        print(f"Fetching '{filename}' with range requests from:\n> {url}\n")
+
+        remote_file = HttpRangeFile(url, size, session, validator)
+        try:
+            with zipfile.ZipFile(remote_file, 'r') as archive:
+                data = archive.read(find_archive_member(archive, filename))
+
+            print(f'> Fetched {remote_file.bytes_fetched} of {size} bytes in {remote_file.requests_made} requests\n')
+
+        except (RangeNotSupportedError, zipfile.BadZipFile):
+            # zipfile reports the errors of reading the central directory as a BadZipFile
+            if not remote_file.ranges_ignored:
+                raise
+            data = None
+
+    if data is None:
+        print(f"Server doesn't support range requests, downloading the whole file:\n> {url}\n")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with zipfile.ZipFile(cached_download(url, cache_dir or tmp_dir, session=session), 'r') as archive:
+                data = archive.read(find_archive_member(archive, filename))
+
+    # Cache the member so an unchanged zip file isn't read again
+    if member_path:
+        tmp_path = f'{member_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, member_path)
+
+    return data
@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from preprocessing import _constants
+from preprocessing._categorical import fillna_categorical, is_categorical, sort_categories
+
+# Nutrient columns of the final output, amounts per gram that are 0.0 where a food lacks the nutrient
+NUTRIENT_COLUMNS = _constants.OUTPUT_COLUMNS[_constants.OUTPUT_COLUMNS.index('energy'):]
+
+# The dtype, fill value, and nullable policy of every column the processors and postprocess_stacked_df type:
+# - dtype: 'int16', 'int32', 'float32', 'category', or 'object' (text or other Python objects, kept as they are,
+#   Arrow-backed strings included)
+# - fill: the value missing values are filled with, or None to leave them
+# - nullable: whether missing values may remain
+# - output_dtype: the dtype of the column in the columnar output formats, if it differs from dtype
+COLUMN_SCHEMA = {
+    # Identifiers
+    'fdc_id': {'dtype': 'int32', 'fill': 0, 'nullable': False},
+    'category_id': {'dtype': 'int32', 'fill': 0, 'nullable': False},
+    'measure_unit_id': {'dtype': 'int32', 'fill': 0, 'nullable': False},
+    'nutrient_id': {'dtype': 'int16', 'fill': 0, 'nullable': False},
+    'portion_id': {'dtype': 'int32', 'fill': 0, 'nullable': False},
+    'food_attribute_type_id': {'dtype': 'int32', 'fill': None, 'nullable': False},
+
+    # Text
+    'usda_data_source': {'dtype': 'category', 'fill': 'no_value', 'nullable': False},
+    'data_type': {'dtype': 'category', 'fill': 'no_value', 'nullable': False},
+    'category': {'dtype': 'category', 'fill': 'no_value', 'nullable': False},
+    'brand_owner': {'dtype': 'category', 'fill': 'no_value', 'nullable': False},
+    'brand_name': {'dtype': 'category', 'fill': 'no_value', 'nullable': False},
+    'food_description': {'dtype': 'object', 'fill': 'no_value', 'nullable': False},
+    'food_common_name': {'dtype': 'object', 'fill': 'no_value', 'nullable': False},
+    'food_common_category': {'dtype': 'object', 'fill': 'no_value', 'nullable': False},
+    'ingredients': {'dtype': 'object', 'fill': 'no_value', 'nullable': False},
+    'nutrient_name': {'dtype': 'category', 'fill': 'no_value', 'nullable': False},
+    'nutrient_unit': {'dtype': 'category', 'fill': 'no_value', 'nullable': False},
+    'food_attribute_type': {'dtype': 'object', 'fill': None, 'nullable': True},
+    'value': {'dtype': 'object', 'fill': None, 'nullable': True},
+
+    # Portions (std_portion_amount holds the parsed quantities, or 'no_value' where none was parsed)
+    'portion_amount': {'dtype': 'float32', 'fill': 0.0, 'nullable': False},
+    'portion_unit': {'dtype': 'category', 'fill': 'no_value', 'nullable': False},
+    'portion_modifier': {'dtype': 'object', 'fill': 'no_value', 'nullable': False},
+    'std_portion_amount': {'dtype': 'object', 'fill': 0.0, 'nullable': False, 'output_dtype': 'float32'},
+    'std_portion_unit': {'dtype': 'category', 'fill': 'no_value', 'nullable': False},
+    'portion_gram_weight': {'dtype': 'float32', 'fill': 0.0, 'nullable': False},
+    'portion_energy': {'dtype': 'float32', 'fill': 0.0, 'nullable': False},
+
+    # Nutrients
+    'nutrient_amount': {'dtype': 'float32', 'fill': 0.0, 'nullable': False},
+    **{col: {'dtype': 'float32', 'fill': 0.0, 'nullable': False} for col in NUTRIENT_COLUMNS},
+}
+
+# Text columns kept categorical through the processors and the stacking (see _categorical)
+CATEGORICAL_COLUMNS = [col for col, spec in COLUMN_SCHEMA.items() if spec['dtype'] == 'category']
+
+# Arrow types of the dtypes, for the columnar output formats (categoricals are written as plain strings)
+ARROW_TYPES = {
+    'int16': pa.int16(),
+    'int32': pa.int32(),
+    'float32': pa.float32(),
+    'category': pa.string(),
+    'object': pa.string(),
+}
+
+
+def _cast(values, dtype):
+    """
+    Cast a column to the dtype of its schema, doing nothing if it already has it.
+    """
+    if dtype == 'category':
+        return values if is_categorical(values) else sort_categories(values.astype(object).astype('category'))
+
+    if dtype == 'object' or values.dtype == dtype:
+        return values
+
+    if pd.api.types.is_float_dtype(values.dtype) and dtype.startswith('int'):
+        # Integer columns that come out of a mean (i.e. fdc_id after the foundation groupby) are narrowed to
+        # float32 before they're truncated
+        values = values.astype('float32')
+
+    elif pd.api.types.is_integer_dtype(values.dtype) and dtype.startswith('int') and len(values):
+        # Narrowing an integer column mustn't wrap around
+        info = np.iinfo(dtype)
+        if values.min() < info.min or values.max() > info.max:
+            raise ValueError(f"Column '{values.name}' has values outside the range of {dtype}")
+
+    return values.astype(dtype)
+
+
+def apply_schema(df, schema=COLUMN_SCHEMA):
+    """
+    Fill the missing values and set the dtypes of every column of the DataFrame listed in the schema, in a single
+    pass, then validate the result. Columns are replaced one at a time, and only if they change, so the
+    DataFrame is never copied as a whole. Columns the schema doesn't list are left as they are.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame, changed in place.
+        schema (dict): A mapping of column names to their dtype, fill value, and nullable policy (default is
+            COLUMN_SCHEMA).
+
+    Returns:
+        df (pd.DataFrame): The DataFrame.
+    """
+    for col in df.columns:
+        spec = schema.get(col)
+        if spec is None:
+            continue
+
+        values = df[col]
+        typed = values
+
+        if spec['fill'] is not None and typed.hasnans:
+            typed = fillna_categorical(typed, spec['fill'])
+
+        typed = _cast(typed, spec['dtype'])
+
+        if typed is not values:
+            df[col] = typed
+
+    validate_schema(df, schema)
+
+    return df
+
+
+def validate_schema(df, schema=COLUMN_SCHEMA):
+    """
+    Check that every column of the DataFrame listed in the schema has its dtype, and has no missing values
+    unless it's nullable.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame.
+        schema (dict): A mapping of column names to their dtype, fill value, and nullable policy (default is
+            COLUMN_SCHEMA).
+
+    Returns:
+        None
+    """
+    errors = []
+    for col in df.columns:
+        spec = schema.get(col)
+        if spec is None:
+            continue
+
+        values = df[col]
+
+        if spec['dtype'] == 'category':
+            valid_dtype = is_categorical(values)
+        elif spec['dtype'] == 'object':
+            valid_dtype = values.dtype == object or pd.api.types.is_string_dtype(values.dtype)
+        else:
+            valid_dtype = values.dtype == spec['dtype']
+
+        if not valid_dtype:
+            errors.append(f"> {col}: dtype {values.dtype}, expected {spec['dtype']}")
+
+        if not spec['nullable'] and values.hasnans:
+            errors.append(f'> {col}: {values.isna().sum()} missing values')
+
+    if errors:
+        raise ValueError('Columns not matching the schema:\n' + '\n'.join(errors))
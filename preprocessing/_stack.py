@@ -0,0 +1,190 @@
+import pandas as pd
+import pyarrow as pa
+from preprocessing import _constants
+from preprocessing._categorical import concat_frames, is_categorical, sort_categories
+from preprocessing._intermediate import iter_intermediate_batches, read_intermediate_schema, read_intermediate_table
+from preprocessing._schema import COLUMN_SCHEMA, apply_schema
+from preprocessing._utils import clean_string_column, portion_amounts_to_float, postprocess_stacked_df
+
+# Number of rows of the processed files stacked and postprocessed at once in streaming mode
+STACK_BATCH_SIZE = 100_000
+
+
+def stacked_dtypes(paths):
+    """
+    Get the dtypes the output columns of the processed files have once they're stacked with concat_frames, from
+    the schemas of the files alone (i.e. float64 for an fdc_id that's int32 in one file and float64 in another).
+
+    Parameters:
+        paths (list of str): The processed files, in stacking order.
+
+    Returns:
+        dtypes (pd.Series): The dtype of every output column the files hold, in output order.
+    """
+    dtypes = concat_frames([read_intermediate_schema(path).empty_table().to_pandas() for path in paths]).dtypes
+
+    return dtypes[[col for col in _constants.OUTPUT_COLUMNS if col in dtypes.index]]
+
+
+def align_batch(batch, dtypes):
+    """
+    Align a batch of a processed file to the stacked columns, adding the columns the file lacks as missing values
+    and casting the others to their stacked dtype, so the batch is postprocessed like the stacked data would be.
+
+    Parameters:
+        batch (pd.DataFrame): The batch.
+        dtypes (pd.Series): The stacked dtypes (see stacked_dtypes).
+
+    Returns:
+        batch (pd.DataFrame): The aligned batch.
+    """
+    batch = batch.reindex(columns=dtypes.index)
+
+    for col, dtype in dtypes.items():
+        values = batch[col]
+
+        if isinstance(dtype, pd.CategoricalDtype):
+            # The categories differ between batches, which the postprocessing turns into plain strings anyway
+            if not is_categorical(values):
+                batch[col] = values.astype(object).astype('category')
+
+        elif values.dtype != dtype:
+            batch[col] = values.astype(dtype)
+
+    return batch
+
+
+def _iter_aligned_batches(paths, dtypes, batch_size, columns=None):
+    """
+    Read the processed files one batch at a time, aligned to the stacked columns given, or to all of them.
+    """
+    dtypes = dtypes if columns is None else dtypes[columns]
+
+    for path in paths:
+        file_columns = [col for col in dtypes.index if col in read_intermediate_schema(path).names]
+
+        for batch in iter_intermediate_batches(path, batch_size, columns=file_columns):
+            yield align_batch(batch.to_pandas(), dtypes)
+
+
+def _arrow_type(dtype, tables, col):
+    """
+    Get the Arrow type a stacked column is concatenated with: a dictionary for categoricals, the type of the
+    dtype for numbers, and the type of the first file that holds the column for text and other Python objects
+    (i.e. string, large_string for the pandas string columns of the pyarrow CSV engine, or list of strings).
+    """
+    if isinstance(dtype, pd.CategoricalDtype):
+        return pa.dictionary(pa.int32(), pa.string())
+
+    if pd.api.types.is_numeric_dtype(dtype):
+        return pa.from_numpy_dtype(dtype)
+
+    types = [table.schema.field(col).type for table in tables if col in table.column_names]
+    return next((arrow_type for arrow_type in types if arrow_type != pa.null()), pa.string())
+
+
+def read_stacked(paths):
+    """
+    Stack the output columns of the processed files into a single DataFrame, with the rows, columns, and dtypes
+    concat_frames gives for the files read with pd.read_parquet.
+
+    The files are concatenated as Arrow tables, which only links their columns together, and the result is
+    converted to pandas once, rather than converting every file and copying them all again to concatenate
+    them. The columns of Feather files are memory-mapped (see _intermediate), so they're neither decoded nor
+    copied until that conversion. Columns only cast when their type differs between the files (i.e. fdc_id,
+    int32 in one file and float64 in another), and those a file lacks are filled with nulls.
+
+    Parameters:
+        paths (list of str): The processed files, in stacking order.
+
+    Returns:
+        df (pd.DataFrame): The stacked output columns.
+    """
+    dtypes = stacked_dtypes(paths)
+    tables = [read_intermediate_table(path, columns=[col for col in dtypes.index
+                                                     if col in read_intermediate_schema(path).names])
+              for path in paths]
+
+    schema = pa.schema([(col, _arrow_type(dtype, tables, col)) for col, dtype in dtypes.items()])
+
+    aligned = []
+    for table in tables:
+        columns = []
+        for field in schema:
+            if field.name not in table.column_names:
+                columns.append(pa.nulls(table.num_rows, field.type))
+                continue
+
+            values = table.column(field.name)
+            if pa.types.is_dictionary(field.type) and not pa.types.is_dictionary(values.type):
+                values = values.dictionary_encode()
+
+            columns.append(values if values.type == field.type else values.cast(field.type))
+
+        aligned.append(pa.Table.from_arrays(columns, schema=schema))
+
+    # Every column is converted on its own, rather than consolidated into 2D blocks (another copy)
+    df = pa.concat_tables(aligned).to_pandas(split_blocks=True)
+
+    # The categories are sorted, like concat_frames sorts them, and the text converted to Python strings is set
+    # back to the pandas string dtype where the files had it
+    for col, dtype in dtypes.items():
+        if is_categorical(df[col]):
+            df[col] = sort_categories(df[col])
+
+        elif df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+
+    return df
+
+
+def stacked_portions_are_numeric(paths, dtypes, batch_size=STACK_BATCH_SIZE):
+    """
+    Check whether every std_portion_amount of the stacked data converts to float32 once it's postprocessed, reading
+    only that column. postprocess_stacked_df converts the column only if all of it does, which a single batch
+    can't tell.
+
+    Parameters:
+        paths (list of str): The processed files.
+        dtypes (pd.Series): The stacked dtypes (see stacked_dtypes).
+        batch_size (int): The number of rows read at once (default is STACK_BATCH_SIZE).
+
+    Returns:
+        numeric (bool): Whether the column is converted.
+    """
+    col = 'std_portion_amount'
+
+    for batch in _iter_aligned_batches(paths, dtypes, batch_size, columns=[col]):
+        # The steps of postprocess_stacked_df the column goes through before it's converted
+        values = apply_schema(batch, {col: COLUMN_SCHEMA[col]})[col]
+        if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values) or is_categorical(values):
+            values = clean_string_column(values)
+
+        if portion_amounts_to_float(values) is None:
+            return False
+
+    return True
+
+
+def iter_stacked_batches(paths, batch_size=STACK_BATCH_SIZE):
+    """
+    Stack and postprocess the processed files one batch at a time, rather than concatenating them in memory first,
+    so peak memory is bounded by the batch size instead of the size of the datasets.
+
+    Every batch holds the rows of a single file and is aligned to the stacked columns first (see align_batch), and
+    std_portion_amount is converted to float32 in every batch or in none of them (see
+    stacked_portions_are_numeric), so the batches hold the rows postprocess_stacked_df gives for the stacked data,
+    in the same order.
+
+    Parameters:
+        paths (list of str): The processed files, in stacking order.
+        batch_size (int): The number of rows stacked and postprocessed at once (default is STACK_BATCH_SIZE).
+
+    Yields:
+        batch (pd.DataFrame): The next postprocessed batch.
+    """
+    dtypes = stacked_dtypes(paths)
+    numeric_portions = stacked_portions_are_numeric(paths, dtypes, batch_size)
+
+    for batch in _iter_aligned_batches(paths, dtypes, batch_size):
+        yield postprocess_stacked_df(batch, numeric_portions=numeric_portions)
@@ -5,9 +5,22 @@ import zipfile
 import re
 import ingredient_slicer
 import json
+import time
+import concurrent.futures
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from preprocessing import _constants
+from preprocessing._categorical import concat_frames, fillna_categorical, is_categorical, to_categorical
+from preprocessing._download import cached_download, remove_cache_entry
+from preprocessing._ingest import iter_csv, read_csv
+from preprocessing._keys import decode_columns, decode_keys, has_keys, rank_keys
+from preprocessing._parallel import parallel_map
+from preprocessing._pivot import pivot_mean
+from preprocessing._portions import lookup_portions, parse_portions
+from preprocessing._profile import profile_stage, profiled
+from preprocessing._schema import CATEGORICAL_COLUMNS, apply_schema
 
 
 def get_usda_urls():
@@ -40,68 +53,106 @@ def get_usda_urls():
     return csv_download_links
 
 
-def download_usda_csv(csv_url, raw_dir):
+@profiled('download')
+def download_usda_csv(csv_url, raw_dir, cache_dir=None, extract=False):
     """
-    Download and extract a USDA CSV file from the provided URL.
+    Download a USDA CSV zip file from the provided URL.
+
+    The zip file is fetched through the persistent download cache (see _download.cached_download), so an
+    unchanged archive is only revalidated with the server rather than downloaded again. The CSV files are read
+    straight out of the zip file (see read_archive_csv), so extracting it is only needed to keep the raw files.
 
     Parameters:
         csv_url (str): The URL pointing to the USDA CSV file to be downloaded.
-        raw_dir (str): The directory where the downloaded and extracted file will be saved.
+        raw_dir (str): The directory where the extracted files will be saved.
+        cache_dir (str): The directory holding the download cache. If None, the zip file is downloaded into
+            raw_dir and should be removed with remove_cache_entry once processed (default is None).
+        extract (bool): Whether to extract the zip file into raw_dir (default is False).
 
     Returns:
-        None
+        filepath (str): The path to the downloaded zip file.
     """
-    def download_url(url, save_path, chunk_size=128):
-        """
-        Download a file from a URL and save it to the specified path.
+    # Download the csv file
+    filepath = cached_download(csv_url, cache_dir or raw_dir)
 
-        Parameters:
-            url (str): The URL of the file to be downloaded.
-            save_path (str): The path where the downloaded file will be saved.
-            chunk_size (int): The size of each download chunk (default is 128 bytes).
+    if extract:
+        print(f'Extracting file paths to:\n> {raw_dir}\n')
 
-        Returns:
-            None
-        """
-        r = requests.get(url, stream=True)
-        with open(save_path, 'wb') as fd:
-            for chunk in r.iter_content(chunk_size=chunk_size):
-                fd.write(chunk)
+        with zipfile.ZipFile(filepath, 'r') as zip:
+            zip.extractall(raw_dir)
 
-    # Download the csv file
-    filename = os.path.basename(csv_url)
-    filepath = os.path.join(raw_dir, filename)
+    return filepath
 
-    print(f'Downloading file paths to:\n> {filepath}\n')
 
-    download_url(csv_url, filepath)
+def archive_root(archive, csv_url):
+    """
+    Get the name of the top-level folder the files of a USDA zip file are packed in.
 
-    with zipfile.ZipFile(filepath, 'r') as zip:
-        zip.extractall(raw_dir)
+    Parameters:
+        archive (zipfile.ZipFile): The opened USDA zip file.
+        csv_url (str): The URL the zip file was downloaded from, used when the files aren't packed in a folder.
 
-    # Delete the zip file
-    os.remove(filepath)
+    Returns:
+        root (str): The name of the top-level folder.
+    """
+    for name in archive.namelist():
+        if '/' in name:
+            return name.split('/')[0]
 
+    return os.path.splitext(os.path.basename(csv_url))[0]
 
-def delete_unnecessary_files(dir, files_to_keep):
+
+def find_archive_member(archive, filename):
     """
-    Delete unnecessary files from a directory, keeping only specified files.
+    Find the member of a zip file with the given file name, in whichever folder it is packed in.
 
     Parameters:
-        dir_path (str): The path to the directory containing the files.
-        files_to_keep (list of str): A list of filenames to keep in the directory.
+        archive (zipfile.ZipFile): The opened zip file.
+        filename (str): The file name to look for (i.e. 'food.csv').
 
     Returns:
-        None
+        member (str): The full name of the member within the zip file.
     """
-    for root, dirs, files in os.walk(dir):
+    for name in archive.namelist():
+        if name.split('/')[-1] == filename and not name.startswith('__MACOSX/'):
+            return name
 
-        for file in files:
+    raise FileNotFoundError(f"'{filename}' not found in {archive.filename}")
 
-            if file not in files_to_keep:
 
-                file_path = os.path.join(root, file)
-                os.remove(file_path)
+@profiled('read_csv')
+def read_archive_csv(archive, filename, engine='pandas', **kwargs):
+    """
+    Read a CSV file straight out of a zip file, streaming the decompressed data into the CSV parser.
+
+    Parameters:
+        archive (zipfile.ZipFile): The opened zip file.
+        filename (str): The file name of the CSV file within the zip file (i.e. 'food.csv').
+        engine (str): The CSV engine to use, one of _ingest.CSV_ENGINES (default is 'pandas').
+        **kwargs: Keyword arguments passed on to _ingest.read_csv (usecols, dtype, and pd.read_csv options).
+
+    Returns:
+        df (pd.DataFrame): The CSV file contents.
+    """
+    with archive.open(find_archive_member(archive, filename)) as f:
+        return read_csv(f, engine=engine, **kwargs)
+
+
+def iter_archive_csv(archive, filename, engine='pandas', **kwargs):
+    """
+    Read a CSV file straight out of a zip file chunk by chunk, so it never has to be held in memory at once.
+
+    Parameters:
+        archive (zipfile.ZipFile): The opened zip file.
+        filename (str): The file name of the CSV file within the zip file (i.e. 'food_nutrient.csv').
+        engine (str): The CSV engine to use, one of _ingest.CSV_ENGINES (default is 'pandas').
+        **kwargs: Keyword arguments passed on to _ingest.iter_csv (usecols, dtype, chunksize, and pd.read_csv options).
+
+    Yields:
+        chunk (pd.DataFrame): The next chunk of the CSV file contents.
+    """
+    with archive.open(find_archive_member(archive, filename)) as f:
+        yield from iter_csv(f, engine=engine, **kwargs)
 
 
 def filter_relevent_nutrients(df):
@@ -114,24 +165,48 @@ def filter_relevent_nutrients(df):
     Returns:
     - None
     """
-    relevant_nutrients = ['Energy', 'Protein', 'Carbohydrate, by difference', 'Total lipid (fat)',
-                          'Iron, Fe', 'Sodium, Na', 'Cholesterol', 'Fatty acids, total trans', 'Fatty acids, total saturated',
-                          'Fiber, total dietary', 'Sugars, Total', 'Vitamin A, RAE', 'Vitamin C, total ascorbic acid',
-                          'Calcium, Ca', 'Retinol', 'Folate, total', 'Fatty acids, total monounsaturated', 'Fatty acids, total polyunsaturated',
-                          'Riboflavin', 'Vitamin B-12', 'Vitamin K (Dihydrophylloquinone)', 'Vitamin K (phylloquinone)',
-                          'Tryptophan', 'Threonine', 'Methionine', 'Phenylalanine', 'Carotene, beta', 'Thiamin',
-                          'Starch', 'Fructose', 'Lactose', 'Galactose', 'Magnesium, Mg', 'Phosphorus, P', 'Copper, Cu',
-                          'Manganese, Mn', 'Tyrosine', 'Alanine', 'Glutamic acid', 'Glycine', 'Proline', 'Valine',
-                          'Arginine', 'Histidine', 'Aspartic acid', 'Serine', 'Sucrose', 'Glucose', 'Maltose',
-                          'Potassium, K', 'Zinc, Zn', 'Selenium, Se', 'Vitamin E (alpha-tocopherol)', 'Niacin', 'Pantothenic acid',
-                          'Vitamin B-6', 'Isoleucine', 'Leucine', 'Lysine', 'Cystine',
-                          'Choline, total', 'Betaine', 'Vitamin K (Menaquinone-4)',
-                          'Vitamin D3 (cholecalciferol)', 'Vitamin D2 (ergocalciferol)']
-
-    df.drop(df[~df['nutrient_name'].isin(relevant_nutrients) |
+    df.drop(df[~df['nutrient_name'].isin(_constants.RELEVANT_NUTRIENTS) |
             (df['nutrient_unit'] == 'kJ')].index, inplace=True)
 
 
+def relevant_nutrient_ids(nutrients):
+    """
+    Resolve the relevant nutrients (see filter_relevent_nutrients) to their ids, so food_nutrient.csv can be
+    filtered by nutrient_id while it's read, before any merges.
+
+    Parameters:
+    - nutrients (DataFrame): The nutrient data, with 'nutrient_id', 'nutrient_name' and 'nutrient_unit' columns.
+
+    Returns:
+    - nutrient_ids (list): The ids of the relevant nutrients, excluding the ones measured in kJ.
+    """
+    is_relevant = nutrients['nutrient_name'].isin(_constants.RELEVANT_NUTRIENTS) & \
+        (nutrients['nutrient_unit'] != 'kJ')
+
+    return nutrients.loc[is_relevant, 'nutrient_id'].tolist()
+
+
+def per_gram_multipliers(nutrient_units):
+    """
+    Get the multiplier converting nutrient amounts per 100 g to per gram amounts in grams (or kcal), for every
+    nutrient unit.
+
+    Parameters:
+    - nutrient_units (Series): The nutrient units (i.e. 'G', 'MG').
+
+    Returns:
+    - multipliers (Series): The multiplier of every unit, 0 for the units that aren't converted.
+    """
+    multipliers = pd.Series(0.0, index=nutrient_units.index)
+
+    multipliers[nutrient_units == 'KCAL'] = round(1/100, 10)
+    multipliers[nutrient_units == 'G'] = round(1/100, 10)
+    multipliers[nutrient_units == 'MG'] = round(0.001/100, 10)
+    multipliers[nutrient_units == 'UG'] = round(0.000001/100, 10)
+
+    return multipliers
+
+
 def add_per_gram_amt(df):
     """
     Add a new column for the per gram amount of various nutrients to the DataFrame.
@@ -145,16 +220,7 @@ def add_per_gram_amt(df):
     Returns:
     - None
     """
-    df['multiplier'] = 0
-
-    df.loc[df['nutrient_unit'] == 'KCAL', 'multiplier'] = round(1/100, 10)
-    df.loc[df['nutrient_unit'] == 'G', 'multiplier'] = round(1/100, 10)
-    df.loc[df['nutrient_unit'] == 'MG', 'multiplier'] = round(0.001/100, 10)
-    df.loc[df['nutrient_unit'] == 'UG', 'multiplier'] = round(0.000001/100, 10)
-
-    df['per_gram_amt'] = round(df.nutrient_amount * df.multiplier, 10)
-
-    df.drop(['multiplier'], axis=1, inplace=True)
+    df['per_gram_amt'] = round(df.nutrient_amount * per_gram_multipliers(df['nutrient_unit']), 10)
 
 
 def format_col_names(col_names):
@@ -189,12 +255,11 @@ def format_col_names(col_names):
 def format_ingredients(ingredients):
     """
     Format the ingredients string by performing various preprocessing steps:
-    1. Remove substrings that contain less than a certain number of percentage symbols.
-    2. Convert the ingredients to lowercase and remove specific substrings like 'ingredients:' and 'made from:'.
-    3. Replace opening parentheses with commas.
-    4. Remove special characters except commas and normalize whitespace.
-    5. Split the ingredients string into a list, splitting at commas.
-    6. Strip whitespace from each item in the ingredients list.
+    1. Convert the ingredients to lowercase and remove specific substrings like 'ingredients:' and 'made from:'.
+    2. Replace opening parentheses with commas.
+    3. Remove special characters except commas and normalize whitespace.
+    4. Split the ingredients string into a list, splitting at commas.
+    5. Strip whitespace from each item in the ingredients list.
 
     Parameters:
         ingredients (str): The input string containing ingredients information.
@@ -203,17 +268,9 @@ def format_ingredients(ingredients):
         formatted_ingredients (list): A list of formatted ingredients.
     """
 
-    # Matches phrases like "contains less than NUMBER %" or "contains less than NUMBER % of:"
-    CONTAINS_LESS_THEN_NUMBER_PCT_SYMBOL_REGEX = re.compile(
-        r'contains less than\s*(?:\d*\.\d+|\d+\s*/\s*\d+|\d+)\s*%', re.IGNORECASE)
-    CONTAINS_LESS_THEN_NUMBER_PCT_SYMBOL_OF_REGEX = re.compile(
-        r'contains less than\s*(?:\d*\.\d+|\d+\s*/\s*\d+|\d+)\s*%\s*of:', re.IGNORECASE)
-
-    # Remove substrings that contain less than a certain number of percentage symbols from the formatted ingredients
-    formatted_ingredients = CONTAINS_LESS_THEN_NUMBER_PCT_SYMBOL_OF_REGEX.sub(
-        '', ingredients)
-    formatted_ingredients = CONTAINS_LESS_THEN_NUMBER_PCT_SYMBOL_REGEX.sub(
-        '', formatted_ingredients)
+    # The 'contains less than NUMBER %' substrings (CONTAINS_LESS_THEN_NUMBER_PCT_SYMBOL_OF_REGEX and
+    # CONTAINS_LESS_THEN_NUMBER_PCT_SYMBOL_REGEX) aren't removed: the lowercasing always started over from the
+    # original string, which dropped their removal, and the output is kept as it was
 
     # Convert the ingredients to lowercase and remove specific substrings
     formatted_ingredients = ingredients.lower()
@@ -233,45 +290,146 @@ def format_ingredients(ingredients):
     return formatted_ingredients
 
 
-def _find_and_replace_imps_patterns(category_value: str) -> str:
+def _format_ascii_ingredients(values):
     """
-    Find and replace matches of IMPS_PATTERN in the given string with the corresponding values in IMPS_MEAT_SERIES.
+    Format ASCII ingredients strings with Arrow string kernels, following the steps of format_ingredients.
     """
-    if category_value is np.nan:
-        return np.nan
 
-    offset = 0
-    pattern_iter = _constants.IMPS_PATTERN.finditer(category_value)
+    # Convert the ingredients to lowercase and remove specific substrings
+    formatted = pc.ascii_lower(values)
+    formatted = pc.replace_substring(formatted, 'ingredients:', '')
+    formatted = pc.replace_substring(formatted, 'made from:', '')
+    formatted = pc.replace_substring(formatted, '(', ',')
+
+    # Remove special characters except commas and normalize whitespace (only the whitespace runs that aren't a
+    # single space already are matched, which keeps the regex from replacing every space)
+    formatted = pc.replace_substring_regex(
+        formatted, f'[^a-z0-9_{_constants.ASCII_WHITESPACE},]+', '')
+    formatted = pc.replace_substring_regex(
+        formatted, f' [{_constants.ASCII_WHITESPACE}]+|[{_constants.ASCII_WHITESPACE[:-1]}][{_constants.ASCII_WHITESPACE}]*', ' ')
 
-    for match in pattern_iter:
-        match_string = match.group()
+    # Split the ingredients string into a list, splitting at commas and stripping whitespace
+    formatted = pc.split_pattern(formatted, ',')
 
-        # Get the start and end of the match and the modified start and end positions given the offset
-        start, end = match.start(), match.end()
-        modified_start = start + offset
-        modified_end = end + offset
+    return pa.chunked_array([pa.ListArray.from_arrays(chunk.offsets, pc.utf8_trim(chunk.values, ' '))
+                             for chunk in formatted.chunks], type=formatted.type)
 
-        DIGIT_PATTERN = re.compile(r'(\d+)')
 
-        digits = DIGIT_PATTERN.findall(match_string)[0]
+@profiled('format_ingredients')
+def format_ingredients_column(ingredients, workers=1):
+    """
+    Format a whole column of ingredients strings at once, giving the same lists as format_ingredients.
 
-        first_digit = digits[0]
-        first_two_digits = digits[0:2]
+    ASCII strings are formatted in bulk with Arrow string kernels, in slices of INGREDIENTS_SLICE_SIZE rows
+    spread over worker threads (the kernels release the GIL). The other strings are formatted with
+    format_ingredients, split across worker processes, since Python's Unicode lowercasing and regex
+    character classes differ from Arrow's.
 
-        if first_two_digits == "11":
-            replacement_str = _constants.IMPS_MEAT_SERIES["11"][1]
-        else:
-            replacement_str = _constants.IMPS_MEAT_SERIES.get(
-                first_digit, ["meat", "meat"])[1]
+    Parameters:
+        ingredients (pd.Series): The ingredients strings.
+        workers (int): The number of worker threads and processes (default is 1).
 
-        # Construct the modified string with the replacement applied
-        category_value = category_value[:modified_start] + \
-            str(replacement_str) + category_value[modified_end:]
+    Returns:
+        formatted_ingredients (pd.Series): The lists of formatted ingredients, as an Arrow list<string> column
+            with the index of ingredients.
+    """
+    values = pa.array(ingredients, type=pa.string(), from_pandas=True)
+    if isinstance(values, pa.Array):
+        values = pa.chunked_array([values])
+
+    if workers > 1 and len(values) > _constants.INGREDIENTS_SLICE_SIZE:
+        slices = [values.slice(offset, _constants.INGREDIENTS_SLICE_SIZE)
+                  for offset in range(0, len(values), _constants.INGREDIENTS_SLICE_SIZE)]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            formatted_slices = list(executor.map(_format_ascii_ingredients, slices))
+
+        formatted = pa.chunked_array([chunk for formatted_slice in formatted_slices for chunk in formatted_slice.chunks],
+                                     type=formatted_slices[0].type)
+    else:
+        formatted = _format_ascii_ingredients(values)
+
+    # Format the strings that aren't ASCII (and missing values, which raise like they do in format_ingredients)
+    is_ascii = pc.fill_null(pc.string_is_ascii(values), False)
+    other_idx = np.flatnonzero(~is_ascii.to_numpy())
+
+    if len(other_idx):
+        other_ingredients = parallel_map(
+            format_ingredients, values.take(pa.array(other_idx)).to_pylist(), workers)
+
+        other_formatted = [None] * len(values)
+        for idx, value in zip(other_idx, other_ingredients):
+            other_formatted[idx] = value
 
-        # Update the offset for subsequent removals
-        offset += len(str(replacement_str)) - (end - start)
+        formatted = pc.if_else(is_ascii, formatted, pa.array(
+            other_formatted, type=formatted.type))
 
-    return category_value
+    return pd.Series(pd.arrays.ArrowExtensionArray(formatted), index=ingredients.index)
+
+
+def arrow_lists_to_object(values):
+    """
+    Convert an Arrow-backed list column (i.e. as returned by format_ingredients_column) to a NumPy object column
+    of arrays, which is how Parquet list columns are read back.
+
+    Writing the Arrow-backed column to Parquet would store its extension dtype in the pandas metadata, which
+    pyarrow 13 can't read back.
+
+    Parameters:
+        values (pd.Series): The Arrow-backed list column.
+
+    Returns:
+        values (pd.Series): The object column, with the index of values.
+    """
+    return pd.Series(pa.chunked_array(pa.array(values)).to_pandas().to_numpy(), index=values.index)
+
+
+# Meat of every IMPS series, looked up by the longest series number an item number starts with
+_IMPS_SERIES_MEATS = {series: meat for series, (_, meat) in _constants.IMPS_MEAT_SERIES.items()}
+_IMPS_SERIES_LENGTHS = sorted({len(series) for series in _IMPS_SERIES_MEATS}, reverse=True)
+
+
+def _replace_meat_standard(match):
+    """
+    Replace a match of MEAT_STANDARD_PATTERN: 'meat' for a URMIS number, and the meat of its IMPS series for an IMPS
+    item, from the first number of the item once its URMIS numbers are replaced ('meat' for unknown series).
+    """
+    if match.group('urmis') is not None:
+        return 'meat'
+
+    digits = _constants.DIGIT_PATTERN.findall(_constants.URMIS_PATTERN.sub('meat', match.group('imps')))[0]
+
+    for length in _IMPS_SERIES_LENGTHS:
+        if digits[:length] in _IMPS_SERIES_MEATS:
+            return _IMPS_SERIES_MEATS[digits[:length]]
+
+    return 'meat'
+
+
+def normalize_meat_standards(values):
+    """
+    Replace the URMIS numbers in the food attribute values with 'meat', and the IMPS items with the meat of their
+    IMPS series (i.e. 'IMPS 410' with 'pork'), in a single pass of MEAT_STANDARD_PATTERN. The values repeat a lot,
+    so every distinct value is normalized once and the results are mapped back.
+
+    The result is the same as replacing URMIS_PATTERN with str.replace, then replacing the matches of IMPS_PATTERN
+    value by value, like process_srlegacy did before (see benchmarks/meat_standards_reference.py). Missing values
+    stay missing.
+
+    Parameters:
+        values (pd.Series): The food attribute values.
+
+    Returns:
+        normalized (pd.Series): The normalized values as an object column, with the index of values.
+    """
+    codes, uniques = pd.factorize(values)
+
+    normalized = [_constants.MEAT_STANDARD_PATTERN.sub(_replace_meat_standard, value) for value in uniques]
+
+    # Missing values have code -1, which picks the NaN appended last
+    normalized = np.array(normalized + [np.nan], dtype=object)[codes]
+
+    return pd.Series(normalized, index=values.index, dtype=object)
 
 
 def define_source(path):
@@ -332,12 +490,17 @@ def apply_ingredient_slicer(entry):
 
 
 # NOTE: this removes an extra iteration from the original version of this function (apply_ingredient_slicer())
-def apply_ingredient_slicer2(entry):
+def apply_ingredient_slicer2(entry, cache_dir=None):
     """
     Applies the IngredientSlicer to a portion modifier and returns the quantity and standardized unit.
 
+    Parsed entries are memoized in the same in-memory and on-disk caches as _portions.parse_portions, so
+    repeated entries are only parsed once.
+
     Parameters:
         entry (str): The row entry to be processed.
+        cache_dir (str): The directory holding the on-disk portion cache. If None, only the in-memory cache is
+            used (default is None).
 
     Returns:
         selected_data (dict): A dictionary containing the quantity and standardized unit extracted from the portion modifier.
@@ -347,11 +510,10 @@ def apply_ingredient_slicer2(entry):
     selected_data = {'quantity': 'no_value', 'standardized_unit': 'no_value'}
 
     try:
-        res = ingredient_slicer.IngredientSlicer(entry).to_json()
+        quantity, standardized_unit = lookup_portions([entry], cache_dir)[entry]
 
-        selected_data["quantity"] = res.get("quantity", "no_value")
-        selected_data["standardized_unit"] = res.get(
-            "standardized_unit", "no_value")
+        selected_data["quantity"] = quantity
+        selected_data["standardized_unit"] = standardized_unit
 
     except Exception as e:
         print(f'There was an error processing entry :"{entry}". {e}')
@@ -361,183 +523,161 @@ def apply_ingredient_slicer2(entry):
 
 def fillna_and_set_dtypes(df):
     """
-    Fill NaN values in the specified column of the DataFrame with predefined values 
-    based on the data types defined in the 'data_types' dictionary. Also, convert 
-    the data type of the column to float32 if it matches the float type.
+    Fill NaN values and set the data types of the DataFrame's columns, as defined for every column in
+    _schema.COLUMN_SCHEMA (i.e. 'no_value' for text, 0.0 for nutrient amounts, int32 for ids, float32 for
+    amounts, and categoricals for repetitive text). The columns are typed in place and validated.
 
     Parameters:
         df (pandas.DataFrame): The DataFrame to be processed.
-        col (str): The column name to be processed.
 
     Returns:
         DataFrame: The processed DataFrame.
     """
-    data_types = {
-        'alanine': 0.0,
-        'arginine': 0.0,
-        'betaine': 0.0,
-        'brand_name': 'no_value',
-        'brand_owner': 'no_value',
-        'calcium_ca': 0.0,
-        'carbohydrate_by_difference': 0.0,
-        'carotene_beta': 0.0,
-        'category': 'no_value',
-        'category_id': 0,
-        'cholesterol': 0.0,
-        'choline_total': 0.0,
-        'copper_cu': 0.0,
-        'cystine': 0.0,
-        'data_type': 'no_value',
-        'energy': 0.0,
-        'fatty_acids_total_monounsaturated': 0.0,
-        'fatty_acids_total_polyunsaturated': 0.0,
-        'fatty_acids_total_saturated': 0.0,
-        'fatty_acids_total_trans': 0.0,
-        'fdc_id': 0,
-        'fiber_total_dietary': 0.0,
-        'folate_total': 0.0,
-        'food_description': 'no_value',
-        'food_common_name': 'no_value',
-        'food_common_category': 'no_value',
-        'fructose': 0.0,
-        'galactose': 0.0,
-        'glucose': 0.0,
-        'glutamic_acid': 0.0,
-        'glycine': 0.0,
-        'histidine': 0.0,
-        'ingredients': 'no_value',
-        # 'ingredients': 'no_value',
-        'iron_fe': 0.0,
-        'isoleucine': 0.0,
-        'lactose': 0.0,
-        'leucine': 0.0,
-        'lysine': 0.0,
-        'magnesium_mg': 0.0,
-        'maltose': 0.0,
-        'manganese_mn': 0.0,
-        'measure_unit_id': 0,
-        'methionine': 0.0,
-        'niacin': 0.0,
-        'nutrient_amount': 0.0,
-        'nutrient_id': 0,
-        'nutrient_name': 'no_value',
-        'nutrient_unit': 'no_value',
-        'pantothenic_acid': 0.0,
-        'phenylalanine': 0.0,
-        'phosphorus_p': 0.0,
-        'portion_amount': 0.0,
-        'portion_energy': 0.0,
-        'portion_gram_weight': 0.0,
-        'portion_id': 0,
-        'portion_modifier': 'no_value',
-        'portion_unit': 'no_value',
-        'potassium_k': 0.0,
-        'proline': 0.0,
-        'protein': 0.0,
-        'retinol': 0.0,
-        'riboflavin': 0.0,
-        'selenium_se': 0.0,
-        'serine': 0.0,
-        'sodium_na': 0.0,
-        'std_portion_unit': 'no_value',
-        'std_portion_amount': 0.0,
-        'sucrose': 0.0,
-        'sugars_total': 0.0,
-        'thiamin': 0.0,
-        'threonine': 0.0,
-        'total_lipid_fat': 0.0,
-        'tryptophan': 0.0,
-        'tyrosine': 0.0,
-        'usda_data_source': 'no_value',
-        'valine': 0.0,
-        'vitamin_a_rae': 0.0,
-        'vitamin_b12': 0.0,
-        'vitamin_b6': 0.0,
-        'vitamin_c_total_ascorbic_acid': 0.0,
-        'vitamin_d2_ergocalciferol': 0.0,
-        'vitamin_d3_cholecalciferol': 0.0,
-        'vitamin_e_alphatocopherol': 0.0,
-        'vitamin_k_dihydrophylloquinone': 0.0,
-        'vitamin_k_menaquinone4': 0.0,
-        'vitamin_k_phylloquinone': 0.0,
-        'zinc_zn': 0.0
-    }
-
-    df = df.fillna(data_types, inplace=False)
-
-    # Get the data types of each column
-    dtypes = df.dtypes.to_dict()
-
-    # Set the data type in each column for integer columns to int32 and float columns to float32
-    for col in dtypes:
-        if col in df.columns:
-            if dtypes[col] in ["int32", "int64"]:
-                df[col] = df[col].astype("int32", errors='ignore')
-
-            elif dtypes[col] in ["float32", "float64"]:
-                df[col] = df[col].astype("float32", errors='ignore')
-    return df
+    return apply_schema(df)
 
 
 def dict_to_json(dictionary):
     return json.dumps(dictionary, ensure_ascii=False)
 
 
-def postprocess_stacked_df(df, verbose=False):
+def clean_string_column(values):
+    """
+    Convert every value to a string, strip whitespace from it and remove the control characters \\x00-\\x19, with
+    Arrow string kernels. The categories of a categorical are cleaned once each, rather than every row.
+
+    Parameters:
+        values (pd.Series): The values.
+
+    Returns:
+        cleaned (pd.Series): The cleaned strings as an object column, with the index of values.
+    """
+    if is_categorical(values):
+        categories = clean_string_column(pd.Series(values.cat.categories.astype(str))).to_numpy()
+
+        # Missing values have code -1, which picks the 'nan' appended last (like astype(str) gives them)
+        cleaned = np.append(categories, 'nan')[values.cat.codes.to_numpy()]
+
+        return pd.Series(cleaned, index=values.index, dtype=object)
+
+    cleaned = pc.utf8_trim(pa.array(values.astype(str), type=pa.string()), _constants.PYTHON_WHITESPACE)
+    cleaned = pc.replace_substring_regex(cleaned, _constants.CONTROL_CHARACTERS_REGEX, '')
+
+    return pd.Series(cleaned.to_numpy(zero_copy_only=False), index=values.index, dtype=object)
+
+
+def ingredients_to_json(ingredients):
+    """
+    Serialize a column of ingredients lists to '{"ingredients": [...]}' JSON strings in bulk, with the same output
+    as calling dict_to_json on every row.
+
+    Every ingredient is stripped and its control characters \\x00-\\x19 are removed first. Rows that hold a string
+    rather than a list (i.e. the 'no_value' fill) become a list of one empty ingredient.
+
+    Parameters:
+        ingredients (pd.Series): The ingredients lists (lists or arrays of strings).
+
+    Returns:
+        ingredients_json (pd.Series): The JSON strings as an object column, with the index of ingredients.
+    """
+    values = [[''] if isinstance(value, str) else value for value in ingredients]
+    lists = pa.array(values, type=pa.list_(pa.string()))
+
+    # Clean the ingredients of all lists at once
+    items = pc.utf8_trim(lists.flatten(), _constants.PYTHON_WHITESPACE)
+    items = pc.replace_substring_regex(items, _constants.CONTROL_CHARACTERS_REGEX, '')
+
+    # Escape them like json.dumps(..., ensure_ascii=False), the remaining control characters are \x1a-\x1f
+    items = pc.replace_substring(items, '\\', '\\\\')
+    items = pc.replace_substring(items, '"', '\\"')
+    for code in range(0x1a, 0x20):
+        items = pc.replace_substring(items, chr(code), f'\\u{code:04x}')
+
+    items = pc.binary_join_element_wise('"', items, '"', '')
+
+    # Join every list back together, an empty list gives '[]'
+    joined = pc.binary_join(pa.ListArray.from_arrays(lists.offsets, items), ', ')
+    ingredients_json = pc.binary_join_element_wise('{"ingredients": [', joined, ']}', '')
+
+    return pd.Series(ingredients_json.to_numpy(zero_copy_only=False), index=ingredients.index, dtype=object)
+
+
+def portion_amounts_to_float(values):
+    """
+    Convert the std_portion_amount values to float32, or return None if any of them isn't a number (i.e. the
+    'no_value' fill of the portions without a parsed quantity).
+
+    Parameters:
+        values (pd.Series): The std_portion_amount values.
+
+    Returns:
+        amounts (pd.Series): The float32 amounts, or None.
+    """
+    try:
+        return values.astype('float32')
+    except (ValueError, TypeError):
+        return None
+
+
+@profiled('postprocess')
+def postprocess_stacked_df(df, verbose=False, numeric_portions=None):
     """Apply final cleaning processes to the concatenated USDA datasets.
     Args:
         df (pd.DataFrame): The concatenated USDA datasets. (The 3 dataframes are the output results of process_foundation(), process_branded(), and process_sr_legacy() functions.
-        verbose (bool): Whether to print additional information (default is False).
+        verbose (bool): Whether to print additional information, including the time taken by every step (default is False).
+        numeric_portions (bool): Whether std_portion_amount is converted to float32, or None to convert it only if every value of df is a number. Batches of the stacked data pass the answer for the stacked data as a whole (default is None).
     Returns:
-        df (pd.DataFrame): The cleaned Pandas DataFrame.
+        df (pd.DataFrame): The cleaned Pandas DataFrame, with the time taken by every step (in seconds) in
+            df.attrs['postprocess_timings'].
     """
 
     print(f"Applying final cleaning processes...") if verbose else None
 
+    timings = {}
+    start = time.perf_counter()
+
     df.reset_index(drop=True, inplace=True)
 
-    df = df[[
-        'fdc_id', 'usda_data_source', 'data_type', 'category', 'brand_owner', 'brand_name',
-        'food_description', 'food_common_name', 'food_common_category', 'ingredients',
-                            'portion_amount', 'portion_unit', 'portion_modifier', 'std_portion_amount', 'std_portion_unit', 'portion_gram_weight',
-                            'portion_energy', 'energy', 'carbohydrate_by_difference', 'protein', 'total_lipid_fat', 'fiber_total_dietary', 'sugars_total',
-                            'calcium_ca', 'iron_fe', 'vitamin_c_total_ascorbic_acid', 'vitamin_a_rae', 'vitamin_e_alphatocopherol',
-                            'sodium_na', 'cholesterol', 'fatty_acids_total_saturated', 'fatty_acids_total_trans', 'fatty_acids_total_monounsaturated',
-                            'fatty_acids_total_polyunsaturated', 'vitamin_k_phylloquinone', 'thiamin', 'riboflavin', 'niacin', 'vitamin_b6', 'folate_total',
-                            'vitamin_b12', 'vitamin_d3_cholecalciferol', 'vitamin_d2_ergocalciferol', 'pantothenic_acid', 'phosphorus_p', 'magnesium_mg',
-                            'potassium_k', 'zinc_zn', 'copper_cu', 'manganese_mn', 'selenium_se', 'carotene_beta', 'retinol', 'vitamin_k_dihydrophylloquinone',
-                            'vitamin_k_menaquinone4', 'tryptophan', 'threonine', 'methionine', 'phenylalanine', 'tyrosine', 'valine', 'arginine', 'histidine',
-                            'isoleucine', 'leucine', 'lysine', 'cystine', 'alanine', 'glutamic_acid', 'glycine', 'proline', 'serine', 'sucrose', 'glucose',
-                            'maltose', 'fructose', 'lactose', 'galactose', 'choline_total', 'betaine'
-    ]]
+    df = df[_constants.OUTPUT_COLUMNS]
+    timings['select_columns'] = round(time.perf_counter() - start, 3)
 
     # Set data types for all columns, and fill NA values using fillna_and_set_dtypes function
+    start = time.perf_counter()
     df = fillna_and_set_dtypes(df)
+    timings['fillna_and_set_dtypes'] = round(time.perf_counter() - start, 3)
 
-    df['ingredients'] = df['ingredients'].apply(
-        lambda x: [s.strip() for s in x] if not isinstance(x, str) else [""])
-    df['ingredients'] = df['ingredients'].apply(
-        lambda x: [re.sub(r'[\x00-\x19]', '', s) for s in x])
-    df['ingredients'] = df.apply(
-        lambda row: {'ingredients': row['ingredients']}, axis=1)
-    df['ingredients'] = df['ingredients'].map(dict_to_json)
+    # Build the ingredients JSON strings
+    start = time.perf_counter()
+    df['ingredients'] = ingredients_to_json(df['ingredients'])
+    timings['ingredients_to_json'] = round(time.perf_counter() - start, 3)
 
-    # Clean up string columns
-    for str_cols in df.select_dtypes(include=['object']).columns:
+    # Clean up string columns (including the Arrow-backed ones read by the pyarrow CSV engine)
+    start = time.perf_counter()
+    for str_cols in df.select_dtypes(include=['object', 'string', 'category']).columns:
 
         if str_cols == "ingredients":
             continue
         else:
-            df[str_cols] = df[str_cols].astype(str)
-            df[str_cols] = df[str_cols].str.strip()
-            df[str_cols] = df[str_cols].apply(
-                lambda x: re.sub(r'[\x00-\x19]', '', x))
+            df[str_cols] = clean_string_column(df[str_cols])
+    timings['clean_string_columns'] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
 
     # Convert the fdc_id to an integer, it should NOT have floating point values
     df["fdc_id"] = df["fdc_id"].astype('int32', errors='ignore')
 
-    # coerce std_portion_amount to a float from a string
-    df["std_portion_amount"] = df["std_portion_amount"].astype(
-        'float32', errors='ignore')
+    # coerce std_portion_amount to a float from a string, unless some of it isn't a number
+    if numeric_portions is not False:
+        amounts = portion_amounts_to_float(df["std_portion_amount"])
+        if amounts is not None:
+            df["std_portion_amount"] = amounts
+    timings['set_output_dtypes'] = round(time.perf_counter() - start, 3)
+
+    df.attrs['postprocess_timings'] = timings
+
+    if verbose:
+        print('Postprocessing step timings:')
+        for step, seconds in timings.items():
+            print(f'> {step}: {seconds}s')
+        print()
 
     return df
@@ -1,7 +1,40 @@
-
+import os
+import tempfile
+import zipfile
 import pandas as pd
 import gc
 from preprocessing._utils import *
+from preprocessing import _lazy
+from preprocessing._intermediate import intermediate_path, write_intermediate
+from preprocessing._partition import PARTITION_SIZE, combine_partitions, partition_bounds, read_partition, spill_partitions
+
+# Columns, dtypes, and renames of the large branded CSV files, shared by the in-memory and streaming modes
+BRANDED_CSV_FILES = {
+    'branded_foods': {
+        'filename': 'branded_food.csv',
+        'usecols': ['fdc_id', 'brand_owner', 'brand_name', 'ingredients', 'serving_size',
+                    'serving_size_unit', 'household_serving_fulltext', 'branded_food_category'],
+        'dtype': {'fdc_id': 'int32', 'brand_owner': 'category', 'brand_name': 'category', 'ingredients': 'str',
+                  'serving_size': 'float32', 'serving_size_unit': 'category', 'household_serving_fulltext': 'str',
+                  'branded_food_category': 'category'},
+        'rename': {'serving_size': 'portion_amount',
+                   'serving_size_unit': 'portion_unit',
+                   'household_serving_fulltext': 'portion_modifier',
+                   'branded_food_category': 'category'},
+    },
+    'foods': {
+        'filename': 'food.csv',
+        'usecols': ['fdc_id', 'description'],
+        'dtype': {'fdc_id': 'int32', 'description': 'str'},
+        'rename': {'description': 'food_description'},
+    },
+    'food_nutrients': {
+        'filename': 'food_nutrient.csv',
+        'usecols': ['fdc_id', 'nutrient_id', 'amount'],
+        'dtype': {'fdc_id': 'int32', 'nutrient_id': 'int16', 'amount': 'float32'},
+        'rename': {'amount': 'nutrient_amount'},
+    },
+}
 
 
 def process_branded(
@@ -9,83 +42,125 @@ def process_branded(
     output_dir=None,
     raw_dir=None,
     keep_files=False,
+    cache_dir=None,
+    csv_engine='pandas',
+    streaming=False,
+    partition_size=PARTITION_SIZE,
+    workers=1,
+    backend='pandas',
+    intermediate_format='parquet',
 ):
 
-    if not os.path.exists(raw_dir):
-        os.makedirs(raw_dir)
-
-    download_usda_csv(url, raw_dir)
-
-    # Find the directory containing the downloaded files to define branded_dir
-    for path in os.listdir(raw_dir):
-        if 'branded' in path:
-            print(f'Found branded data in:\n> {path}\n')
-            branded_dir = os.path.join(raw_dir, path)
-            source = define_source(branded_dir)[0]
+    # Download the zip file, the raw files are only extracted if keep_files flag is specified
+    zip_path = download_usda_csv(url, raw_dir, cache_dir, extract=keep_files)
 
-    # Delete unnecessary files if keep_files flag is not specified
-    if not keep_files:
-        files_to_keep = ['branded_food.csv',
-                         'food_nutrient.csv', 'food.csv', 'nutrient.csv']
-        delete_unnecessary_files(branded_dir, files_to_keep)
+    branded_archive = zipfile.ZipFile(zip_path, 'r')
+    branded_dir = os.path.join(raw_dir, archive_root(branded_archive, url))
+    source = define_source(branded_dir)[0]
+    print(f'Found branded data in:\n> {os.path.basename(branded_dir)}\n')
 
     print(f'Initializing processing for:\n> {source}\n')
 
-    branded_foods = pd.read_csv(os.path.join(branded_dir, 'branded_food.csv'),
-                                usecols=['fdc_id', 'brand_owner', 'brand_name', 'ingredients', 'serving_size',
-                                         'serving_size_unit', 'household_serving_fulltext', 'branded_food_category'],
-                                dtype={'fdc_id': 'int32', 'brand_owner': 'str', 'brand_name': 'str', 'ingredients': 'str',
-                                       'serving_size': 'float32', 'serving_size_unit': 'str', 'household_serving_fulltext': 'str',
-                                       'branded_food_category': 'str'},
-                                low_memory=False)
-
-    food_nutrients = pd.read_csv(os.path.join(branded_dir, 'food_nutrient.csv'),
-                                 usecols=['fdc_id', 'nutrient_id', 'amount'],
-                                 dtype={
-                                     'fdc_id': 'int32', 'nutrient_id': 'int16', 'amount': 'float32'},
+    # Load nutrient.csv, which is small enough to be read in full in both modes
+    nutrients = read_archive_csv(branded_archive, 'nutrient.csv', csv_engine,
+                                 usecols=['id', 'name', 'unit_name'],
+                                 dtype={'id': 'int16', 'name': 'category',
+                                        'unit_name': 'category'},
                                  low_memory=False)
 
-    foods = pd.read_csv(os.path.join(branded_dir, 'food.csv'),
-                        usecols=['fdc_id', 'description'],
-                        dtype={'fdc_id': 'int32', 'description': 'str'},
-                        low_memory=False)
-
-    nutrients = pd.read_csv(os.path.join(branded_dir, 'nutrient.csv'),
-                            usecols=['id', 'name', 'unit_name'],
-                            dtype={'id': 'int16', 'name': 'str',
-                                   'unit_name': 'str'},
-                            low_memory=False)
-
-    branded_foods.rename(columns={'serving_size': 'portion_amount',
-                                  'serving_size_unit': 'portion_unit',
-                                  'household_serving_fulltext': 'portion_modifier',
-                                  'branded_food_category': 'category'}, inplace=True)
-
-    # Rename columns to be consistent across datasets
-    food_nutrients.rename(columns={'amount': 'nutrient_amount'}, inplace=True)
-    foods.rename(columns={'description': 'food_description'}, inplace=True)
     nutrients.rename(columns={'id': 'nutrient_id', 'name': 'nutrient_name',
                      'unit_name': 'nutrient_unit'}, inplace=True)
 
-    gc.collect()
+    # Resolve the relevant nutrients to their ids once, so only their rows of food_nutrient.csv are read
+    nutrient_ids = relevant_nutrient_ids(nutrients)
+    nutrients = nutrients[nutrients['nutrient_id'].isin(nutrient_ids)]
 
-    # Set data types for all columns, and fill NA values using fillna_and_set_dtypes function
-    branded_foods = fillna_and_set_dtypes(branded_foods)
-    food_nutrients = fillna_and_set_dtypes(food_nutrients)
-    foods = fillna_and_set_dtypes(foods)
+    output_path = intermediate_path(output_dir, 'branded', intermediate_format)
 
-    # Join datasets
-    full_foods = pd.merge(food_nutrients, nutrients,
-                          on='nutrient_id', how='left')
-    full_foods.drop(['nutrient_id'], axis=1, inplace=True)
+    if streaming:
+        _process_branded_streaming(branded_archive, nutrients, nutrient_ids, branded_dir,
+                                   output_dir, output_path, cache_dir, csv_engine, partition_size, workers,
+                                   backend)
+        branded_archive.close()
 
-    full_foods = pd.merge(foods, full_foods, on='fdc_id', how='left')
-    full_foods = pd.merge(full_foods, branded_foods, on='fdc_id', how='left')
+    else:
+        # Declare the datasets, which are read straight from the zip file when they're joined
+        branded_foods = _scan_branded_csv(branded_archive, 'branded_foods', csv_engine)
+        foods = _scan_branded_csv(branded_archive, 'foods', csv_engine)
+        food_nutrients = _lazy.filter_rows(_scan_branded_csv(branded_archive, 'food_nutrients', csv_engine),
+                                           _lazy.isin('nutrient_id', nutrient_ids))
 
-    gc.collect()
+        full_foods, _ = _merge_and_pivot(foods, food_nutrients, nutrients, branded_foods, backend)
+
+        branded_archive.close()
+
+        gc.collect()
+
+        full_foods = _finalize_branded(full_foods, branded_dir, cache_dir, workers)
+
+        # Save intermediary dataframe
+        with profile_stage('to_parquet', rows_in=len(full_foods)):
+            write_intermediate(full_foods, output_path)
+
+    # Delete the zip file if it isn't kept in a persistent download cache
+    if cache_dir is None:
+        remove_cache_entry(url, raw_dir)
+
+
+def _scan_branded_csv(branded_archive, name, csv_engine):
+    """
+    Declare one of the BRANDED_CSV_FILES as a plan reading it straight from the zip file, with its columns renamed
+    (see _lazy.scan_archive_csv).
+    """
+    spec = BRANDED_CSV_FILES[name]
+
+    return _lazy.scan_archive_csv(branded_archive, spec['filename'], spec['usecols'], spec['dtype'],
+                                  rename=spec['rename'], csv_engine=csv_engine)
+
+
+def _iter_branded_csv(branded_archive, name, csv_engine, filters=None):
+    """
+    Read one of the BRANDED_CSV_FILES straight from the zip file chunk by chunk, with its columns renamed.
+    """
+    spec = BRANDED_CSV_FILES[name]
+    for chunk in iter_archive_csv(branded_archive, spec['filename'], csv_engine,
+                                  usecols=spec['usecols'], dtype=spec['dtype'], filters=filters,
+                                  low_memory=False):
+        yield chunk.rename(columns=spec['rename'])
+
+
+@profiled('merge_and_pivot')
+def _merge_and_pivot(foods, food_nutrients, nutrients, branded_foods, backend='pandas'):
+    """
+    Join the branded datasets and pivot the per gram nutrient amounts into one column per nutrient.
+
+    Every food is handled on its own, so the datasets can be processed in full or one fdc_id range at a time.
 
-    # Filter for rows with relevant_nutrients using filter_relevent_nutrients function
-    filter_relevent_nutrients(full_foods)
+    Parameters:
+        foods (pd.DataFrame or dict): The food.csv data, or a plan reading it (see _lazy).
+        food_nutrients (pd.DataFrame or dict): The food_nutrient.csv data, or a plan reading it.
+        nutrients (pd.DataFrame): The nutrient.csv data.
+        branded_foods (pd.DataFrame or dict): The branded_food.csv data, or a plan reading it.
+        backend (str): The backend the datasets are joined with, one of _lazy.BACKENDS (default is 'pandas').
+
+    Returns:
+        full_foods (pd.DataFrame): One row per food, with the food info followed by the nutrient columns.
+        nutrient_cols (list): The names of the nutrient columns, sorted.
+    """
+
+    # Join datasets, setting their data types and filling their NA values (see fillna_and_set_dtypes) first, and
+    # keep the rows of the relevant nutrients
+    full_foods = _lazy.join(_lazy.from_frame(food_nutrients, fill=True), _lazy.from_frame(nutrients),
+                            on='nutrient_id')
+    full_foods = _lazy.drop(full_foods, ['nutrient_id'])
+
+    full_foods = _lazy.join(_lazy.from_frame(foods, fill=True), full_foods, on='fdc_id')
+    full_foods = _lazy.join(full_foods, _lazy.from_frame(branded_foods, fill=True), on='fdc_id')
+    full_foods = _lazy.filter_rows(full_foods, *_lazy.relevant_nutrient_predicates())
+
+    full_foods = _lazy.collect(full_foods, backend)
+
+    gc.collect()
 
     # Add new column for per gram amount using add_per_gram_amt function
     add_per_gram_amt(full_foods)
@@ -96,21 +171,41 @@ def process_branded(
 
     # Stash the first row of each group to join back with the pivoted nutrition data later
     stashed_food_info = full_foods.groupby(
-        ['fdc_id', 'food_description', 'category']).first().reset_index()
+        ['fdc_id', 'food_description', 'category'], observed=True).first().reset_index()
 
-    stashed_food_info['brand_name'].fillna('no_value', inplace=True)
+    stashed_food_info['brand_name'] = fillna_categorical(stashed_food_info['brand_name'], 'no_value')
     stashed_food_info['portion_modifier'].fillna('no_value', inplace=True)
 
-    full_foods = full_foods.pivot_table(
-        index=['fdc_id'],
-        columns='nutrient_name',
-        values='per_gram_amt').reset_index()
+    full_foods = pivot_mean(full_foods,
+                            index=['fdc_id'],
+                            columns='nutrient_name',
+                            values='per_gram_amt')
+
+    nutrient_cols = [col for col in full_foods.columns if col != 'fdc_id']
 
     full_foods = pd.merge(stashed_food_info, full_foods,
                           on='fdc_id', how='left')
 
     gc.collect()
 
+    return full_foods, nutrient_cols
+
+
+@profiled('finalize')
+def _finalize_branded(full_foods, branded_dir, cache_dir=None, workers=1):
+    """
+    Add the derived columns to the pivoted branded data and format its column names and values.
+
+    Parameters:
+        full_foods (pd.DataFrame): The pivoted data, as returned by _merge_and_pivot.
+        branded_dir (str): The path of the branded data, used to define the data source.
+        cache_dir (str): The directory holding the on-disk portion cache, if any (default is None).
+        workers (int): The number of worker processes used for the per row text processing (default is 1).
+
+    Returns:
+        full_foods (pd.DataFrame): The processed branded data.
+    """
+
     # Add portion_energy column as calorie estimate
     full_foods['portion_energy'] = full_foods['Energy'] * \
         full_foods['portion_amount']
@@ -121,17 +216,13 @@ def process_branded(
 
     # Add columns applying ingredient_slicer function
     full_foods['portion_combined'] = full_foods.loc[:, 'portion_amount'].astype(
-        str) + ' ' + full_foods.loc[:, 'portion_unit'] + ' ' + full_foods.loc[:, 'portion_modifier']
-
-    # Extract ingredients from portion_combined column
-    full_foods['parsed_ingredient'] = full_foods['portion_combined'].apply(
-        lambda x: ingredient_slicer.IngredientSlicer(x).parsed_ingredient())
-    full_foods['std_portion_amount'] = full_foods['parsed_ingredient'].apply(
-        lambda x: x["quantity"] if x["quantity"] else "no_value")
-    full_foods['std_portion_unit'] = full_foods['parsed_ingredient'].apply(
-        lambda x: x["standardized_unit"] if x["standardized_unit"] else "no_value")
-    full_foods.drop(['portion_combined', 'parsed_ingredient'],
-                    axis=1, inplace=True)
+        str) + ' ' + full_foods.loc[:, 'portion_unit'].astype(object) + ' ' + full_foods.loc[:, 'portion_modifier']
+
+    # Extract ingredients from portion_combined column, parsing every unique portion once (see _portions.parse_portions)
+    portions = parse_portions(full_foods['portion_combined'], cache_dir, workers=workers)
+    full_foods['std_portion_amount'] = portions['quantity']
+    full_foods['std_portion_unit'] = portions['standardized_unit']
+    full_foods.drop(['portion_combined'], axis=1, inplace=True)
 
     gc.collect()
 
@@ -150,24 +241,103 @@ def process_branded(
         full_foods[col] = full_foods[col].str.replace(
             '(', '').replace(')', '').str.lower()
 
-    # Format ingredient values using the format_ingredients function
-    full_foods['ingredients'] = full_foods['ingredients'].apply(
-        lambda x: format_ingredients(x))
-
-    # Save intermediary dataframe
-    full_foods.to_parquet(os.path.join(
-        output_dir, f'processed_branded.parquet'))
-
-    # Delete ramining files if keep_files flag is not specified
-    if not keep_files:
-        import shutil
-
-        for root, dirs, files in os.walk(branded_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                os.remove(file_path)
-
-        try:
-            os.removedirs(branded_dir)
-        except OSError:
-            shutil.rmtree(branded_dir)
+    # Format ingredient values for the whole column at once using the format_ingredients_column function
+    full_foods['ingredients'] = arrow_lists_to_object(format_ingredients_column(
+        full_foods['ingredients'], workers))
+
+    # Keep the repetitive text columns categorical in the intermediary dataframe
+    full_foods = to_categorical(full_foods, CATEGORICAL_COLUMNS)
+
+    return full_foods
+
+
+def _process_branded_streaming(branded_archive, nutrients, nutrient_ids, branded_dir, output_dir, output_path,
+                               cache_dir=None, csv_engine='pandas', partition_size=PARTITION_SIZE, workers=1,
+                               backend='pandas'):
+    """
+    Process the branded data one fdc_id range at a time, so peak memory is bounded by the partition size
+    instead of the size of the dataset.
+
+    1. The large CSV files are read chunk by chunk and spilled to disk, split by fdc_id range.
+    2. Every partition is merged and pivoted on its own, and its nutrient columns are recorded.
+    3. Every partition is reindexed to the sorted union of the nutrient columns, finalized, and written as
+       its own row group of the output file, which matches the one written by the in-memory mode.
+
+    Parameters:
+        branded_archive (zipfile.ZipFile): The opened branded zip file.
+        nutrients (pd.DataFrame): The relevant nutrients from nutrient.csv.
+        nutrient_ids (list): The ids of the relevant nutrients.
+        branded_dir (str): The path of the branded data, used to define the data source.
+        output_dir (str): The directory the temporary partition files are written to.
+        output_path (str): The path of the processed file, whose extension selects its format (see _intermediate).
+        cache_dir (str): The directory holding the on-disk portion cache, if any (default is None).
+        csv_engine (str): The CSV engine to use, one of _ingest.CSV_ENGINES (default is 'pandas').
+        partition_size (int): The number of foods processed at once (default is 100000).
+        workers (int): The number of worker processes used for the per row text processing (default is 1).
+        backend (str): The backend the partitions are joined with, one of _lazy.BACKENDS (default is 'pandas').
+
+    Returns:
+        None
+    """
+
+    # Split the foods into fdc_id ranges of partition_size foods each
+    food_ids = read_archive_csv(branded_archive, 'food.csv', csv_engine,
+                                usecols=['fdc_id'], dtype={'fdc_id': 'int32'})['fdc_id']
+    bounds = partition_bounds(food_ids, partition_size)
+    del food_ids
+
+    print(f'Streaming branded data in {len(bounds)} partitions of up to {partition_size} foods.\n')
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as spill_dir:
+
+        # Spill the large CSV files to disk, split by fdc_id range
+        templates = {}
+        for name in BRANDED_CSV_FILES:
+            filters = {'nutrient_id': nutrient_ids} if name == 'food_nutrients' else None
+            with profile_stage('spill'):
+                templates[name] = spill_partitions(_iter_branded_csv(branded_archive, name, csv_engine, filters),
+                                                   os.path.join(spill_dir, name), bounds)
+
+        # Merge and pivot every partition, keeping track of the nutrient columns found in any of them
+        merged_paths = []
+        nutrient_dtypes = {}
+        for partition in range(len(bounds)):
+            tables = {name: read_partition(os.path.join(spill_dir, name), partition, templates[name])
+                      for name in BRANDED_CSV_FILES}
+
+            full_foods, nutrient_cols = _merge_and_pivot(tables['foods'], tables['food_nutrients'], nutrients,
+                                                         tables['branded_foods'], backend)
+            del tables
+
+            for col in nutrient_cols:
+                nutrient_dtypes.setdefault(col, full_foods[col].dtype)
+
+            if len(full_foods):
+                merged_paths.append(os.path.join(spill_dir, f'merged-{partition:06d}.parquet'))
+                full_foods.to_parquet(merged_paths[-1], index=False)
+
+            del full_foods
+            gc.collect()
+
+        # Reindex every partition to the nutrient columns of the whole dataset before finalizing it
+        nutrient_cols = sorted(nutrient_dtypes)
+        processed_paths = []
+        for merged_path in merged_paths:
+            full_foods = pd.read_parquet(merged_path)
+            food_info_cols = [col for col in full_foods.columns if col not in nutrient_dtypes]
+
+            full_foods = full_foods.reindex(columns=food_info_cols + nutrient_cols)
+            for col, dtype in nutrient_dtypes.items():
+                full_foods[col] = full_foods[col].astype(dtype)
+
+            full_foods = _finalize_branded(full_foods, branded_dir, cache_dir, workers)
+
+            processed_paths.append(merged_path.replace('merged-', 'processed-'))
+            full_foods.to_parquet(processed_paths[-1], index=False)
+
+            del full_foods
+            gc.collect()
+
+        # Append every partition as a row group of the processed file
+        with profile_stage('to_parquet'):
+            combine_partitions(processed_paths, output_path)
@@ -1,7 +1,12 @@
+import io
 import os
+import zipfile
 import pandas as pd
 import gc
 from preprocessing._utils import *
+from preprocessing import _lazy
+from preprocessing._intermediate import intermediate_path, write_intermediate
+from preprocessing._remote_zip import read_remote_zip_member
 
 
 def process_foundation(
@@ -9,74 +14,94 @@ def process_foundation(
     output_dir=None,
     raw_dir=None,
     keep_files=False,
+    cache_dir=None,
+    csv_engine='pandas',
+    workers=1,
+    backend='pandas',
+    intermediate_format='parquet',
 ):
 
-    if not os.path.exists(raw_dir):
-        os.makedirs(raw_dir)
-
     for url in urls:
-        download_usda_csv(url, raw_dir)
-
-    # Find the directory containing the downloaded files to define foundation_dir
-    for path in os.listdir(raw_dir):
-        if 'foundation' in path:
-            foundation_dir = os.path.join(raw_dir, path)
+        # Download the zip file, the raw files are only extracted if keep_files flag is specified
+        if 'foundation' in url:
+            zip_path = download_usda_csv(
+                url, raw_dir, cache_dir, extract=keep_files)
+
+            foundation_url = url
+            foundation_archive = zipfile.ZipFile(zip_path, 'r')
+            foundation_dir = os.path.join(
+                raw_dir, archive_root(foundation_archive, url))
             source = define_source(foundation_dir)[0]
-        if 'FoodData_Central_csv' in path:
-            all_dir = os.path.join(raw_dir, path)
 
-    # Delete unnecessary files if keep_files flag is not specified
-    if not keep_files:
-        files_to_keep = ['food_nutrient.csv', 'food.csv',
-                         'nutrient.csv', 'food_portion.csv', 'measure_unit.csv', 'food_attribute.csv']
-        delete_unnecessary_files(foundation_dir, files_to_keep)
+        # Only food_category.csv is needed from the full archive, so fetch just that file from the remote zip file
+        if 'FoodData_Central_csv' in url:
+            food_category_csv = read_remote_zip_member(
+                url, 'food_category.csv', cache_dir)
 
-        files_to_keep = ['food_category.csv']
-        delete_unnecessary_files(all_dir, files_to_keep)
+            if keep_files:
+                all_dir = os.path.join(
+                    raw_dir, os.path.splitext(os.path.basename(url))[0])
+                os.makedirs(all_dir, exist_ok=True)
+                with open(os.path.join(all_dir, 'food_category.csv'), 'wb') as f:
+                    f.write(food_category_csv)
 
     print(f'Initializing processing for:\n> {source}\n')
 
-    # Load datasets
-    food_nutrients = pd.read_csv(os.path.join(foundation_dir, 'food_nutrient.csv'),
-                                 usecols=['fdc_id', 'nutrient_id', 'amount'],
-                                 dtype={
-                                     'fdc_id': 'int32', 'nutrient_id': 'int32', 'amount': 'float32'},
+    # Load datasets straight from the zip files, the large ones are declared and read when they're joined (the foods
+    # are read right away, with the backend, so their descriptions can be ranked below)
+    foods = _lazy.collect(_lazy.scan_archive_csv(foundation_archive, 'food.csv',
+                                                 usecols=['fdc_id', 'description',
+                                                          'food_category_id'],
+                                                 dtype={'fdc_id': 'int32', 'description': 'str',
+                                                        'food_category_id': 'float32'},
+                                                 rename={'description': 'food_description',
+                                                         'food_category_id': 'category_id'},
+                                                 csv_engine=csv_engine), backend)
+
+    nutrients = read_archive_csv(foundation_archive, 'nutrient.csv', csv_engine,
+                                 usecols=['id', 'name', 'unit_name'],
+                                 dtype={'id': 'int32', 'name': 'category',
+                                        'unit_name': 'category'},
                                  low_memory=False)
 
-    foods = pd.read_csv(os.path.join(foundation_dir, 'food.csv'),
-                        usecols=['fdc_id', 'description', 'food_category_id'],
-                        dtype={'fdc_id': 'int32', 'description': 'str',
-                               'food_category_id': 'float32'},
-                        low_memory=False)
-
-    nutrients = pd.read_csv(os.path.join(foundation_dir, 'nutrient.csv'),
-                            usecols=['id', 'name', 'unit_name'],
-                            dtype={'id': 'int32', 'name': 'str',
-                                   'unit_name': 'str'},
-                            low_memory=False)
-
-    categories = pd.read_csv(os.path.join(all_dir, 'food_category.csv'),
-                             usecols=['id', 'description'],
-                             dtype={'id': 'int32', 'description': 'str'},
-                             low_memory=False)
-
-    portions = pd.read_csv(os.path.join(foundation_dir, 'food_portion.csv'),
-                           usecols=['id', 'fdc_id', 'amount',
-                                    'measure_unit_id', 'modifier', 'gram_weight'],
-                           dtype={'id': 'int32', 'fdc_id': 'int32', 'amount': 'float32',
-                                  'measure_unit_id': 'int32', 'modifier': 'str', 'gram_weight': 'float32'},
-                           low_memory=False)
-
-    measure_units = pd.read_csv(os.path.join(foundation_dir, 'measure_unit.csv'),
-                                usecols=['id', 'name'],
-                                dtype={'id': 'int32', 'name': 'str'},
+    nutrients.rename(columns={'id': 'nutrient_id', 'name': 'nutrient_name',
+                     'unit_name': 'nutrient_unit'}, inplace=True)
+
+    # Resolve the relevant nutrients to their ids once, so only their rows of food_nutrient.csv are read
+    nutrient_ids = relevant_nutrient_ids(nutrients)
+    nutrients = nutrients[nutrients['nutrient_id'].isin(nutrient_ids)]
+
+    food_nutrients = _lazy.scan_archive_csv(foundation_archive, 'food_nutrient.csv',
+                                            usecols=['fdc_id',
+                                                     'nutrient_id', 'amount'],
+                                            dtype={
+                                                'fdc_id': 'int32', 'nutrient_id': 'int32', 'amount': 'float32'},
+                                            rename={'amount': 'nutrient_amount'},
+                                            csv_engine=csv_engine)
+    food_nutrients = _lazy.filter_rows(food_nutrients, _lazy.isin('nutrient_id', nutrient_ids))
+
+    categories = read_csv(io.BytesIO(food_category_csv), csv_engine,
+                          usecols=['id', 'description'],
+                          dtype={'id': 'int32', 'description': 'category'},
+                          low_memory=False)
+
+    portions = read_archive_csv(foundation_archive, 'food_portion.csv', csv_engine,
+                                usecols=['id', 'fdc_id', 'amount',
+                                         'measure_unit_id', 'modifier', 'gram_weight'],
+                                dtype={'id': 'int32', 'fdc_id': 'int32', 'amount': 'float32',
+                                       'measure_unit_id': 'int32', 'modifier': 'str', 'gram_weight': 'float32'},
                                 low_memory=False)
 
-    food_attribute = pd.read_csv(os.path.join(foundation_dir, 'food_attribute.csv'),
-                                 usecols=["fdc_id", "name", "value"],
-                                 dtype={'fdc_id': 'int32',
-                                        'name': 'str', 'value': 'str'},
-                                 low_memory=False)
+    measure_units = read_archive_csv(foundation_archive, 'measure_unit.csv', csv_engine,
+                                     usecols=['id', 'name'],
+                                     dtype={'id': 'int32', 'name': 'category'},
+                                     low_memory=False)
+
+    food_attribute = read_archive_csv(foundation_archive, 'food_attribute.csv', csv_engine,
+                                      usecols=["fdc_id", "name", "value"],
+                                      dtype={'fdc_id': 'int32',
+                                             'name': 'str', 'value': 'str'},
+                                      low_memory=False)
 
     # food_attribute_type = pd.read_csv(os.path.join(foundation_dir, 'food_attribute_type.csv'),
     #                             # usecols    = ['id', 'name'],
@@ -84,11 +109,6 @@ def process_foundation(
     #                             low_memory=False)
 
     # Rename columns to be consistent across datasets
-    food_nutrients.rename(columns={'amount': 'nutrient_amount'}, inplace=True)
-    foods.rename(columns={'description': 'food_description',
-                 'food_category_id': 'category_id'}, inplace=True)
-    nutrients.rename(columns={'id': 'nutrient_id', 'name': 'nutrient_name',
-                     'unit_name': 'nutrient_unit'}, inplace=True)
     categories.rename(columns={'id': 'category_id',
                       'description': 'category'}, inplace=True)
     portions.rename(columns={'id': 'portion_id', 'amount': 'portion_amount',
@@ -122,9 +142,8 @@ def process_foundation(
 
     gc.collect()
 
-    # Set data types for all columns, and fill NA values using fillna_and_set_dtypes function
-    food_nutrients = fillna_and_set_dtypes(food_nutrients)
-    foods = fillna_and_set_dtypes(foods)
+    # Set data types for all columns, and fill NA values using fillna_and_set_dtypes function (the scans of the
+    # large datasets do so as they're read)
     nutrients = fillna_and_set_dtypes(nutrients)
     categories = fillna_and_set_dtypes(categories)
     portions = fillna_and_set_dtypes(portions)
@@ -134,10 +153,6 @@ def process_foundation(
     foods = pd.merge(foods, categories, on='category_id', how='left')
     foods.drop(['category_id'], axis=1, inplace=True)
 
-    nutrients = pd.merge(food_nutrients, nutrients,
-                         on='nutrient_id', how='left')
-    nutrients.drop(['nutrient_id'], axis=1, inplace=True)
-
     # If True, portion_units are non-applicable
     if (portions['measure_unit_id'] == 9999).all():
         portions['portion_unit'] = 'no_value'
@@ -149,44 +164,74 @@ def process_foundation(
     portions.drop(['measure_unit_id'], axis=1, inplace=True)
     portions.drop(['portion_id'], axis=1, inplace=True)
 
-    full_foods = pd.merge(foods, nutrients, on='fdc_id', how='left')
-    full_foods = pd.merge(full_foods, food_attribute, on='fdc_id', how='left')
-    full_foods = pd.merge(full_foods, portions, on='fdc_id', how='inner')
+    # Get the multiplier of the per gram amount of every nutrient, from its unit (see add_per_gram_amt)
+    nutrients['multiplier'] = per_gram_multipliers(nutrients['nutrient_unit'])
 
-    gc.collect()
+    # Replace the text the foods are aggregated by with integer surrogate keys ranked like the text, in the small
+    # tables, so the joins of the large ones, the groupby, and the pivot carry integers, and the text is only
+    # attached once the data is wide (see _keys.rank_keys)
+    key_values = {}
+    for df, col in [(foods, 'food_description'), (foods, 'category'), (nutrients, 'nutrient_name'),
+                    (nutrients, 'nutrient_unit'), (portions, 'portion_modifier'), (portions, 'portion_unit')]:
+        df[col], key_values[col] = rank_keys(df[col])
+
+    nutrients = _lazy.join(food_nutrients, _lazy.from_frame(nutrients), on='nutrient_id')
 
-    # Filter for rows with relevant_nutrients using filter_relevent_nutrients function
-    filter_relevent_nutrients(full_foods)
+    full_foods = _lazy.join(_lazy.from_frame(foods), nutrients, on='fdc_id')
+    full_foods = _lazy.join(full_foods, _lazy.from_frame(portions), on='fdc_id', how='inner')
 
-    # Add new column for per gram amount using add_per_gram_amt function
-    add_per_gram_amt(full_foods)
+    # Filter for rows with relevant nutrients (the food attributes hold a single row per food, so they're joined
+    # with the common names below)
+    full_foods = _lazy.filter_rows(full_foods, _lazy.isin('nutrient_id', nutrient_ids))
+
+    # Run the joins with the backend (see _lazy.collect)
+    with profile_stage('merge') as stage:
+        full_foods = _lazy.collect(full_foods, backend)
+        stage.rows_out = len(full_foods)
+
+    foundation_archive.close()
+
+    gc.collect()
+
+    # Add new column for per gram amount, from the multiplier of the nutrient unit (see add_per_gram_amt)
+    full_foods['per_gram_amt'] = round(full_foods['nutrient_amount'] * full_foods['multiplier'], 10)
+    full_foods.drop(['nutrient_id', 'nutrient_amount', 'multiplier'], axis=1, inplace=True)
 
     gc.collect()
 
-    # Get just the unique food descriptions and common names and stash them to join back after aggregating
-    common_names = full_foods[['food_description',
-                               'food_common_name', 'food_common_category']]
+    # Get the common names of the foods of every food description, to join back after aggregating (the foods
+    # sharing a description are aggregated together, so the join gives a row per common name of the description)
+    common_names = full_foods.drop_duplicates('fdc_id')[['food_description', 'fdc_id']]
+    common_names = pd.merge(common_names, food_attribute, on='fdc_id', how='left')
+    common_names = common_names[['food_description', 'food_common_name', 'food_common_category']]
     common_names = common_names.drop_duplicates(inplace=False)
 
-    # Aggregate rows with equal values and pivot data
-    full_foods = full_foods.groupby(['food_description', 'category', 'nutrient_name', 'nutrient_unit',
-                                    'portion_modifier', 'portion_unit']).mean(numeric_only=True).reset_index()
-
-    full_foods = pd.pivot_table(full_foods,
-                                index=['fdc_id',
-                                       'food_description',
-                                       'category',
-                                       'portion_amount',
-                                       'portion_unit',
-                                       'portion_modifier',
-                                       'portion_gram_weight'],
-                                columns=['nutrient_name'],
-                                values='per_gram_amt').reset_index()
+    # Aggregate rows with equal values, leaving out the rows missing a key like the groupby on the text did, and
+    # pivot data
+    group_keys = ['food_description', 'category', 'nutrient_name', 'nutrient_unit', 'portion_modifier',
+                  'portion_unit']
+    full_foods = full_foods[has_keys(full_foods, group_keys)]
+    full_foods = full_foods.groupby(group_keys).mean(numeric_only=True).reset_index()
+
+    full_foods = pivot_mean(full_foods,
+                            index=['fdc_id',
+                                   'food_description',
+                                   'category',
+                                   'portion_amount',
+                                   'portion_unit',
+                                   'portion_modifier',
+                                   'portion_gram_weight'],
+                            columns='nutrient_name',
+                            values='per_gram_amt')
+    full_foods = decode_columns(full_foods, key_values['nutrient_name'])
 
     # Join back the common names
     full_foods = pd.merge(full_foods, common_names,
                           on='food_description', how='left')
 
+    # Attach the text of the keys
+    full_foods = decode_keys(full_foods, key_values)
+
     gc.collect()
 
     # Add portion_energy column as calorie estimate
@@ -199,20 +244,13 @@ def process_foundation(
 
     # Add columns applying ingredient_slicer function
     full_foods['portion_combined'] = full_foods.loc[:, 'portion_amount'].astype(
-        str) + ' ' + full_foods.loc[:, 'portion_unit'] + ' ' + full_foods.loc[:, 'portion_modifier']
+        str) + ' ' + full_foods.loc[:, 'portion_unit'].astype(object) + ' ' + full_foods.loc[:, 'portion_modifier']
 
-    # Extract ingredients from portion_combined column
-    full_foods['parsed_ingredient'] = full_foods['portion_combined'].apply(
-        lambda x: ingredient_slicer.IngredientSlicer(x).parsed_ingredient())
-
-    full_foods['std_portion_amount'] = full_foods['parsed_ingredient'].apply(
-        lambda x: x["quantity"] if x["quantity"] else "no_value")
-
-    full_foods['std_portion_unit'] = full_foods['parsed_ingredient'].apply(
-        lambda x: x["standardized_unit"] if x["standardized_unit"] else "no_value")
-
-    full_foods.drop(['portion_combined', 'parsed_ingredient'],
-                    axis=1, inplace=True)
+    # Extract ingredients from portion_combined column, parsing every unique portion once (see _portions.parse_portions)
+    portions = parse_portions(full_foods['portion_combined'], cache_dir, workers=workers)
+    full_foods['std_portion_amount'] = portions['quantity']
+    full_foods['std_portion_unit'] = portions['standardized_unit']
+    full_foods.drop(['portion_combined'], axis=1, inplace=True)
 
     gc.collect()
 
@@ -235,30 +273,13 @@ def process_foundation(
     full_foods['food_common_name'].fillna('no_value', inplace=True)
     full_foods['food_common_category'].fillna('no_value', inplace=True)
 
+    # Keep the repetitive text columns categorical in the intermediary dataframe
+    full_foods = to_categorical(full_foods, CATEGORICAL_COLUMNS)
+
     # Save intermediary dataframe
-    full_foods.to_parquet(os.path.join(
-        output_dir, f'processed_foundation.parquet'))
-
-    # Delete remaining files if keep_files flag is not specified
-    if not keep_files:
-        import shutil
-
-        for root, dirs, files in os.walk(all_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                os.remove(file_path)
-
-        try:
-            os.removedirs(all_dir)
-        except OSError:
-            shutil.rmtree(all_dir)
-
-        for root, dirs, files in os.walk(foundation_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                os.remove(file_path)
-
-        try:
-            os.removedirs(foundation_dir)
-        except OSError:
-            shutil.rmtree(foundation_dir)
+    with profile_stage('to_parquet', rows_in=len(full_foods)):
+        write_intermediate(full_foods, intermediate_path(output_dir, 'foundation', intermediate_format))
+
+    # Delete the zip file if it isn't kept in a persistent download cache
+    if cache_dir is None:
+        remove_cache_entry(foundation_url, raw_dir)
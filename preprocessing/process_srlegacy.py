@@ -1,10 +1,11 @@
 import os
+import zipfile
 import pandas as pd
 import numpy as np
 import gc
 from preprocessing._utils import *
-from preprocessing import _constants
-from preprocessing._utils import _find_and_replace_imps_patterns
+from preprocessing import _lazy
+from preprocessing._intermediate import intermediate_path, write_intermediate
 
 
 def process_srlegacy(
@@ -12,81 +13,82 @@ def process_srlegacy(
     output_dir=None,
     raw_dir=None,
     keep_files=False,
+    cache_dir=None,
+    csv_engine='pandas',
+    workers=1,
+    backend='pandas',
+    intermediate_format='parquet',
 ):
 
-    if not os.path.exists(raw_dir):
-        os.makedirs(raw_dir)
+    # Download the zip file, the raw files are only extracted if keep_files flag is specified
+    zip_path = download_usda_csv(url, raw_dir, cache_dir, extract=keep_files)
 
-    download_usda_csv(url, raw_dir)
-
-    # Find the directory containing the downloaded files to define srlegacy_dir
-    for path in os.listdir(raw_dir):
-        if 'sr_legacy' in path:
-            srlegacy_dir = os.path.join(raw_dir, path)
-            source = define_source(srlegacy_dir)[0]
-
-    # Delete unnecessary files if keep_files flag is not specified
-    if not keep_files:
-        files_to_keep = ['food_nutrient.csv', 'food.csv', 'nutrient.csv', 'food_category.csv',
-                         'food_portion.csv', 'measure_unit.csv',
-                         'food_attribute.csv', 'food_attribute_type.csv']
-        delete_unnecessary_files(srlegacy_dir, files_to_keep)
+    srlegacy_archive = zipfile.ZipFile(zip_path, 'r')
+    srlegacy_dir = os.path.join(raw_dir, archive_root(srlegacy_archive, url))
+    source = define_source(srlegacy_dir)[0]
 
     print(f'Initializing processing for:\n> {source}\n')
 
-    # Load datasets
-    food_nutrients = pd.read_csv(os.path.join(srlegacy_dir, 'food_nutrient.csv'),
-                                 usecols=['fdc_id', 'nutrient_id', 'amount'],
-                                 dtype={
-                                     'fdc_id': 'int32', 'nutrient_id': 'int32', 'amount': 'float32'},
+    # Load datasets straight from the zip file, the large ones are declared and read when they're joined (the foods
+    # are read right away, with the backend, so their descriptions can be ranked below)
+    foods = _lazy.collect(_lazy.scan_archive_csv(srlegacy_archive, 'food.csv',
+                                                 usecols=['fdc_id', 'description', 'food_category_id'],
+                                                 dtype={'fdc_id': 'int32', 'description': 'str',
+                                                        'food_category_id': 'float32'},
+                                                 rename={'description': 'food_description',
+                                                         'food_category_id': 'category_id'},
+                                                 csv_engine=csv_engine), backend)
+
+    nutrients = read_archive_csv(srlegacy_archive, 'nutrient.csv', csv_engine,
+                                 usecols=['id', 'name', 'unit_name'],
+                                 dtype={'id': 'int32', 'name': 'category',
+                                        'unit_name': 'category'},
                                  low_memory=False)
 
-    foods = pd.read_csv(os.path.join(srlegacy_dir, 'food.csv'),
-                        usecols=['fdc_id', 'description', 'food_category_id'],
-                        dtype={'fdc_id': 'int32', 'description': 'str',
-                               'food_category_id': 'float32'},
-                        low_memory=False)
-
-    nutrients = pd.read_csv(os.path.join(srlegacy_dir, 'nutrient.csv'),
-                            usecols=['id', 'name', 'unit_name'],
-                            dtype={'id': 'int32', 'name': 'str',
-                                   'unit_name': 'str'},
-                            low_memory=False)
-
-    categories = pd.read_csv(os.path.join(srlegacy_dir, 'food_category.csv'),
-                             usecols=['id', 'description'],
-                             dtype={'id': 'int32', 'description': 'str'},
-                             low_memory=False)
-
-    portions = pd.read_csv(os.path.join(srlegacy_dir, 'food_portion.csv'),
-                           usecols=['id', 'fdc_id', 'amount',
-                                    'measure_unit_id', 'modifier', 'gram_weight'],
-                           dtype={'id': 'int32', 'fdc_id': 'int32', 'amount': 'float32',
-                                  'measure_unit_id': 'int32', 'modifier': 'str', 'gram_weight': 'float32'},
-                           low_memory=False)
-
-    measure_units = pd.read_csv(os.path.join(srlegacy_dir, 'measure_unit.csv'),
-                                usecols=['id', 'name'],
-                                dtype={'id': 'int32', 'name': 'str'},
+    nutrients.rename(columns={'id': 'nutrient_id', 'name': 'nutrient_name',
+                     'unit_name': 'nutrient_unit'}, inplace=True)
+
+    # Resolve the relevant nutrients to their ids once, so only their rows of food_nutrient.csv are read
+    nutrient_ids = relevant_nutrient_ids(nutrients)
+    nutrients = nutrients[nutrients['nutrient_id'].isin(nutrient_ids)]
+
+    food_nutrients = _lazy.scan_archive_csv(srlegacy_archive, 'food_nutrient.csv',
+                                            usecols=['fdc_id', 'nutrient_id', 'amount'],
+                                            dtype={
+                                                'fdc_id': 'int32', 'nutrient_id': 'int32', 'amount': 'float32'},
+                                            rename={'amount': 'nutrient_amount'},
+                                            csv_engine=csv_engine)
+    food_nutrients = _lazy.filter_rows(food_nutrients, _lazy.isin('nutrient_id', nutrient_ids))
+
+    categories = read_archive_csv(srlegacy_archive, 'food_category.csv', csv_engine,
+                                  usecols=['id', 'description'],
+                                  dtype={'id': 'int32', 'description': 'category'},
+                                  low_memory=False)
+
+    portions = read_archive_csv(srlegacy_archive, 'food_portion.csv', csv_engine,
+                                usecols=['id', 'fdc_id', 'amount',
+                                         'measure_unit_id', 'modifier', 'gram_weight'],
+                                dtype={'id': 'int32', 'fdc_id': 'int32', 'amount': 'float32',
+                                       'measure_unit_id': 'int32', 'modifier': 'str', 'gram_weight': 'float32'},
                                 low_memory=False)
 
-    food_attribute = pd.read_csv(os.path.join(srlegacy_dir, 'food_attribute.csv'),
-                                 usecols=[
-                                     'fdc_id', 'food_attribute_type_id', 'value'],
-                                 dtype={
-                                     'fdc_id': 'int32', 'food_attribute_type_id': 'int32', 'value': 'str'},
-                                 low_memory=False)
-    food_attribute_type = pd.read_csv(os.path.join(srlegacy_dir, 'food_attribute_type.csv'),
-                                      usecols=['id', 'name'],
-                                      dtype={'id': 'int32', 'name': 'str'},
+    measure_units = read_archive_csv(srlegacy_archive, 'measure_unit.csv', csv_engine,
+                                     usecols=['id', 'name'],
+                                     dtype={'id': 'int32', 'name': 'category'},
+                                     low_memory=False)
+
+    food_attribute = read_archive_csv(srlegacy_archive, 'food_attribute.csv', csv_engine,
+                                      usecols=[
+                                          'fdc_id', 'food_attribute_type_id', 'value'],
+                                      dtype={
+                                          'fdc_id': 'int32', 'food_attribute_type_id': 'int32', 'value': 'str'},
                                       low_memory=False)
+    food_attribute_type = read_archive_csv(srlegacy_archive, 'food_attribute_type.csv', csv_engine,
+                                           usecols=['id', 'name'],
+                                           dtype={'id': 'int32', 'name': 'str'},
+                                           low_memory=False)
 
     # Rename columns to be consistent across datasets
-    food_nutrients.rename(columns={'amount': 'nutrient_amount'}, inplace=True)
-    foods.rename(columns={'description': 'food_description',
-                 'food_category_id': 'category_id'}, inplace=True)
-    nutrients.rename(columns={'id': 'nutrient_id', 'name': 'nutrient_name',
-                     'unit_name': 'nutrient_unit'}, inplace=True)
     categories.rename(columns={'id': 'category_id',
                       'description': 'category'}, inplace=True)
     portions.rename(columns={'id': 'portion_id', 'amount': 'portion_amount',
@@ -100,9 +102,8 @@ def process_srlegacy(
 
     gc.collect()
 
-    # Set data types for all columns, and fill NA values using fillna_and_set_dtypes function
-    food_nutrients = fillna_and_set_dtypes(food_nutrients)
-    foods = fillna_and_set_dtypes(foods)
+    # Set data types for all columns, and fill NA values using fillna_and_set_dtypes function (the scans of the
+    # large datasets do so as they're read)
     nutrients = fillna_and_set_dtypes(nutrients)
     categories = fillna_and_set_dtypes(categories)
     portions = fillna_and_set_dtypes(portions)
@@ -114,19 +115,12 @@ def process_srlegacy(
     foods = pd.merge(foods, categories, on='category_id', how='left')
     foods.drop(['category_id'], axis=1, inplace=True)
 
-    nutrients = pd.merge(food_nutrients, nutrients,
-                         on='nutrient_id', how='left')
-    nutrients.drop(['nutrient_id'], axis=1, inplace=True)
-
     food_attribute = pd.merge(
         food_attribute, food_attribute_type, on='food_attribute_type_id', how='left')
     food_attribute.drop(['food_attribute_type_id'], axis=1, inplace=True)
 
-    # Find and replace the IMPS and URIMIS patterns with "meat" or the appropriate category
-    food_attribute['value'] = food_attribute['value'].str.replace(
-        _constants.URMIS_PATTERN, "meat", regex=True)
-    food_attribute['value'] = food_attribute["value"].apply(
-        lambda x: _find_and_replace_imps_patterns(x))
+    # Find and replace the IMPS and URMIS patterns with "meat" or the appropriate category
+    food_attribute['value'] = normalize_meat_standards(food_attribute['value'])
 
     # Fill in missing or NaN values with "no_value"
     food_attribute['value'] = food_attribute['value'].fillna("no_value")
@@ -144,43 +138,76 @@ def process_srlegacy(
     portions.drop(['measure_unit_id'], axis=1, inplace=True)
     portions.drop(['portion_id'], axis=1, inplace=True)
 
-    full_foods = pd.merge(foods, nutrients, on='fdc_id', how='left')
-    full_foods = pd.merge(full_foods, food_attribute, on='fdc_id', how='left')
-    full_foods = pd.merge(full_foods, portions, on='fdc_id', how='inner')
+    # Get the multiplier of the per gram amount of every nutrient, from its unit (see add_per_gram_amt)
+    nutrients['multiplier'] = per_gram_multipliers(nutrients['nutrient_unit'])
 
-    gc.collect()
+    # Replace the text the foods are aggregated by with integer surrogate keys ranked like the text, in the small
+    # tables, so the joins of the large ones, the groupby, and the pivot carry integers, and the text is only
+    # attached once the data is wide (see _keys.rank_keys)
+    key_values = {}
+    for df, col in [(foods, 'food_description'), (foods, 'category'), (nutrients, 'nutrient_name'),
+                    (nutrients, 'nutrient_unit'), (portions, 'portion_modifier'), (portions, 'portion_unit')]:
+        df[col], key_values[col] = rank_keys(df[col])
 
-    # Filter for rows with relevant_nutrients using filter_relevent_nutrients function
-    filter_relevent_nutrients(full_foods)
+    nutrients = _lazy.join(food_nutrients, _lazy.from_frame(nutrients), on='nutrient_id')
 
-    # Add new column for per gram amount using add_per_gram_amt function
-    add_per_gram_amt(full_foods)
+    # A food has a row for every one of its attributes, which the mean of the aggregation below weighs it by, so
+    # the attributes are joined by fdc_id alone, and their common names joined back after aggregating
+    full_foods = _lazy.join(_lazy.from_frame(foods), nutrients, on='fdc_id')
+    full_foods = _lazy.join(full_foods, _lazy.from_frame(food_attribute[['fdc_id']]), on='fdc_id')
+    full_foods = _lazy.join(full_foods, _lazy.from_frame(portions), on='fdc_id', how='inner')
+
+    # Filter for rows with relevant nutrients
+    full_foods = _lazy.filter_rows(full_foods, _lazy.isin('nutrient_id', nutrient_ids))
+
+    # Run the joins with the backend (see _lazy.collect)
+    with profile_stage('merge') as stage:
+        full_foods = _lazy.collect(full_foods, backend)
+        stage.rows_out = len(full_foods)
+
+    srlegacy_archive.close()
+
+    gc.collect()
+
+    # Add new column for per gram amount, from the multiplier of the nutrient unit (see add_per_gram_amt)
+    full_foods['per_gram_amt'] = round(full_foods['nutrient_amount'] * full_foods['multiplier'], 10)
+    full_foods.drop(['nutrient_id', 'nutrient_amount', 'multiplier'], axis=1, inplace=True)
 
     gc.collect()
 
-    # Get just the unique food descriptions and common names and stash them to join back after aggregating
-    common_names = full_foods[['food_description', 'food_common_name']]
+    # Get the common names of the foods of every food description, to join back after aggregating (the foods
+    # sharing a description are aggregated together, so the join gives a row per common name of the description)
+    common_names = full_foods.drop_duplicates('fdc_id')[['food_description', 'fdc_id']]
+    common_names = pd.merge(common_names, food_attribute, on='fdc_id', how='left')
+    common_names = common_names[['food_description', 'food_common_name']]
     common_names = common_names.drop_duplicates(inplace=False)
 
-    # Aggregate rows with equal values and pivot data
-    full_foods = full_foods.groupby(['food_description', 'category',
-                                     'nutrient_name', 'nutrient_unit', 'portion_modifier', 'portion_unit']).mean(numeric_only=True).reset_index()
-
-    full_foods = pd.pivot_table(full_foods,
-                                index=['fdc_id',
-                                       'food_description',
-                                       'category',
-                                       'portion_amount',
-                                       'portion_unit',
-                                       'portion_modifier',
-                                       'portion_gram_weight'],
-                                columns=['nutrient_name'],
-                                values='per_gram_amt').reset_index()
+    # Aggregate rows with equal values, leaving out the rows missing a key like the groupby on the text did, and
+    # pivot data
+    group_keys = ['food_description', 'category', 'nutrient_name', 'nutrient_unit', 'portion_modifier',
+                  'portion_unit']
+    full_foods = full_foods[has_keys(full_foods, group_keys)]
+    full_foods = full_foods.groupby(group_keys).mean(numeric_only=True).reset_index()
+
+    full_foods = pivot_mean(full_foods,
+                            index=['fdc_id',
+                                   'food_description',
+                                   'category',
+                                   'portion_amount',
+                                   'portion_unit',
+                                   'portion_modifier',
+                                   'portion_gram_weight'],
+                            columns='nutrient_name',
+                            values='per_gram_amt')
+    full_foods = decode_columns(full_foods, key_values['nutrient_name'])
 
     # Merge back the common names by the food description column
     full_foods = pd.merge(full_foods, common_names,
                           on='food_description', how='left')
 
+    # Attach the text of the keys
+    full_foods = decode_keys(full_foods, key_values)
+
     gc.collect()
 
     # Add portion_energy column as calorie estimate
@@ -193,17 +220,13 @@ def process_srlegacy(
 
     # Add columns applying ingredient_slicer function
     full_foods['portion_combined'] = full_foods.loc[:, 'portion_amount'].astype(
-        str) + ' ' + full_foods.loc[:, 'portion_unit'] + ' ' + full_foods.loc[:, 'portion_modifier']
-
-    # Extract ingredients from portion_combined column
-    full_foods['parsed_ingredient'] = full_foods['portion_combined'].apply(
-        lambda x: ingredient_slicer.IngredientSlicer(x).parsed_ingredient())
-    full_foods['std_portion_amount'] = full_foods['parsed_ingredient'].apply(
-        lambda x: x["quantity"] if x["quantity"] else "no_value")
-    full_foods['std_portion_unit'] = full_foods['parsed_ingredient'].apply(
-        lambda x: x["standardized_unit"] if x["standardized_unit"] else "no_value")
-    full_foods.drop(['portion_combined', 'parsed_ingredient'],
-                    axis=1, inplace=True)
+        str) + ' ' + full_foods.loc[:, 'portion_unit'].astype(object) + ' ' + full_foods.loc[:, 'portion_modifier']
+
+    # Extract ingredients from portion_combined column, parsing every unique portion once (see _portions.parse_portions)
+    portions = parse_portions(full_foods['portion_combined'], cache_dir, workers=workers)
+    full_foods['std_portion_amount'] = portions['quantity']
+    full_foods['std_portion_unit'] = portions['standardized_unit']
+    full_foods.drop(['portion_combined'], axis=1, inplace=True)
 
     gc.collect()
 
@@ -225,20 +248,13 @@ def process_srlegacy(
     # Fill in any remaining NaN values with 'no_value'
     full_foods['food_common_name'].fillna('no_value', inplace=True)
 
+    # Keep the repetitive text columns categorical in the intermediary dataframe
+    full_foods = to_categorical(full_foods, CATEGORICAL_COLUMNS)
+
     # Save intermediary dataframe
-    full_foods.to_parquet(os.path.join(
-        output_dir, f'processed_srlegacy.parquet'))
-
-    # Delete remaining files if keep_files flag is not specified
-    if not keep_files:
-        import shutil
-
-        for root, dirs, files in os.walk(srlegacy_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                os.remove(file_path)
-
-        try:
-            os.removedirs(srlegacy_dir)
-        except OSError:
-            shutil.rmtree(srlegacy_dir)
+    with profile_stage('to_parquet', rows_in=len(full_foods)):
+        write_intermediate(full_foods, intermediate_path(output_dir, 'srlegacy', intermediate_format))
+
+    # Delete the zip file if it isn't kept in a persistent download cache
+    if cache_dir is None:
+        remove_cache_entry(url, raw_dir)
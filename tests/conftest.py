@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+
+from fdc_fixtures import write_fixtures
+
+
+@pytest.fixture(scope='session')
+def fixture_archives(tmp_path_factory):
+    """
+    Synthetic FDC archives (see benchmarks/fdc_fixtures.py), written once per test session.
+    """
+    return write_fixtures(str(tmp_path_factory.mktemp('fixtures')), scale=1, seed=0)
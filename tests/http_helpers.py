@@ -0,0 +1,51 @@
+import requests
+
+
+class RecordingSession(requests.Session):
+    """
+    A session recording the method and status code of every response, the responses themselves (history), and
+    the number of bytes the server sent (from Content-Length). It can also cut the connection of every streamed response after cut_after bytes (even
+    once the whole body was received), and drop the Range header of every request (ignore_ranges), like a server
+    that doesn't support byte ranges.
+    """
+
+    def __init__(self, cut_after=None, ignore_ranges=False):
+        super().__init__()
+        self.cut_after = cut_after
+        self.ignore_ranges = ignore_ranges
+        self.responses = []
+        self.history = []
+        self.bytes_received = 0
+
+    def request(self, method, url, headers=None, **kwargs):
+        if self.ignore_ranges and headers:
+            headers = {name: value for name, value in headers.items() if name != 'Range'}
+
+        r = super().request(method, url, headers=headers, **kwargs)
+        self.responses.append((method, r.status_code))
+        self.history.append(r)
+        if method == 'GET':
+            self.bytes_received += int(r.headers.get('Content-Length', 0))
+
+        if self.cut_after is not None and kwargs.get('stream'):
+            r.iter_content = _cut_stream(r.iter_content, self.cut_after)
+
+        return r
+
+
+def _cut_stream(iter_content, n_bytes):
+    """
+    Wrap Response.iter_content so it yields n_bytes at most and then fails like a dropped connection.
+    """
+    def iter_cut(chunk_size=1, decode_unicode=False):
+        sent = 0
+        for chunk in iter_content(chunk_size=chunk_size):
+            chunk = chunk[:n_bytes - sent]
+            if not chunk:
+                break
+            sent += len(chunk)
+            yield chunk
+
+        raise requests.ConnectionError(f'Connection cut after {sent} bytes')
+
+    return iter_cut
@@ -0,0 +1,145 @@
+import os
+import shutil
+import pytest
+import requests
+from fdc_fixtures import serve_fixtures
+from http_helpers import RecordingSession
+from preprocessing import _download
+from preprocessing._download import cached_download, get_cache_entry
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def served(fixture_archives, tmp_path):
+    """
+    Serve a copy of the foundation archive, which tests may change, and yield its path and URL.
+    """
+    served_dir = tmp_path / 'served'
+    served_dir.mkdir()
+    path = shutil.copy(fixture_archives['foundation'], served_dir)
+
+    with serve_fixtures(str(served_dir)) as urls:
+        yield path, urls[0]
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / 'cache')
+
+
+def change_served_file(path, source):
+    """
+    Replace a served file with another archive (of another size, so its ETag changes too).
+    """
+    assert os.path.getsize(path) != os.path.getsize(source)
+    shutil.copy(source, path)
+
+
+def test_complete_entry_is_revalidated_and_reused(served, cache_dir):
+    path, url = served
+
+    first = cached_download(url, cache_dir)
+    assert read_bytes(first) == read_bytes(path)
+
+    session = RecordingSession()
+    assert cached_download(url, cache_dir, session=session) == first
+    assert session.responses == [('GET', 304)]
+
+
+def test_changed_file_replaces_cached_entry(served, cache_dir, fixture_archives):
+    path, url = served
+
+    first = cached_download(url, cache_dir)
+    change_served_file(path, fixture_archives['sr_legacy'])
+
+    session = RecordingSession()
+    second = cached_download(url, cache_dir, session=session)
+
+    assert session.responses == [('GET', 200)]
+    assert read_bytes(second) == read_bytes(fixture_archives['sr_legacy'])
+    assert not os.path.exists(first)
+
+
+def test_truncated_download_is_resumed(served, cache_dir):
+    path, url = served
+
+    with pytest.raises(requests.ConnectionError):
+        cached_download(url, cache_dir, session=RecordingSession(cut_after=1000))
+    assert get_cache_entry(url, cache_dir) == {}
+
+    session = RecordingSession()
+    cached = cached_download(url, cache_dir, session=session)
+
+    assert session.responses == [('GET', 206)]
+    assert read_bytes(cached) == read_bytes(path)
+    assert get_cache_entry(url, cache_dir)['path'] == cached
+
+
+def test_resume_restarts_when_file_changed(served, cache_dir, fixture_archives):
+    path, url = served
+
+    with pytest.raises(requests.ConnectionError):
+        cached_download(url, cache_dir, session=RecordingSession(cut_after=1000))
+
+    # The ETag changes, so the server ignores the If-Range range request and sends the whole new file
+    change_served_file(path, fixture_archives['sr_legacy'])
+
+    session = RecordingSession()
+    cached = cached_download(url, cache_dir, session=session)
+
+    assert session.responses == [('GET', 200)]
+    assert read_bytes(cached) == read_bytes(fixture_archives['sr_legacy'])
+
+
+def test_interrupted_ranged_download_is_not_resumed(served, cache_dir, monkeypatch):
+    path, url = served
+    monkeypatch.setattr(_download, 'MIN_RANGED_DOWNLOAD_SIZE', 0)
+
+    def interrupt(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as patch:
+        patch.setattr(_download, '_download_range', interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            cached_download(url, cache_dir, n_parts=4)
+
+    # The preallocated file is removed, rather than left (zero-filled) for the next run to resume
+    assert not [filename for filename in os.listdir(cache_dir) if filename.endswith('.part')]
+
+    session = RecordingSession()
+    cached = cached_download(url, cache_dir, session=session, n_parts=4)
+
+    assert ('GET', 206) in session.responses
+    assert read_bytes(cached) == read_bytes(path)
+
+
+def test_partial_file_of_full_size_is_downloaded_again(served, cache_dir):
+    path, url = served
+
+    # The whole file is written before the connection drops, so there's nothing left to resume
+    with pytest.raises(requests.ConnectionError):
+        cached_download(url, cache_dir, session=RecordingSession(cut_after=os.path.getsize(path)))
+
+    session = RecordingSession()
+    cached = cached_download(url, cache_dir, session=session)
+
+    assert session.responses == [('GET', 200)]
+    assert read_bytes(cached) == read_bytes(path)
+
+
+def test_corrupt_download_is_not_cached(served, cache_dir):
+    path, url = served
+
+    with open(path, 'r+b') as f:
+        f.seek(os.path.getsize(path) // 2)
+        f.write(b'\0' * 64)
+
+    with pytest.raises(IOError, match='Corrupt download'):
+        cached_download(url, cache_dir)
+
+    assert get_cache_entry(url, cache_dir) == {}
+    assert not [filename for filename in os.listdir(cache_dir) if not filename.endswith('.json')]
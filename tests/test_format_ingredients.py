@@ -0,0 +1,65 @@
+import random
+import pandas as pd
+import pytest
+from preprocessing import _constants
+from preprocessing._utils import format_ingredients, format_ingredients_column
+
+# Ingredients typical of branded_food.csv
+INGREDIENTS = ['Sugar', 'SALT', 'water', 'Enriched Flour (wheat flour, niacin, iron)', 'Contains less than 2% of: salt',
+               'INGREDIENTS: milk', 'made from: corn', 'soy lecithin*', 'natural flavor.', 'jalapeno peppers',
+               'Vitamin B1 [thiamin]', 'CORN SYRUP', 'PARTIALLY HYDROGENATED SOYBEAN OIL', 'RED 40',
+               'jalapeño peppers', 'crème fraîche']
+
+# Pieces of random strings, chosen to hit the edge cases of format_ingredients (prefixes, parentheses,
+# punctuation, whitespace and separator characters, and characters that aren't ASCII)
+PIECES = [chr(i) for i in range(128)] + ['ingredients:', 'INGREDIENTS:', 'made from:', 'Made From:', '(', ' , ',
+                                         ',,', '  ', ' \t ', '\x1c', '\x1f', 'é', 'İ', 'ß', 'ﬁ', '\xa0', '\x85']
+
+
+def random_strings(n, seed=0):
+    rng = random.Random(seed)
+    return pd.Series([''.join(rng.choice(PIECES) for _ in range(rng.randint(0, 40))) for _ in range(n)])
+
+
+def synthetic_strings(n, seed=0):
+    rng = random.Random(seed)
+    return pd.Series([', '.join(rng.choice(INGREDIENTS) for _ in range(rng.randint(0, 25))) for _ in range(n)])
+
+
+def assert_formatted_like_format_ingredients(values, workers=1):
+    formatted = format_ingredients_column(values, workers)
+
+    assert formatted.index.equals(values.index)
+    for value, result in zip(values, formatted):
+        assert list(result) == format_ingredients(value), repr(value)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_strings(seed):
+    assert_formatted_like_format_ingredients(random_strings(5_000, seed))
+
+
+def test_synthetic_strings():
+    assert_formatted_like_format_ingredients(synthetic_strings(5_000))
+
+
+def test_edge_cases():
+    assert_formatted_like_format_ingredients(pd.Series(
+        ['', ' ', ',', '()', 'INGREDIENTS:', 'ingredients: made from: (a), b ,, c', 'a\x1cb\x1fc\x1dd\x1ee',
+         'tab\tand\nnewline  runs', 'ÀB (Ç), dé', 'İstanbul, STRASSE', '\xa0nbsp\x85nel'],
+        index=range(100, 111)))
+
+
+def test_workers(monkeypatch):
+    # Slice the ASCII strings, so the slices are formatted by several threads
+    monkeypatch.setattr(_constants, 'INGREDIENTS_SLICE_SIZE', 700)
+    assert_formatted_like_format_ingredients(pd.concat([random_strings(2_000), synthetic_strings(2_000)],
+                                                       ignore_index=True), workers=2)
+
+
+def test_missing_values_raise_like_format_ingredients():
+    with pytest.raises(AttributeError):
+        format_ingredients(None)
+
+    with pytest.raises(AttributeError):
+        format_ingredients_column(pd.Series(['salt', None]))
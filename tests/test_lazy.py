@@ -0,0 +1,138 @@
+import zipfile
+import numpy as np
+import pandas as pd
+import pytest
+from preprocessing import _lazy
+from preprocessing._utils import read_archive_csv
+
+# Foods, with a food without nutrients, and out of fdc_id order so the row order of the joins shows
+FOODS = pd.DataFrame({
+    'fdc_id': np.array([3, 1, 2, 4, 1], dtype='int32'),
+    'food_description': ['Milk', 'Apple', 'Bread', 'Salt', 'Apple, raw'],
+    'category': pd.Categorical(['Dairy', 'Fruits', 'Baked', 'Spices', 'Fruits']),
+})
+
+# Nutrients of the foods, with several rows per food, and a nutrient missing from NUTRIENTS
+FOOD_NUTRIENTS = pd.DataFrame({
+    'fdc_id': np.array([2, 1, 3, 1, 2, 3, 5], dtype='int32'),
+    'nutrient_id': np.array([10, 11, 12, 10, 13, 11, 10], dtype='int16'),
+    'nutrient_amount': np.array([1.5, 2.0, 0.5, 3.0, 4.0, 6.5, 7.0], dtype='float32'),
+})
+
+NUTRIENTS = pd.DataFrame({
+    'nutrient_id': np.array([10, 11, 12], dtype='int16'),
+    'nutrient_name': pd.Categorical(['Protein', 'Energy', 'Energy']),
+    'nutrient_unit': pd.Categorical(['G', 'KCAL', 'kJ']),
+})
+
+
+def nutrient_plan():
+    nutrients = _lazy.join(_lazy.from_frame(FOOD_NUTRIENTS), _lazy.from_frame(NUTRIENTS), on='nutrient_id')
+
+    return _lazy.join(_lazy.from_frame(FOODS), nutrients, on='fdc_id')
+
+
+def assert_backends_match(plan, expected):
+    """
+    Check that both backends give the expected rows, in order, with the expected columns and dtypes.
+    """
+    for backend in _lazy.BACKENDS:
+        df = _lazy.collect(plan, backend)
+        pd.testing.assert_frame_equal(df.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def test_joins_keep_the_left_row_order():
+    expected = pd.merge(FOODS, pd.merge(FOOD_NUTRIENTS, NUTRIENTS, on='nutrient_id', how='left'),
+                        on='fdc_id', how='left')
+
+    assert_backends_match(nutrient_plan(), expected)
+
+
+def test_left_join_filtered_on_right_columns_becomes_inner():
+    plan = _lazy.filter_rows(nutrient_plan(), _lazy.isin('nutrient_name', ['Energy']))
+
+    optimized = _lazy.optimize(plan)
+    assert optimized['op'] == 'join' and optimized['how'] == 'inner'
+    assert optimized['right']['how'] == 'inner'
+
+    # The rows the filter keeps, with the dtypes of the inner joins, which have no missing values to hold
+    expected = pd.merge(FOODS, pd.merge(FOOD_NUTRIENTS, NUTRIENTS, on='nutrient_id', how='inner'),
+                        on='fdc_id', how='inner')
+    expected = expected[expected['nutrient_name'].isin(['Energy'])]
+
+    assert_backends_match(plan, expected)
+
+
+def test_not_equal_keeps_the_left_rows_without_a_match():
+    plan = _lazy.filter_rows(nutrient_plan(), _lazy.not_equal('nutrient_unit', 'kJ'))
+
+    optimized = _lazy.optimize(plan)
+    assert optimized['op'] == 'filter' and optimized['input']['how'] == 'left'
+
+    expected = pd.merge(FOODS, pd.merge(FOOD_NUTRIENTS, NUTRIENTS, on='nutrient_id', how='left'),
+                        on='fdc_id', how='left')
+    expected = expected[expected['nutrient_unit'] != 'kJ']
+
+    # The food without nutrients (fdc_id 4) is kept, with missing values
+    assert 4 in expected['fdc_id'].tolist()
+    assert_backends_match(plan, expected)
+
+
+def test_unused_columns_are_pruned():
+    plan = _lazy.drop(nutrient_plan(), ['nutrient_id', 'nutrient_unit', 'category'])
+
+    optimized = _lazy.optimize(plan)
+    assert optimized['input']['left']['columns'] == ['fdc_id', 'food_description']
+    assert optimized['input']['right']['right']['columns'] == ['nutrient_id', 'nutrient_name']
+
+    expected = pd.merge(FOODS, pd.merge(FOOD_NUTRIENTS, NUTRIENTS, on='nutrient_id', how='left'),
+                        on='fdc_id', how='left')
+    expected = expected.drop(columns=['nutrient_id', 'nutrient_unit', 'category'])
+
+    assert_backends_match(plan, expected)
+
+
+def test_inner_join_with_fan_out():
+    portions = pd.DataFrame({'fdc_id': np.array([1, 3, 1, 9], dtype='int32'),
+                             'portion_gram_weight': [100.0, 240.0, 150.0, 1.0]})
+    plan = _lazy.join(nutrient_plan(), _lazy.from_frame(portions), on='fdc_id', how='inner')
+
+    expected = pd.merge(FOODS, pd.merge(FOOD_NUTRIENTS, NUTRIENTS, on='nutrient_id', how='left'),
+                        on='fdc_id', how='left')
+    expected = pd.merge(expected, portions, on='fdc_id', how='inner')
+
+    assert_backends_match(plan, expected)
+
+
+@pytest.mark.parametrize('csv_engine', ['pandas', 'pyarrow'])
+def test_backends_match_on_fixture_archives(fixture_archives, csv_engine):
+    with zipfile.ZipFile(fixture_archives['branded'], 'r') as archive:
+        nutrients = read_archive_csv(archive, 'nutrient.csv', csv_engine, usecols=['id', 'name', 'unit_name'],
+                                     dtype={'id': 'int16', 'name': 'category', 'unit_name': 'category'})
+        nutrients.rename(columns={'id': 'nutrient_id', 'name': 'nutrient_name', 'unit_name': 'nutrient_unit'},
+                         inplace=True)
+
+        food_nutrients = _lazy.scan_archive_csv(archive, 'food_nutrient.csv', ['fdc_id', 'nutrient_id', 'amount'],
+                                                {'fdc_id': 'int32', 'nutrient_id': 'int16', 'amount': 'float32'},
+                                                rename={'amount': 'nutrient_amount'}, csv_engine=csv_engine)
+        foods = _lazy.scan_archive_csv(archive, 'food.csv', ['fdc_id', 'description'],
+                                       {'fdc_id': 'int32', 'description': 'str'},
+                                       rename={'description': 'food_description'}, csv_engine=csv_engine)
+        branded_foods = _lazy.scan_archive_csv(archive, 'branded_food.csv',
+                                               ['fdc_id', 'brand_owner', 'ingredients', 'branded_food_category'],
+                                               {'fdc_id': 'int32', 'brand_owner': 'category', 'ingredients': 'str',
+                                                'branded_food_category': 'category'},
+                                               rename={'branded_food_category': 'category'},
+                                               csv_engine=csv_engine)
+
+        plan = _lazy.drop(_lazy.join(food_nutrients, _lazy.from_frame(nutrients), on='nutrient_id'),
+                          ['nutrient_id'])
+        plan = _lazy.join(foods, plan, on='fdc_id')
+        plan = _lazy.join(plan, branded_foods, on='fdc_id')
+        plan = _lazy.filter_rows(plan, *_lazy.relevant_nutrient_predicates())
+
+        expected = _lazy.collect(plan, 'pandas')
+        df = _lazy.collect(plan, 'arrow')
+
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), expected.reset_index(drop=True))
@@ -0,0 +1,47 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from meat_standards_reference import ATTRIBUTES, find_and_replace_imps_patterns, normalize_reference, outcome, \
+    random_values
+from preprocessing import _constants
+from preprocessing._utils import _replace_meat_standard, normalize_meat_standards
+
+
+def normalize_value(value):
+    return _constants.MEAT_STANDARD_PATTERN.sub(_replace_meat_standard, value)
+
+
+def reference_value(value):
+    return find_and_replace_imps_patterns(_constants.URMIS_PATTERN.sub('meat', value))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_strings_match_reference(seed):
+    # Checked one at a time, so the strings the patterns fail on (IMPS items without a number) count too
+    for value in random_values(random.Random(seed), 5_000):
+        assert outcome(normalize_value, value) == outcome(reference_value, value), repr(value)
+
+
+def test_imps_item_without_a_number_raises():
+    assert outcome(reference_value, 'IMPS #, beef') is IndexError
+    assert outcome(normalize_value, 'IMPS #, beef') is IndexError
+
+
+def test_attributes_match_reference():
+    rng = random.Random(0)
+    values = pd.Series([np.nan if rng.random() < 0.1 else rng.choice(ATTRIBUTES) for _ in range(10_000)],
+                       index=np.arange(10_000) * 2, dtype=object)
+
+    normalized = normalize_meat_standards(values)
+
+    pd.testing.assert_series_equal(normalized, normalize_reference(values).astype(object))
+    assert normalized[values.isna()].isna().all()
+
+
+def test_known_series():
+    # The series is the longest one an item number starts with, so 1100 is goat rather than beef
+    values = pd.Series(['Pork (IMPS 410)', 'Goat, IMPS 1100 whole carcass', 'IMPS 0 unknown series',
+                        'URMIS #2281 urmis #2282'])
+
+    assert normalize_meat_standards(values).tolist() == ['Pork (pork', 'Goat, goat', 'meat', 'meat meat']
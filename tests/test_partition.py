@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+from preprocessing._categorical import concat_frames, to_categorical
+from preprocessing._intermediate import read_intermediate_table
+from preprocessing._partition import combine_partitions
+
+
+def write_partitions(tmp_path, frames):
+    paths = []
+    for idx, df in enumerate(frames):
+        paths.append(str(tmp_path / f'processed-{idx:06d}.parquet'))
+        df.to_parquet(paths[-1], index=False)
+
+    return paths
+
+
+@pytest.mark.parametrize('extension', ['.parquet', '.feather'])
+def test_partitions_with_different_categories(tmp_path, extension):
+    # Partitions with categories of their own, a missing value, more categories than int8 codes hold, and a
+    # column that's all null in one partition
+    frames = [
+        pd.DataFrame({'fdc_id': np.arange(3), 'brand_owner': pd.Categorical(['b', 'a', None]),
+                      'brand_name': [None, None, None]}),
+        pd.DataFrame({'fdc_id': np.arange(3, 5), 'brand_owner': pd.Categorical(['c', 'd']),
+                      'brand_name': ['x', 'y']}),
+        pd.DataFrame({'fdc_id': np.arange(5, 305), 'brand_owner': pd.Categorical([f'{i:03d}' for i in range(300)]),
+                      'brand_name': 'z'}),
+    ]
+    output_path = str(tmp_path / f'processed_branded{extension}')
+
+    combine_partitions(write_partitions(tmp_path, frames), output_path)
+
+    df = to_categorical(read_intermediate_table(output_path).to_pandas(), ['brand_owner'])
+    expected = concat_frames(frames, ignore_index=True)
+
+    pd.testing.assert_frame_equal(df, to_categorical(expected, ['brand_owner']))
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import os
+import pandas as pd
+import pytest
+from fdc_fixtures import FIXTURE_ARCHIVES, serve_fixtures, write_fixtures
+from preprocessing.process_foundation import process_foundation
+from preprocessing.process_srlegacy import process_srlegacy
+
+# Scale of the fixture archives the processors run on, which gives foods with several portions each
+SCALE = 3
+
+# Output of the processors for the fixture archives (SCALE, seed 0), written before the joins and aggregations
+# were keyed on integers rather than on the text of the descriptions, categories, nutrients, and portions
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+@pytest.fixture(scope='module')
+def urls(tmp_path_factory):
+    fixture_dir = str(tmp_path_factory.mktemp('fixtures'))
+    write_fixtures(fixture_dir, scale=SCALE, seed=0)
+
+    with serve_fixtures(fixture_dir) as urls:
+        yield dict(zip(FIXTURE_ARCHIVES, urls))
+
+
+def run_processor(processor, urls, tmp_path, csv_engine, backend):
+    """
+    Run a processor on the served fixture archives, and read back its processed file.
+    """
+    output_dir = str(tmp_path / 'output')
+    os.makedirs(output_dir)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if processor == 'foundation':
+            process_foundation([urls['foundation'], urls['full']], output_dir, str(tmp_path / 'raw'),
+                               cache_dir=str(tmp_path / 'cache'), csv_engine=csv_engine, backend=backend)
+        else:
+            process_srlegacy(urls['sr_legacy'], output_dir, str(tmp_path / 'raw'), cache_dir=str(tmp_path / 'cache'),
+                             csv_engine=csv_engine, backend=backend)
+
+    return pd.read_parquet(os.path.join(output_dir, f'processed_{processor}.parquet'))
+
+
+@pytest.mark.parametrize('backend', ['pandas', 'arrow'])
+@pytest.mark.parametrize('csv_engine', ['pandas', 'pyarrow'])
+@pytest.mark.parametrize('processor', ['foundation', 'srlegacy'])
+def test_output_rows_match(urls, tmp_path, processor, csv_engine, backend):
+    df = run_processor(processor, urls, tmp_path, csv_engine, backend)
+
+    with open(os.path.join(DATA_DIR, f'processed_{processor}.csv')) as f:
+        expected = f.read()
+
+    # Compared as CSV text, so every row, column, and value has to match, in order
+    assert df.to_csv(index=False) == expected
@@ -0,0 +1,72 @@
+import os
+import zipfile
+import pytest
+from fdc_fixtures import FIXTURE_ARCHIVES, serve_fixtures
+from http_helpers import RecordingSession
+from preprocessing._remote_zip import read_remote_zip_member
+from preprocessing._utils import find_archive_member
+
+
+def read_member(path, filename):
+    with zipfile.ZipFile(path, 'r') as archive:
+        return archive.read(find_archive_member(archive, filename))
+
+
+@pytest.fixture
+def fixtures_dir(fixture_archives):
+    return os.path.dirname(fixture_archives['full'])
+
+
+def archive_url(urls, name):
+    return urls[list(FIXTURE_ARCHIVES).index(name)]
+
+
+def test_member_is_read_with_range_requests(fixture_archives, fixtures_dir, tmp_path):
+    with serve_fixtures(fixtures_dir) as urls:
+        session = RecordingSession()
+        data = read_remote_zip_member(archive_url(urls, 'branded'), 'nutrient.csv', str(tmp_path), session=session)
+
+    assert data == read_member(fixture_archives['branded'], 'nutrient.csv')
+
+    # The central directory and the member are fetched, and nothing else
+    assert set(session.responses) == {('HEAD', 200), ('GET', 206)}
+    assert session.bytes_received < os.path.getsize(fixture_archives['branded']) / 2
+
+
+def test_cached_member_costs_a_head_request(fixture_archives, fixtures_dir, tmp_path):
+    with serve_fixtures(fixtures_dir) as urls:
+        url = archive_url(urls, 'full')
+        read_remote_zip_member(url, 'food_category.csv', str(tmp_path))
+
+        session = RecordingSession()
+        data = read_remote_zip_member(url, 'food_category.csv', str(tmp_path), session=session)
+
+    assert data == read_member(fixture_archives['full'], 'food_category.csv')
+    assert session.responses == [('HEAD', 200)]
+
+
+def test_server_without_ranges_falls_back_to_download(fixture_archives, fixtures_dir, tmp_path):
+    with serve_fixtures(fixtures_dir, accept_ranges=False) as urls:
+        session = RecordingSession()
+        data = read_remote_zip_member(archive_url(urls, 'full'), 'food_category.csv', str(tmp_path),
+                                      session=session)
+
+    assert data == read_member(fixture_archives['full'], 'food_category.csv')
+    assert session.responses == [('HEAD', 200), ('GET', 200)]
+
+
+def test_ignored_range_request_falls_back_to_download(fixture_archives, fixtures_dir, tmp_path):
+    # The server advertises byte ranges, but answers the range requests with the whole file
+    with serve_fixtures(fixtures_dir) as urls:
+        session = RecordingSession(ignore_ranges=True)
+        data = read_remote_zip_member(archive_url(urls, 'full'), 'food_category.csv', str(tmp_path),
+                                      session=session)
+
+    assert data == read_member(fixture_archives['full'], 'food_category.csv')
+    assert session.responses[-1] == ('GET', 200)
+    assert ('GET', 206) not in session.responses
+
+    # The body of the ignored range request (the whole file) is never read, only the fallback download is
+    ignored = session.history[session.responses.index(('GET', 200))]
+    assert ignored.raw.tell() == 0
+    assert session.history[-1].raw.tell() == os.path.getsize(fixture_archives['full'])
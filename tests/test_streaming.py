@@ -0,0 +1,83 @@
+import contextlib
+import io
+import os
+import pandas as pd
+import pytest
+from fdc_fixtures import FIXTURE_ARCHIVES, serve_fixtures
+from preprocessing._categorical import to_categorical
+from preprocessing._intermediate import intermediate_path, read_intermediate_table
+from preprocessing._output import write_output, write_output_batches
+from preprocessing._schema import CATEGORICAL_COLUMNS
+from preprocessing._stack import iter_stacked_batches, read_stacked
+from preprocessing._utils import postprocess_stacked_df
+from preprocessing.process_branded import process_branded
+from preprocessing.process_foundation import process_foundation
+from preprocessing.process_srlegacy import process_srlegacy
+
+# Foods per partition, so the 4000 branded foods of the fixtures are split into 8 partitions, each with a brand
+# owner of its own (see fdc_fixtures.branded_food_table)
+PARTITION_SIZE = 500
+
+
+@pytest.fixture(scope='module')
+def urls(fixture_archives):
+    with serve_fixtures(os.path.dirname(fixture_archives['full'])) as urls:
+        yield dict(zip(FIXTURE_ARCHIVES, urls))
+
+
+@pytest.fixture
+def branded_url(urls):
+    return urls['branded']
+
+
+def run_branded(url, tmp_path, intermediate_format, streaming):
+    """
+    Run process_branded on the served branded fixture archive, and get its processed file.
+    """
+    output_dir = str(tmp_path / ('streaming' if streaming else 'in_memory'))
+    os.makedirs(output_dir)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_branded(url, output_dir, os.path.join(output_dir, 'raw'), cache_dir=str(tmp_path / 'cache'),
+                        streaming=streaming, partition_size=PARTITION_SIZE, intermediate_format=intermediate_format)
+
+    return intermediate_path(output_dir, 'branded', intermediate_format)
+
+
+@pytest.mark.parametrize('intermediate_format', ['parquet', 'feather'])
+def test_streaming_matches_in_memory(branded_url, tmp_path, intermediate_format):
+    expected = read_intermediate_table(run_branded(branded_url, tmp_path, intermediate_format, False)).to_pandas()
+    df = read_intermediate_table(run_branded(branded_url, tmp_path, intermediate_format, True)).to_pandas()
+
+    # The partitions have different brand owners, which every partition writes as categories of its own
+    assert df['brand_owner'].nunique() > 5
+
+    # Every partition is a row group of the Parquet file, whose categories are in order of appearance
+    pd.testing.assert_frame_equal(to_categorical(df, CATEGORICAL_COLUMNS), expected)
+
+
+@pytest.mark.parametrize('intermediate_format', ['parquet', 'feather'])
+def test_streaming_final_output_is_identical(urls, tmp_path, intermediate_format):
+    # The foundation and SR Legacy files, which are processed the same way in either mode, are stacked too
+    output_dir = str(tmp_path / 'other')
+    os.makedirs(output_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_foundation([urls['foundation'], urls['full']], output_dir, os.path.join(output_dir, 'raw'),
+                           cache_dir=str(tmp_path / 'cache'), intermediate_format=intermediate_format)
+        process_srlegacy(urls['sr_legacy'], output_dir, os.path.join(output_dir, 'raw'),
+                         cache_dir=str(tmp_path / 'cache'), intermediate_format=intermediate_format)
+    other_paths = [intermediate_path(output_dir, name, intermediate_format) for name in ['foundation', 'srlegacy']]
+
+    # Stacked and postprocessed like main.py does in either mode
+    in_memory_path = str(tmp_path / 'in_memory.csv')
+    paths = other_paths + [run_branded(urls['branded'], tmp_path, intermediate_format, False)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        write_output(postprocess_stacked_df(read_stacked(paths)), in_memory_path)
+
+    streaming_path = str(tmp_path / 'streaming.csv')
+    paths = other_paths + [run_branded(urls['branded'], tmp_path, intermediate_format, True)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        write_output_batches(iter_stacked_batches(paths, batch_size=1_000), streaming_path)
+
+    with open(in_memory_path, 'rb') as expected, open(streaming_path, 'rb') as f:
+        assert f.read() == expected.read()